@@ -2,12 +2,14 @@
 # Such as the Indexer and MACI databases
 # Also grant access to SELECT on all tables in the experimental_views schema
 
-import pandas as pd
 import psycopg2 as pg
 from psycopg2 import sql
 import logging
 import os
 
+from db_utils import read_query
+from update_foreign_schema import INDEXER_CONFIG, MACI_CONFIG
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -15,11 +17,7 @@ def run_query(query, db_params):
     """Run a query and return the results as a DataFrame."""
     try:
         with pg.connect(**db_params) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query)
-                col_names = [desc[0] for desc in cur.description]
-                results = pd.DataFrame(cur.fetchall(), columns=col_names)
-                return results
+            return read_query(conn, query)
     except pg.Error as e:
         logger.error(f"ERROR: Could not execute the query. {e}")
         return None
@@ -35,12 +33,13 @@ def execute_command(command, db_params):
     except pg.Error as e:
         logger.error(f"ERROR: Could not execute the command. {e}")
 
-def create_server(server_name, host, dbname, port, DB_PARAMS):
-    """Create a new server connection"""
+def create_server(server_name, host, dbname, port, DB_PARAMS, options=None):
+    """Create a new server connection, with optional postgres_fdw options such as fetch_size"""
+    server_options = ''.join(f", {key} '{value}'" for key, value in (options or {}).items())
     create_server_query = f"""
     CREATE SERVER {server_name}
     FOREIGN DATA WRAPPER postgres_fdw
-    OPTIONS (host '{host}', dbname '{dbname}', port '{port}');
+    OPTIONS (host '{host}', dbname '{dbname}', port '{port}'{server_options});
     """
     execute_command(create_server_query, DB_PARAMS)
 
@@ -106,8 +105,8 @@ def main():
     USERS = os.getenv('DB_FDW_USERS').strip('[]').replace("'", "").split(', ')
     
     # Create server connections
-    create_server('indexer', INDEXER_DB_PARAMS['host'], INDEXER_DB_PARAMS['dbname'], INDEXER_DB_PARAMS['port'], DB_PARAMS)
-    create_server('maci', MACI_DB_PARAMS['host'], MACI_DB_PARAMS['dbname'], MACI_DB_PARAMS['port'], DB_PARAMS)
+    create_server('indexer', INDEXER_DB_PARAMS['host'], INDEXER_DB_PARAMS['dbname'], INDEXER_DB_PARAMS['port'], DB_PARAMS, INDEXER_CONFIG.server_options)
+    create_server('maci', MACI_DB_PARAMS['host'], MACI_DB_PARAMS['dbname'], MACI_DB_PARAMS['port'], DB_PARAMS, MACI_CONFIG.server_options)
 
     # Create user mappings
     for user in USERS:
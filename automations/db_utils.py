@@ -1,8 +1,41 @@
 ## TO DO: IMPORT INTO ALL AUTOMATIONS AND SCRIPTS
 
 import pandas as pd
+import io
+import json
 import logging
+import os
+import uuid
+from typing import Dict, Iterator, List, Optional, Tuple
+
 import psycopg2 as pg
+import pyarrow as pa
+
+# Rows per chunk read from a server-side cursor
+READ_CHUNK_ROWS = int(os.environ.get('READ_CHUNK_ROWS', 50000))
+
+# Rows serialized and sent per COPY chunk
+COPY_CHUNK_ROWS = int(os.environ.get('COPY_CHUNK_ROWS', 50000))
+
+NULL_MARKER = '\\N'
+
+# pandas (with nullable_dtypes) and Arrow types of the postgres types (by type OID) that have an exact counterpart;
+# numeric stays Decimal objects in pandas and becomes text in Arrow, everything else is left as psycopg2 returns it
+PG_TYPES = {
+    16: ('boolean', pa.bool_()),  # bool
+    20: ('Int64', pa.int64()),  # int8
+    21: ('Int64', pa.int64()),  # int2
+    23: ('Int64', pa.int64()),  # int4
+    25: (object, pa.string()),  # text
+    700: ('float64', pa.float64()),  # float4
+    701: ('float64', pa.float64()),  # float8
+    1042: (object, pa.string()),  # bpchar
+    1043: (object, pa.string()),  # varchar
+    1082: (object, pa.date32()),  # date
+    1114: ('datetime64[ns]', pa.timestamp('us')),  # timestamp
+    1184: ('datetime64[ns, UTC]', pa.timestamp('us', tz='UTC')),  # timestamptz
+    1700: (object, pa.string()),  # numeric
+}
 
 def setup_logging():
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -30,17 +63,163 @@ def execute_command(command, DB_PARAMS, logger=None):
         if connection:
             connection.close()
 
+def chunk_to_dataframe(rows: List[tuple], description, nullable_dtypes: bool = False) -> pd.DataFrame:
+    """Build a DataFrame from fetched rows.
+
+    By default pandas infers the dtypes, as the fetchall() based run_query
+    helpers did: integer columns with NULLs become float, boolean columns
+    with NULLs object. Concatenating such chunks gives the dtypes inferring
+    over the whole result would have given.
+
+    With nullable_dtypes, every column is typed by its postgres type
+    instead, so the dtype never depends on the values of a chunk; integer
+    columns with NULLs become nullable Int64 and booleans nullable boolean.
+    """
+    if not nullable_dtypes:
+        return pd.DataFrame(rows, columns=[column.name for column in description])
+    columns = list(zip(*rows)) if rows else [()] * len(description)
+    data = {}
+    for column, values in zip(description, columns):
+        dtype = PG_TYPES.get(column.type_code, (object, None))[0]
+        if str(dtype).startswith('datetime64'):
+            try:
+                data[column.name] = pd.to_datetime(pd.Series(values, dtype=object), utc=dtype.endswith('UTC]'))
+                continue
+            except (pd.errors.OutOfBoundsDatetime, OverflowError, ValueError):
+                # e.g. 'infinity' or year 1; keep the datetime objects
+                dtype = object
+        data[column.name] = pd.Series(pd.array(list(values), dtype=dtype), dtype=dtype)
+    return pd.DataFrame(data)
+
+
+def arrow_schema(description) -> pa.Schema:
+    """Return the Arrow schema of a query's columns; types without an exact counterpart become text."""
+    return pa.schema([(column.name, PG_TYPES.get(column.type_code, (object, pa.string()))[1]) for column in description])
+
+
+def fetch_chunks(connection, query: str, params=None, chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[Tuple[List[tuple], tuple]]:
+    """Run a query on a named server-side cursor and yield its rows chunk_rows at a time, with the cursor description.
+
+    Only one chunk is held on the client at a time. The cursor lives in
+    the connection's current transaction, which is left open.
+    """
+    with connection.cursor(name=f"read_{uuid.uuid4().hex[:12]}") as cursor:
+        cursor.itersize = chunk_rows
+        # The query becomes part of a DECLARE statement
+        cursor.execute(query.strip().rstrip(';'), params)
+        rows = cursor.fetchmany(chunk_rows)
+        # A named cursor has no description until the first fetch
+        description = cursor.description
+        yield rows, description
+        while len(rows) == chunk_rows:
+            rows = cursor.fetchmany(chunk_rows)
+            if rows:
+                yield rows, description
+
+
+def iter_query(
+    connection,
+    query: str,
+    params=None,
+    chunk_rows: int = READ_CHUNK_ROWS,
+    nullable_dtypes: bool = False
+) -> Iterator[pd.DataFrame]:
+    """Yield the results of a query as DataFrames of at most chunk_rows rows, see chunk_to_dataframe.
+
+    The first chunk is yielded even if it is empty, so the columns are
+    always known.
+    """
+    for rows, description in fetch_chunks(connection, query, params, chunk_rows):
+        yield chunk_to_dataframe(rows, description, nullable_dtypes)
+
+
+def iter_query_batches(connection, query: str, params=None, chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[pa.RecordBatch]:
+    """Yield the results of a query as Arrow record batches with one schema, taken from the column types."""
+    schema = None
+    for rows, description in fetch_chunks(connection, query, params, chunk_rows):
+        if schema is None:
+            schema = arrow_schema(description)
+        arrays = []
+        for field, values in zip(schema, zip(*rows) if rows else [()] * len(schema)):
+            values = list(values)
+            if pa.types.is_string(field.type):
+                values = [
+                    value if value is None or isinstance(value, str)
+                    else json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+                    for value in values
+                ]
+            arrays.append(pa.array(values, type=field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def read_query(
+    connection,
+    query: str,
+    params=None,
+    chunk_rows: int = READ_CHUNK_ROWS,
+    nullable_dtypes: bool = False
+) -> pd.DataFrame:
+    """Return the results of a query as one DataFrame, read in chunks from a server-side cursor."""
+    chunks = list(iter_query(connection, query, params, chunk_rows, nullable_dtypes))
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def infer_column_type(series: pd.Series) -> str:
+    """Return the PostgreSQL type of a column that has no declared type."""
+    kind = series.dtype.kind
+    if kind in 'iu':
+        return 'bigint'
+    if kind == 'f':
+        return 'double precision'
+    if kind == 'b':
+        return 'boolean'
+    if kind == 'M':
+        return 'timestamp with time zone'
+    return 'text'
+
+
+def get_column_types(df: pd.DataFrame, column_types: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Return column -> type for every column of df, in column order."""
+    column_types = column_types or {}
+    return {column: column_types.get(column) or infer_column_type(df[column]) for column in df.columns}
+
+
+def copy_dataframe(connection, df: pd.DataFrame, table: str, chunk_rows: int = COPY_CHUNK_ROWS) -> None:
+    """Append the rows of df to a table with COPY FROM STDIN, chunk_rows rows at a time.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    column_list = ', '.join(f'"{column}"' for column in df.columns)
+    copy_command = f"COPY {table} ({column_list}) FROM STDIN (FORMAT csv, NULL '{NULL_MARKER}')"
+    with connection.cursor() as cursor:
+        for start in range(0, len(df), chunk_rows):
+            buffer = io.StringIO()
+            df.iloc[start:start + chunk_rows].to_csv(buffer, index=False, header=False, na_rep=NULL_MARKER)
+            buffer.seek(0)
+            cursor.copy_expert(copy_command, buffer)
+
+
+def get_store_columns(connection, store: str) -> List[Tuple[str, str]]:
+    """Return (column, type) of the store table in column order, or [] if it does not exist."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+        """, (store,))
+        return cursor.fetchall()
+
+
 def run_query(query, db_params, logger=None):
     """Run a query and return the results as a DataFrame."""
     if logger is None:
         logger = setup_logging()
     try:
         with pg.connect(**db_params) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query)
-                col_names = [desc[0] for desc in cur.description]
-                results = pd.DataFrame(cur.fetchall(), columns=col_names)
-                return results
+            return read_query(conn, query)
     except pg.Error as e:
         logger.error(f"ERROR: Could not execute the query. {e}")
         return None
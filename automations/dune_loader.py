@@ -0,0 +1,333 @@
+"""Load Dune query results into the Grants database with COPY.
+
+The rows of a Dune result are streamed into a typed store table with
+COPY FROM STDIN, DUNE_COPY_CHUNK_ROWS rows at a time, so neither the client
+nor the server ever holds the whole result as SQL text. The materialized
+view is then created from the store on the server.
+
+The store is persistent and keyed by event_signature. A full reload
+truncates and reloads it in place; an incremental run only fetches the
+rows after the last ingested tx_timestamp and upserts them. The live view
+keeps its own copy of the rows, so it is not affected until the new view
+is swapped in. A store whose columns no longer match is renamed to
+{store}_old on a full reload, which the caller drops once the views
+reading it are gone.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from db_utils import copy_dataframe, get_column_types, get_store_columns
+from dune_results import download_result, read_cached_result
+
+logger = logging.getLogger(__name__)
+
+# Rows serialized and sent per COPY chunk
+DUNE_COPY_CHUNK_ROWS = int(os.environ.get('DUNE_COPY_CHUNK_ROWS', 50000))
+
+# Last execution, tx_timestamp and row_number ingested from each Dune query
+DUNE_STATE_TABLE = 'public.dune_ingestion_state'
+
+# Column types of the leaderboard events, matching the types the VALUES
+# literal used to produce. tx_timestamp stays text: it is part of the view's
+# unique key and is cast by the queries reading it.
+LEADERBOARD_COLUMN_TYPES = {
+    'blockchain': 'text',
+    'tx_timestamp': 'text',
+    'tx_hash': 'text',
+    'address': 'text',
+    'strategy_name': 'text',
+    'role': 'text',
+    'gmv': 'numeric',
+    'row_number': 'integer',
+    'event_signature': 'text'
+}
+
+# Columns hashed into event_signature, in order
+SIGNATURE_COLUMNS = ['tx_timestamp', 'tx_hash', 'address', 'gmv', 'role', 'row_number']
+
+# Frames with at least this many rows are hashed on SIGNATURE_WORKERS processes
+SIGNATURE_POOL_MIN_ROWS = int(os.environ.get('SIGNATURE_POOL_MIN_ROWS', 500000))
+SIGNATURE_WORKERS = int(os.environ.get('SIGNATURE_WORKERS', os.cpu_count() or 1))
+
+
+def hash_keys(keys: List[str]) -> List[str]:
+    """Return the hex SHA-256 digest of every key."""
+    sha256 = hashlib.sha256
+    return [sha256(key.encode()).hexdigest() for key in keys]
+
+
+def event_signatures(df: pd.DataFrame, workers: Optional[int] = None) -> List[str]:
+    """Return the event_signature of every row of df.
+
+    The key of a row is the str() of each of SIGNATURE_COLUMNS, concatenated.
+    It is built column by column from the columns' Python values, which
+    format exactly like the row-wise f-string the signatures were first
+    computed with, so existing signatures do not change. Frames of at least
+    SIGNATURE_POOL_MIN_ROWS rows are hashed on a pool of worker processes.
+    """
+    columns = [[str(value) for value in df[column].tolist()] for column in SIGNATURE_COLUMNS]
+    keys = [''.join(values) for values in zip(*columns)]
+    del columns
+    workers = workers or SIGNATURE_WORKERS
+    if workers <= 1 or len(keys) < SIGNATURE_POOL_MIN_ROWS:
+        return hash_keys(keys)
+    chunk_size = -(-len(keys) // (workers * 4))
+    chunks = [keys[start:start + chunk_size] for start in range(0, len(keys), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [signature for signatures in executor.map(hash_keys, chunks) for signature in signatures]
+
+
+# dtypes the columns are cast to before hashing, so a page whose gmv values
+# are all whole numbers formats them like a full result does ('5.0', not '5')
+COLUMN_DTYPES = {'numeric': 'float64'}
+
+# Columns that identify an event, without its row_number
+EVENT_COLUMNS = ['tx_timestamp', 'tx_hash', 'address', 'gmv', 'role']
+
+
+def cast_leaderboard_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast the columns with a declared numeric type to the dtype a full result has."""
+    df = df.copy()
+    for column, column_type in LEADERBOARD_COLUMN_TYPES.items():
+        if column in df.columns and column_type in COLUMN_DTYPES:
+            df[column] = pd.to_numeric(df[column]).astype(COLUMN_DTYPES[column_type])
+    return df
+
+
+def drop_ingested_events(connection, df: pd.DataFrame, store: str, last_tx_timestamp: str) -> pd.DataFrame:
+    """Drop the rows of df at last_tx_timestamp that the store already has.
+
+    Incremental fetches include the last ingested tx_timestamp, so events
+    that arrive later with that same timestamp are not lost. The events
+    already stored are matched on EVENT_COLUMNS, as often as they occur:
+    their signature includes the row_number, so the upsert cannot tell a
+    refetched event from a new one.
+    """
+    column_list = ', '.join(f'"{column}"' for column in EVENT_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {column_list} FROM {store} WHERE tx_timestamp = %s", (last_tx_timestamp,))
+        stored = pd.DataFrame(cursor.fetchall(), columns=EVENT_COLUMNS)
+    connection.rollback()
+    if len(stored) == 0:
+        return df
+    stored = cast_leaderboard_columns(stored)
+
+    def occurrence_keys(frame: pd.DataFrame) -> pd.Series:
+        keys = pd.Series(
+            ['\x1f'.join(values) for values in zip(*(
+                frame[column].map(lambda value: '' if pd.isna(value) else str(value)).tolist() for column in EVENT_COLUMNS
+            ))],
+            index=frame.index
+        )
+        # The n-th copy of an event only matches the n-th stored copy
+        return keys + '#' + keys.groupby(keys).cumcount().astype(str)
+
+    ingested = occurrence_keys(df).isin(set(occurrence_keys(stored)))
+    logger.info(f"Skipping {int(ingested.sum())} rows at {last_tx_timestamp} that were ingested before")
+    return df[~ingested]
+
+
+def prepare_leaderboard_events(query_result_df: pd.DataFrame, first_row_number: int = 1) -> pd.DataFrame:
+    """Sort the leaderboard events and add their row_number and event_signature columns."""
+    query_result_df = cast_leaderboard_columns(query_result_df)
+    query_result_df = query_result_df.sort_values(by=['tx_timestamp', 'role', 'address', 'gmv'])
+    query_result_df['row_number'] = range(first_row_number, first_row_number + len(query_result_df))
+    query_result_df['event_signature'] = event_signatures(query_result_df)
+    return query_result_df
+
+
+def load_store(
+    connection,
+    df: pd.DataFrame,
+    store: str,
+    column_types: Optional[Dict[str, str]] = None,
+    key: Optional[str] = None,
+    upsert: bool = False,
+    state: Optional[dict] = None,
+    chunk_rows: int = DUNE_COPY_CHUNK_ROWS
+) -> None:
+    """Write the rows of df to the store table (schema.name) in one transaction.
+
+    Args:
+        column_types: Column -> type; other columns get a type inferred from their dtype
+        key: Column with a unique index, which upserts are matched on
+        upsert: If True, the rows are copied into a temporary table and
+            upserted on key; otherwise the store is truncated and reloaded
+        state: Ingestion state saved in the same transaction, see save_ingestion_state
+    """
+    schema, name = store.split('.', 1)
+    types = get_column_types(df, column_types)
+    try:
+        existing = get_store_columns(connection, store)
+        with connection.cursor() as cursor:
+            if existing and existing != list(types.items()):
+                if upsert:
+                    raise ValueError(f"Columns of {store} changed, it has to be reloaded in full")
+                logger.info(f"Columns of {store} changed, replacing it")
+                cursor.execute(f"""
+                DROP TABLE IF EXISTS {store}_old CASCADE;
+                ALTER TABLE {store} RENAME TO {name}_old;
+                """)
+            columns_sql = ', '.join(f'"{column}" {column_type}' for column, column_type in types.items())
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {store} ({columns_sql});")
+            if key:
+                cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {name}_{key}_key ON {store} ("{key}");')
+            if upsert:
+                staging = f"{name}_upsert"
+                cursor.execute(f"CREATE TEMPORARY TABLE {staging} (LIKE {store}) ON COMMIT DROP;")
+            else:
+                staging = store
+                cursor.execute(f"TRUNCATE {store};")
+        logger.info(f"Copying {len(df)} rows into {staging} in chunks of {chunk_rows}")
+        copy_dataframe(connection, df, staging, chunk_rows)
+        with connection.cursor() as cursor:
+            if upsert:
+                column_list = ', '.join(f'"{column}"' for column in types)
+                update_columns = ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in types if column != key)
+                cursor.execute(f"""
+                INSERT INTO {store} ({column_list})
+                SELECT {column_list} FROM {staging}
+                ON CONFLICT ("{key}") DO UPDATE SET {update_columns};
+                """)
+            if state is not None:
+                save_ingestion_state(cursor, **state)
+            cursor.execute(f"ANALYZE {store}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def ensure_state_table(connection) -> None:
+    """Create the ingestion state table if it is missing."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DUNE_STATE_TABLE} (
+            query_id bigint PRIMARY KEY,
+            execution_id text,
+            last_tx_timestamp text,
+            last_row_number bigint NOT NULL,
+            ingested_at timestamptz NOT NULL DEFAULT now()
+        );
+        """)
+    connection.commit()
+
+
+def get_ingestion_state(connection, query_id: int) -> Optional[dict]:
+    """Return the execution id, last tx_timestamp and last row_number ingested from a query, if any."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT execution_id, last_tx_timestamp, last_row_number FROM {DUNE_STATE_TABLE} WHERE query_id = %s",
+            (query_id,)
+        )
+        row = cursor.fetchone()
+    connection.rollback()
+    if row is None:
+        return None
+    return {'execution_id': row[0], 'last_tx_timestamp': row[1], 'last_row_number': row[2]}
+
+
+def save_ingestion_state(
+    cursor,
+    query_id: int,
+    execution_id: Optional[str],
+    last_tx_timestamp: Optional[str],
+    last_row_number: int
+) -> None:
+    cursor.execute(f"""
+    INSERT INTO {DUNE_STATE_TABLE} (query_id, execution_id, last_tx_timestamp, last_row_number, ingested_at)
+    VALUES (%s, %s, %s, %s, now())
+    ON CONFLICT (query_id) DO UPDATE
+    SET execution_id = EXCLUDED.execution_id, last_tx_timestamp = EXCLUDED.last_tx_timestamp,
+        last_row_number = EXCLUDED.last_row_number, ingested_at = EXCLUDED.ingested_at
+    """, (query_id, execution_id, last_tx_timestamp, last_row_number))
+
+
+def fetch_latest_result(dune_api_key: str, query_id: int, since: Optional[str] = None) -> Tuple[pd.DataFrame, str]:
+    """Return the rows of the latest execution of a query and its execution id.
+
+    The rows are downloaded page by page into the local parquet cache, or
+    read from it if that execution was downloaded before. If since is
+    given, Dune filters the rows to those with the same or a later
+    tx_timestamp before sending them.
+    """
+    filters = None
+    if since is not None:
+        filters = f"tx_timestamp >= '{since.replace(chr(39), chr(39) * 2)}'"
+    execution_id, path = download_result(dune_api_key, query_id, filters)
+    return read_cached_result(path), execution_id
+
+
+def ingest_leaderboard_events(
+    connection,
+    dune_api_key: str,
+    query_id: int,
+    store: str,
+    full_refresh: bool = False
+) -> int:
+    """Bring the leaderboard store up to date with the latest result of a Dune query.
+
+    The first run, and any run with full_refresh, loads the whole result.
+    Later runs fetch only the rows with the last ingested tx_timestamp or a
+    later one, drop the ones at that timestamp the store already has, and
+    upsert the rest by event_signature. The events are numbered in
+    tx_timestamp order, so the new events continue the row_number sequence.
+    They get the same signatures a full reload would give them, unless Dune
+    delivers an event older than the last ingested one, which is skipped
+    until the next full refresh, or a late event at the last ingested
+    timestamp, which a full reload may number differently.
+
+    Returns the number of rows written.
+    """
+    ensure_state_table(connection)
+    state = get_ingestion_state(connection, query_id)
+    incremental = not full_refresh and state is not None and bool(get_store_columns(connection, store))
+    connection.rollback()
+
+    if incremental:
+        logger.info(f"Fetching Dune rows of query {query_id} from {state['last_tx_timestamp']}")
+        df, execution_id = fetch_latest_result(dune_api_key, query_id, since=state['last_tx_timestamp'])
+        if len(df):
+            df = drop_ingested_events(connection, cast_leaderboard_columns(df), store, state['last_tx_timestamp'])
+        if len(df) == 0:
+            logger.info(f"No new Dune rows in execution {execution_id}")
+            with connection.cursor() as cursor:
+                save_ingestion_state(
+                    cursor, query_id, execution_id, state['last_tx_timestamp'], state['last_row_number']
+                )
+            connection.commit()
+            return 0
+        df = prepare_leaderboard_events(df, first_row_number=state['last_row_number'] + 1)
+        if list(get_column_types(df, LEADERBOARD_COLUMN_TYPES).items()) == get_store_columns(connection, store):
+            load_store(
+                connection, df, store, LEADERBOARD_COLUMN_TYPES, key='event_signature', upsert=True,
+                state={
+                    'query_id': query_id, 'execution_id': execution_id,
+                    'last_tx_timestamp': df['tx_timestamp'].max(),
+                    'last_row_number': state['last_row_number'] + len(df)
+                }
+            )
+            logger.info(f"Upserted {len(df)} new Dune rows into {store}")
+            return len(df)
+        connection.rollback()
+        logger.warning(f"Columns of Dune query {query_id} changed, reloading {store} in full")
+
+    logger.info(f"Fetching the full result of Dune query {query_id}")
+    df, execution_id = fetch_latest_result(dune_api_key, query_id)
+    if len(df) == 0:
+        raise ValueError("Empty result set from Dune")
+    df = prepare_leaderboard_events(df)
+    load_store(
+        connection, df, store, LEADERBOARD_COLUMN_TYPES, key='event_signature',
+        state={
+            'query_id': query_id, 'execution_id': execution_id,
+            'last_tx_timestamp': df['tx_timestamp'].max(), 'last_row_number': len(df)
+        }
+    )
+    logger.info(f"Loaded {len(df)} Dune rows into {store}")
+    return len(df)
@@ -0,0 +1,137 @@
+"""Paginated download of Dune query results into a local parquet cache.
+
+The results of an execution are fetched from the Dune API in pages of
+DUNE_BATCH_SIZE rows, and every page is written to its own parquet file
+as soon as it arrives, so the download never holds more than one page in
+memory. The files are kept under DUNE_CACHE_DIR, keyed by query,
+execution id and filters. A run whose latest execution is already cached
+downloads nothing.
+
+DUNE_API_URL can point at a stand-in for the API, such as
+scripts/dune_api_stub.py.
+"""
+import hashlib
+import logging
+import os
+import shutil
+from typing import Iterator, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+logger = logging.getLogger(__name__)
+
+DUNE_API_URL = os.environ.get('DUNE_API_URL', 'https://api.dune.com/api/v1')
+
+# Directory the downloaded results are cached in
+DUNE_CACHE_DIR = os.environ.get('DUNE_CACHE_DIR', '.dune_cache')
+
+# Rows per page fetched from the Dune results API
+DUNE_BATCH_SIZE = int(os.environ.get('DUNE_BATCH_SIZE', 10000))
+
+# Written once every page of an execution is cached
+COMPLETE_MARKER = '_COMPLETE'
+
+
+def get_latest_execution_id(dune_api_key: str, query_id: int) -> Optional[str]:
+    """Return the id of the latest Dune execution of a query without downloading its rows."""
+    response = requests.get(
+        f"{DUNE_API_URL}/query/{query_id}/results",
+        params={'limit': 1},
+        headers={'X-Dune-API-Key': dune_api_key},
+        timeout=60
+    )
+    response.raise_for_status()
+    return response.json().get('execution_id')
+
+
+def iter_result_pages(
+    dune_api_key: str,
+    execution_id: str,
+    filters: Optional[str] = None,
+    batch_size: int = DUNE_BATCH_SIZE
+) -> Iterator[list]:
+    """Yield the rows of an execution one page at a time, following next_uri."""
+    params = {'limit': batch_size}
+    if filters:
+        params['filters'] = filters
+    url = f"{DUNE_API_URL}/execution/{execution_id}/results"
+    while url:
+        response = requests.get(url, params=params, headers={'X-Dune-API-Key': dune_api_key}, timeout=300)
+        response.raise_for_status()
+        page = response.json()
+        yield page.get('result', {}).get('rows', [])
+        url = page.get('next_uri')
+        # next_uri already carries the offset, limit and filters
+        params = None
+
+
+def get_cache_path(query_id: int, execution_id: str, filters: Optional[str] = None) -> str:
+    """Return the cache directory of an execution's results under the given filters."""
+    name = execution_id
+    if filters:
+        name += '_' + hashlib.sha256(filters.encode()).hexdigest()[:12]
+    return os.path.join(DUNE_CACHE_DIR, f"query_{query_id}", name)
+
+
+def download_result(
+    dune_api_key: str,
+    query_id: int,
+    filters: Optional[str] = None,
+    batch_size: int = DUNE_BATCH_SIZE
+) -> Tuple[str, str]:
+    """Cache the latest result of a query and return its execution id and cache directory.
+
+    Nothing is downloaded if that execution is already cached. Older
+    executions of the query are removed from the cache.
+    """
+    execution_id = get_latest_execution_id(dune_api_key, query_id)
+    if execution_id is None:
+        raise ValueError(f"Dune query {query_id} has no execution")
+    path = get_cache_path(query_id, execution_id, filters)
+    if os.path.exists(os.path.join(path, COMPLETE_MARKER)):
+        logger.info(f"Execution {execution_id} of Dune query {query_id} is already cached in {path}")
+        return execution_id, path
+
+    partial_path = f"{path}.partial"
+    shutil.rmtree(partial_path, ignore_errors=True)
+    os.makedirs(partial_path)
+    rows = 0
+    for number, page in enumerate(iter_result_pages(dune_api_key, execution_id, filters, batch_size)):
+        if not page:
+            continue
+        table = pa.Table.from_pandas(pd.DataFrame(page), preserve_index=False)
+        pq.write_table(table, os.path.join(partial_path, f"part-{number:05d}.parquet"))
+        rows += len(page)
+    open(os.path.join(partial_path, COMPLETE_MARKER), 'w').close()
+
+    # Keep only the execution that was just downloaded
+    query_dir = os.path.dirname(path)
+    for entry in os.listdir(query_dir):
+        if entry != os.path.basename(partial_path):
+            shutil.rmtree(os.path.join(query_dir, entry), ignore_errors=True)
+    os.rename(partial_path, path)
+    logger.info(f"Cached {rows} rows of execution {execution_id} of Dune query {query_id} in {path}")
+    return execution_id, path
+
+
+def iter_cached_batches(path: str, columns: Optional[list] = None) -> Iterator[pd.DataFrame]:
+    """Yield the cached pages of an execution as DataFrames, in order."""
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.parquet'):
+            yield pq.read_table(os.path.join(path, name), columns=columns).to_pandas()
+
+
+def read_cached_result(path: str) -> pd.DataFrame:
+    """Return all cached rows of an execution as one DataFrame.
+
+    The pages are combined with the dtypes a DataFrame of all rows would
+    have had, e.g. a page of integer gmv values among float pages becomes
+    float, and a page with only NULL addresses becomes None values.
+    """
+    batches = list(iter_cached_batches(path))
+    if not batches:
+        return pd.DataFrame()
+    return pd.concat(batches, ignore_index=True).infer_objects()
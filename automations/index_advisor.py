@@ -0,0 +1,187 @@
+"""Suggest secondary indexes for the materialized views from the recorded workload.
+
+Reads pg_stat_statements, finds the statements that query a managed view and
+the view columns they filter on - "col = ...", "col IN (...)", range
+comparisons and "LOWER(col) = ..." - and weights every column by the total
+execution time of the statements that filter on it. Columns that are not
+yet covered by a declared index are printed as secondary_indexes entries
+for BASE_MATVIEWS or DEPENDENT_MATVIEWS. Range filters on timestamp columns
+are suggested as BRIN indexes, since the views are built in time order.
+
+Usage:
+    python automations/index_advisor.py --min-calls 50 --limit 10
+
+Requires the pg_stat_statements extension. Nothing is created; review the
+suggestions and add them to the view configuration.
+"""
+import argparse
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2
+
+from refresh_report import has_pg_stat_statements
+from sql_dependencies import find_relation_references, tokenize
+from update_materialized_views import (
+    BASE_MATVIEWS, DEPENDENT_MATVIEWS, get_connection, get_index_specs, get_view_schema
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Statements that define or maintain the views rather than query them
+MAINTENANCE_PREFIXES = ('alter', 'analyze', 'create', 'drop', 'explain', 'refresh', 'vacuum')
+
+RANGE_OPERATORS = {'<', '>', 'between'}
+FILTER_OPERATORS = RANGE_OPERATORS | {'=', 'in', 'like', 'ilike', 'is'}
+
+TIMESTAMP_TYPES = ('timestamp', 'date')
+
+
+def get_statements(connection, min_calls: int) -> List[Tuple[str, int, float]]:
+    """Return (query, calls, total milliseconds) for this database's statements."""
+    for time_column in ('total_exec_time', 'total_time'):  # total_time before PostgreSQL 13
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"""
+                SELECT query, calls, {time_column}
+                FROM pg_stat_statements
+                WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                AND calls >= %s
+                """, (min_calls,))
+                statements = cursor.fetchall()
+            connection.rollback()
+            return statements
+        except psycopg2.errors.UndefinedColumn:
+            connection.rollback()
+    return []
+
+
+def get_column_types(connection, schema: str, name: str) -> Dict[str, str]:
+    """Return column name -> type name for a view."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        """, (f"{schema}.{name}",))
+        column_types = dict(cursor.fetchall())
+    connection.rollback()
+    return column_types
+
+
+def find_filters(sql: str) -> List[Tuple[Optional[str], str, bool, str]]:
+    """Return (qualifier, column, lowered, operator) for every filter-like comparison in a query."""
+    tokens = tokenize(sql)
+    filters = []
+    for i, token in enumerate(tokens):
+        if token.kind not in ('word', 'quoted_identifier'):
+            continue
+        lowered = (
+            i >= 2 and tokens[i - 1].text == '(' and tokens[i - 2].text.lower() == 'lower'
+        ) or (
+            i >= 4 and tokens[i - 1].text == '.' and tokens[i - 3].text == '(' and tokens[i - 4].text.lower() == 'lower'
+        )
+        qualifier = tokens[i - 2].value if i >= 2 and tokens[i - 1].text == '.' else None
+        j = i + 1
+        if lowered:
+            if j >= len(tokens) or tokens[j].text != ')':
+                continue
+            j += 1
+        if j < len(tokens) and tokens[j].text == '.':
+            continue  # a qualifier, not a column
+        if j < len(tokens) and tokens[j].text.lower() == 'not':
+            j += 1
+        if j >= len(tokens) or tokens[j].text.lower() not in FILTER_OPERATORS:
+            continue
+        filters.append((qualifier, token.value, lowered, tokens[j].text.lower()))
+    return filters
+
+
+def is_covered(column: str, lowered: bool, brin: bool, specs: List[dict]) -> bool:
+    """Return True if a declared index can already serve filters on a column."""
+    for spec in specs:
+        if brin and spec.get('method') != 'brin':
+            continue
+        if lowered:
+            if spec.get('expression', '').replace(' ', '').lower() == f"lower({column})":
+                return True
+        elif spec.get('columns', [None])[0] == column and spec.get('method', 'btree') in ('btree', 'brin'):
+            return True
+    return False
+
+
+def advise(connection, min_calls: int = 10) -> Dict[str, List[dict]]:
+    """Return the suggested secondary_indexes for each managed view, heaviest first."""
+    views = {**BASE_MATVIEWS, **DEPENDENT_MATVIEWS}
+    column_types = {matview: get_column_types(connection, get_view_schema(matview), matview) for matview in views}
+    weights = defaultdict(lambda: [0.0, 0])
+
+    for query, calls, total_ms in get_statements(connection, min_calls):
+        if query.lstrip().lower().startswith(MAINTENANCE_PREFIXES):
+            continue
+        references = [
+            reference for reference in find_relation_references(query)
+            if reference.name in views and reference.schema in (None, get_view_schema(reference.name))
+        ]
+        if not references:
+            continue
+        for qualifier, column, lowered, operator in find_filters(query):
+            if qualifier is not None:
+                candidates = [r.name for r in references if qualifier in (r.alias, r.name)]
+            else:
+                candidates = [r.name for r in references if column in column_types[r.name]]
+                # An unqualified column is ambiguous if several views have it
+                candidates = candidates if len(candidates) == 1 else []
+            for matview in candidates:
+                column_type = column_types[matview].get(column)
+                if column_type is None:
+                    continue
+                brin = operator in RANGE_OPERATORS and not lowered and column_type.startswith(TIMESTAMP_TYPES)
+                weight = weights[(matview, column, lowered, brin)]
+                weight[0] += total_ms
+                weight[1] += calls
+
+    suggestions = defaultdict(list)
+    for (matview, column, lowered, brin), (total_ms, calls) in sorted(weights.items(), key=lambda item: -item[1][0]):
+        if is_covered(column, lowered, brin, get_index_specs(views[matview])):
+            continue
+        if lowered:
+            spec = {'expression': f"LOWER({column})"}
+        elif brin:
+            spec = {'columns': [column], 'method': 'brin'}
+        else:
+            spec = {'columns': [column]}
+        suggestions[matview].append({'spec': spec, 'total_ms': total_ms, 'calls': calls})
+    return dict(suggestions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggest secondary indexes for the materialized views.")
+    parser.add_argument('--min-calls', type=int, default=10, help="Ignore statements called fewer times")
+    parser.add_argument('--limit', type=int, default=5, help="Suggestions per view")
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        if not has_pg_stat_statements(connection):
+            logger.error("pg_stat_statements is not available in this database")
+            return
+        suggestions = advise(connection, args.min_calls)
+    finally:
+        connection.close()
+
+    if not suggestions:
+        logger.info("All filtered view columns are covered by declared indexes")
+        return
+    for matview, entries in suggestions.items():
+        print(f"# {matview}")
+        print("'secondary_indexes': [")
+        for entry in entries[:args.limit]:
+            print(f"    {entry['spec']!r},  # {entry['total_ms'] / 1000:.1f}s over {entry['calls']} calls")
+        print("]")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Validation statistics for materialized views.
+
+collect_view_stats computes everything the refresh validates - row count,
+amount total, null counts and per-chain and per-round breakdowns - in a
+single scan, using GROUPING SETS. When exact numbers are not needed it
+reads the planner's row estimate from pg_class.reltuples instead of
+scanning the view at all.
+"""
+import logging
+import os
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Columns that are broken down by, in nesting order, when the view has them
+BREAKDOWN_COLUMNS = ['chain_id', 'round_id']
+
+# Relative decrease of a round's total that is still not reported, e.g. from rounding
+ROUND_TOTAL_TOLERANCE = float(os.environ.get('ROUND_TOTAL_TOLERANCE', 0.001))
+
+# Rounds named in a breakdown warning; the rest are only counted
+MAX_REPORTED_ROUNDS = 5
+
+
+class ViewStats(NamedTuple):
+    schema: str
+    name: str
+    row_count: int
+    total: Optional[Decimal]
+    null_counts: Dict[str, int]
+    by_chain: Dict[object, Tuple[int, Optional[Decimal]]]
+    by_round: Dict[Tuple[object, object], Tuple[int, Optional[Decimal]]]
+    estimated: bool = False
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.schema}.{self.name}"
+
+
+def get_relation_columns(connection, schema: str, name: str) -> List[str]:
+    """Return the column names of a table or materialized view (information_schema omits matviews)."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT attname
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+        """, (f"{schema}.{name}",))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def estimate_row_count(connection, schema: str, name: str) -> Optional[int]:
+    """Return the planner's row estimate for a relation, analyzing it first if it never was.
+
+    Returns None if the relation does not exist.
+    """
+    query = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)"
+    with connection.cursor() as cursor:
+        cursor.execute(query, (f"{schema}.{name}",))
+        row = cursor.fetchone()
+        if row is None:
+            connection.rollback()
+            return None
+        if row[0] < 0:
+            # Freshly created views have no statistics yet; ANALYZE only samples the view
+            cursor.execute(f"ANALYZE {schema}.{name}")
+            cursor.execute(query, (f"{schema}.{name}",))
+            row = cursor.fetchone()
+    connection.commit()
+    return max(row[0], 0)
+
+
+def collect_view_stats(
+    connection,
+    schema: str,
+    name: str,
+    amount_column: Optional[str] = None,
+    null_columns: Optional[List[str]] = None,
+    exact: bool = True
+) -> Optional[ViewStats]:
+    """Collect validation statistics for a view in a single scan.
+
+    Args:
+        amount_column: Column or expression that is summed, if any
+        null_columns: Columns whose NULL values are counted, in addition to
+            the amount column
+        exact: If False, only estimate the row count from pg_class.reltuples;
+            totals, null counts and breakdowns are left empty
+
+    Returns:
+        The statistics, or None if the view does not exist
+    """
+    columns = get_relation_columns(connection, schema, name)
+    if not columns:
+        return None
+
+    if not exact:
+        return ViewStats(
+            schema, name, estimate_row_count(connection, schema, name),
+            None, {}, {}, {}, estimated=True
+        )
+
+    breakdown = [column for column in BREAKDOWN_COLUMNS if column in columns]
+    # Nest the breakdown columns: (), (chain_id), (chain_id, round_id)
+    grouping_sets = ', '.join(
+        f"({', '.join(breakdown[:depth])})" for depth in range(len(breakdown) + 1)
+    )
+    counted = {column: column for column in (null_columns or []) if column in columns}
+    if amount_column:
+        counted['amount'] = amount_column
+
+    select_list = [
+        f"GROUPING({', '.join(breakdown)})" if breakdown else "0",
+        *breakdown,
+        "COUNT(*)",
+        f"SUM({amount_column})" if amount_column else "NULL",
+        *(f"COUNT(*) - COUNT({expression})" for expression in counted.values())
+    ]
+    query = f"""
+    SELECT {', '.join(select_list)}
+    FROM {schema}.{name}
+    GROUP BY GROUPING SETS ({grouping_sets})
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    connection.rollback()
+
+    row_count, total, null_counts = 0, None, {}
+    by_chain, by_round = {}, {}
+    depth_by_grouping = {
+        # GROUPING() sets one bit per column left out of the grouping set
+        (1 << (len(breakdown) - depth)) - 1: depth for depth in range(len(breakdown) + 1)
+    }
+    for row in rows:
+        grouping, keys = row[0], row[1:1 + len(breakdown)]
+        count, amount = row[1 + len(breakdown)], row[2 + len(breakdown)]
+        if amount_column:
+            amount = amount if amount is not None else Decimal('0')
+        depth = depth_by_grouping[grouping]
+        if depth == 0:
+            row_count, total = count, amount
+            null_counts = dict(zip(counted, row[3 + len(breakdown):]))
+        elif depth == 1:
+            by_chain[keys[0]] = (count, amount)
+        else:
+            by_round[tuple(keys[:2])] = (count, amount)
+
+    return ViewStats(schema, name, row_count, total, null_counts, by_chain, by_round)
+
+
+def describe_rounds(rounds: List[str]) -> str:
+    described = ', '.join(rounds[:MAX_REPORTED_ROUNDS])
+    if len(rounds) > MAX_REPORTED_ROUNDS:
+        described += f" and {len(rounds) - MAX_REPORTED_ROUNDS} more"
+    return described
+
+
+def compare_round_breakdown(
+    matview: str,
+    old: Dict[Tuple[object, object], Tuple[int, Optional[Decimal]]],
+    new: Dict[Tuple[object, object], Tuple[int, Optional[Decimal]]]
+) -> List[str]:
+    """Return warnings for rounds that disappeared or whose total decreased beyond the tolerance."""
+    disappeared, decreased = [], []
+    for (chain_id, round_id), (old_count, old_total) in sorted(old.items(), key=lambda item: str(item[0])):
+        if (chain_id, round_id) not in new:
+            disappeared.append(f"{round_id} on chain {chain_id} ({old_count} rows)")
+            continue
+        new_total = new[(chain_id, round_id)][1]
+        if old_total is None or new_total is None or new_total >= old_total:
+            continue
+        # Totals are Decimal for numeric amounts and float for real ones
+        if float(old_total - new_total) > abs(float(old_total)) * ROUND_TOTAL_TOLERANCE:
+            decreased.append(f"{round_id} on chain {chain_id} ({old_total} -> {new_total})")
+    warnings = []
+    if disappeared:
+        warnings.append(f"{len(disappeared)} rounds disappeared from {matview}: {describe_rounds(disappeared)}")
+    if decreased:
+        warnings.append(f"Total amount for {matview} decreased in {len(decreased)} rounds: {describe_rounds(decreased)}")
+    return warnings
+
+
+def compare_stats(matview: str, old: Optional[ViewStats], new: Optional[ViewStats]) -> List[str]:
+    """Log how a view changed and return warnings about suspicious changes.
+
+    A shrinking total or row count, chains that disappeared or whose total
+    decreased, rounds that disappeared or whose total decreased by more than
+    ROUND_TOTAL_TOLERANCE, and NULL values in key columns are reported as
+    warnings.
+    """
+    warnings = []
+    if new is None:
+        return [f"{matview} does not exist after the refresh"]
+
+    for column, nulls in new.null_counts.items():
+        if column != 'amount' and nulls:
+            warnings.append(f"{matview} has {nulls} NULL values in key column {column}")
+
+    if old is None:
+        approximate = '~' if new.estimated else ''
+        logger.info(f"{matview} built with {approximate}{new.row_count} rows, total {new.total}")
+        for warning in warnings:
+            logger.warning(warning)
+        return warnings
+
+    if old.estimated or new.estimated:
+        # Estimates drift between ANALYZE runs, so a lower estimate is not a warning
+        logger.info(f"Row count for {matview}: ~{old.row_count} -> ~{new.row_count} (estimated)")
+    elif new.row_count < old.row_count:
+        warnings.append(f"Row count for {matview} has decreased: {old.row_count} -> {new.row_count}")
+    else:
+        logger.info(f"Row count for {matview}: {old.row_count} -> {new.row_count}")
+
+    if old.total is not None and new.total is not None:
+        if new.total < old.total:
+            warnings.append(f"Total amount for {matview} has decreased: {old.total} -> {new.total}")
+        elif new.total > old.total:
+            logger.info(f"Total amount for {matview} has increased: {old.total} -> {new.total}")
+        else:
+            logger.info(f"Total amount for {matview} remains unchanged at {new.total}")
+
+    for chain_id, (old_count, old_total) in sorted(old.by_chain.items(), key=lambda item: str(item[0])):
+        if chain_id not in new.by_chain:
+            warnings.append(f"Chain {chain_id} disappeared from {matview} ({old_count} rows)")
+            continue
+        new_total = new.by_chain[chain_id][1]
+        if old_total is not None and new_total is not None and new_total < old_total:
+            warnings.append(f"Total amount for {matview} on chain {chain_id} has decreased: {old_total} -> {new_total}")
+
+    warnings.extend(compare_round_breakdown(matview, old.by_round, new.by_round))
+
+    for warning in warnings:
+        logger.warning(warning)
+    return warnings
@@ -0,0 +1,424 @@
+"""Mirror indexer and MACI tables into local tables with binary COPY.
+
+Instead of scanning the postgres_fdw foreign tables, every mirrored table is
+streamed straight from the source database with
+COPY (SELECT ...) TO STDOUT (FORMAT binary) into a local staging table with
+COPY ... FROM STDIN (FORMAT binary). The two COPYs are connected through an
+OS pipe, so rows are never buffered in Python beyond one pipe's worth.
+Tables are mirrored concurrently, each coordinated on a connection of its
+own, and large tables are split into one stream per chain; the streams of
+all tables share one pool of --workers COPY streams, and all streams of a
+table read the same exported snapshot.
+
+Each mirror is a local table partitioned by its split column (or with a
+single default partition), so a refresh only exchanges partitions and
+views reading the mirror keep working. The source indexes are rebuilt on
+every partition, so downstream queries get local index scans. Every swap
+also records a content fingerprint of the mirror (its row count and the
+maxima of its FOREIGN_CHANGE_COLUMNS), which update_materialized_views.py
+compares to skip the views whose mirrors did not change.
+
+Usage:
+    python automations/mirror_tables.py --sources indexer maci --workers 4
+
+The mirrors are written to the {source}_mirror schemas. Point the refresh
+at them with INDEXER_SOURCE_SCHEMA=indexer_mirror and
+MACI_SOURCE_SCHEMA=maci_mirror.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+import psycopg2
+
+from refresh_report import RunReport, report_step
+from update_foreign_schema import INDEXER_CONFIG, MACI_CONFIG, DatabaseConfig, load_schema_versions
+from update_materialized_views import (
+    FOREIGN_CHANGE_COLUMNS, MIRROR_FINGERPRINT_TABLE, execute_command, execute_with_lock_retries, get_connection,
+    hash_text
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MIRROR_WORKERS = int(os.environ.get('MIRROR_WORKERS', 4))
+
+# Bytes handed from one COPY to the other per read
+COPY_CHUNK_SIZE = 1 << 20
+
+# Tables mirrored from each source. Tables with split_by are copied with
+# one stream per value of that column and partitioned by it.
+MIRROR_TABLES = {
+    'indexer': {
+        'rounds': {},
+        'applications': {'split_by': 'chain_id'},
+        'donations': {'split_by': 'chain_id'},
+        'applications_payouts': {},
+        'round_roles': {}
+    },
+    'maci': {
+        'rounds': {},
+        'applications': {},
+        'contributions': {'split_by': 'chain_id'},
+        'round_roles': {}
+    }
+}
+
+SOURCE_CONFIGS = {config.name: config for config in (INDEXER_CONFIG, MACI_CONFIG)}
+
+# Types with an oid below this are built in, and their binary format is the same on every server
+FIRST_NORMAL_OID = 16384
+
+
+class SourceColumn(NamedTuple):
+    name: str
+    type: str
+    builtin: bool
+
+
+def get_mirror_schema(config: DatabaseConfig) -> str:
+    """Return the local schema the tables of a source are mirrored to."""
+    return f"{config.schema}_mirror"
+
+
+def get_source_schema(config: DatabaseConfig) -> str:
+    """Return the schema of the current indexer/MACI version, as recorded by update_foreign_schema.py."""
+    version = load_schema_versions()[config.name]['version']
+    if version is None:
+        raise ValueError(f"No schema version recorded for {config.name}, run update_foreign_schema.py first")
+    return f"chain_data_{version}"
+
+
+def get_source_columns(connection, schema: str, table: str) -> List[SourceColumn]:
+    """Return the columns of a source table in ordinal order."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT attname, format_type(atttypid, atttypmod), atttypid < %s
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+        """, (FIRST_NORMAL_OID, f'{schema}."{table}"'))
+        return [SourceColumn(*row) for row in cursor.fetchall()]
+
+
+def get_source_indexes(connection, schema: str, table: str) -> List[str]:
+    """Return the column lists and methods of a source table's indexes, e.g. 'USING btree (id, chain_id)'."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE schemaname = %s AND tablename = %s", (schema, table))
+        definitions = [row[0] for row in cursor.fetchall()]
+    indexes = []
+    for definition in definitions:
+        match = re.match(r'CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?\S+ (USING .*)$', definition)
+        if match:
+            indexes.append(f"{match.group(1) or ''}{match.group(2)}")
+    return indexes
+
+
+def local_columns_sql(columns: List[SourceColumn]) -> str:
+    """Column definitions of a mirror; types that are not built in (enums, domains) become text."""
+    return ', '.join(
+        f'"{column.name}" {column.type if column.builtin else "text"}' for column in columns
+    )
+
+
+def copy_stream(source_params: Dict, snapshot: Optional[str], copy_out: str, connection, copy_in: str) -> None:
+    """Stream the output of copy_out on the source into copy_in on a local connection.
+
+    The source COPY runs on its own thread and writes into a pipe that the
+    local COPY reads from. The local transaction is left open, so the
+    caller commits only once both sides succeeded.
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        source = None
+        try:
+            source = psycopg2.connect(**source_params)
+            with os.fdopen(write_fd, 'wb') as writer, source.cursor() as cursor:
+                if snapshot:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+                cursor.copy_expert(copy_out, writer, size=COPY_CHUNK_SIZE)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            if source is not None:
+                source.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        # Closing the read end on failure makes the producer fail with a broken pipe
+        with os.fdopen(read_fd, 'rb') as reader, connection.cursor() as cursor:
+            cursor.copy_expert(copy_in, reader, size=COPY_CHUNK_SIZE)
+    finally:
+        producer.join()
+    if errors:
+        # A producer that failed mid-stream ends the pipe early, which a text COPY would accept
+        raise errors[0]
+
+
+class MirrorStream(NamedTuple):
+    partition: str
+    where: str
+    bound: str
+
+
+def get_streams(source, source_schema: str, table: str, split_by: Optional[str]) -> List[MirrorStream]:
+    """Return one stream per value of split_by, or a single stream into the default partition."""
+    if not split_by:
+        return [MirrorStream(f"{table}_all", "true", "DEFAULT")]
+    with source.cursor() as cursor:
+        cursor.execute(f'SELECT DISTINCT "{split_by}" FROM {source_schema}."{table}" WHERE "{split_by}" IS NOT NULL')
+        values = sorted(row[0] for row in cursor.fetchall())
+        streams = []
+        for value in values:
+            literal = cursor.mogrify('%s', (value,)).decode()
+            suffix = re.sub(r'[^a-z0-9]+', '_', str(value).lower())
+            streams.append(MirrorStream(
+                f"{table}_{split_by}_{suffix}", f'"{split_by}" = {literal}', f"FOR VALUES IN ({literal})"
+            ))
+    return streams
+
+
+def ensure_mirror_table(connection, target_schema: str, table: str, columns: List[SourceColumn], split_by: Optional[str]) -> None:
+    """Create the partitioned mirror table, recreating it if the source columns changed.
+
+    Recreating drops the views that read the mirror, like a foreign schema
+    update does; the next refresh rebuilds them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum
+        """, (f"{target_schema}.{table}",))
+        existing = cursor.fetchall()
+    connection.rollback()
+    expected = [(column.name, column.type if column.builtin else 'text') for column in columns]
+    if existing == expected:
+        return
+    if existing:
+        logger.warning(f"Columns of {target_schema}.{table} changed, recreating it and the views reading it")
+    partition_key = split_by or columns[0].name
+    execute_command(connection, f"""
+    CREATE SCHEMA IF NOT EXISTS {target_schema};
+    DROP TABLE IF EXISTS {target_schema}.{table} CASCADE;
+    CREATE TABLE {target_schema}.{table} ({local_columns_sql(columns)}) PARTITION BY LIST ("{partition_key}");
+    """)
+
+
+def ensure_fingerprint_table(connection) -> None:
+    """Create the table of mirror fingerprints if it is missing."""
+    execute_command(connection, f"""
+    CREATE TABLE IF NOT EXISTS {MIRROR_FINGERPRINT_TABLE} (
+        schema_name text NOT NULL,
+        table_name text NOT NULL,
+        fingerprint text NOT NULL,
+        mirrored_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (schema_name, table_name)
+    );
+    """)
+
+
+def get_content_fingerprint(connection, target_schema: str, columns: List[SourceColumn], streams: List[MirrorStream]) -> str:
+    """Hash the row count and the maxima of the FOREIGN_CHANGE_COLUMNS of the copied {partition}_new tables.
+
+    Like the change markers of foreign tables, this misses updates that
+    leave every maximum and the row count unchanged.
+    """
+    change_columns = sorted(column.name for column in columns if column.name in FOREIGN_CHANGE_COLUMNS)
+    aggregates = ', '.join(['COUNT(*)'] + [f'MAX("{column}")' for column in change_columns])
+    rows = ' UNION ALL '.join(f"SELECT * FROM {target_schema}.{stream.partition}_new" for stream in streams)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {aggregates} FROM ({rows}) t")
+        values = cursor.fetchone()
+    connection.rollback()
+    return hash_text(json.dumps(dict(zip(['count'] + change_columns, values)), default=str))
+
+
+def load_stream(
+    config: DatabaseConfig,
+    snapshot: Optional[str],
+    source_schema: str,
+    target_schema: str,
+    table: str,
+    columns: List[SourceColumn],
+    indexes: List[str],
+    stream: MirrorStream
+) -> None:
+    """Copy one stream into {partition}_new and index it, ready to be attached."""
+    staging = f"{stream.partition}_new"
+    binary = all(column.builtin for column in columns)
+    copy_format = 'binary' if binary else 'text'
+    column_list = ', '.join(f'"{column.name}"' for column in columns)
+    connection = get_connection()
+    try:
+        execute_command(connection, f"""
+        DROP TABLE IF EXISTS {target_schema}.{staging};
+        CREATE TABLE {target_schema}.{staging} (LIKE {target_schema}.{table});
+        """)
+        start_time = time.time()
+        copy_stream(
+            config.db_params, snapshot,
+            f'COPY (SELECT {column_list} FROM {source_schema}."{table}" WHERE {stream.where}) TO STDOUT (FORMAT {copy_format})',
+            connection,
+            f"COPY {target_schema}.{staging} ({column_list}) FROM STDIN (FORMAT {copy_format})"
+        )
+        connection.commit()
+        logger.info(f"Copied {stream.partition} in {time.time() - start_time:.1f} seconds ({copy_format})")
+
+        commands = []
+        if stream.bound != 'DEFAULT':
+            # Lets ATTACH PARTITION skip validating the rows
+            commands.append(f"ALTER TABLE {target_schema}.{staging} ADD CONSTRAINT partition_check CHECK ({stream.where});")
+        commands.extend(
+            f"CREATE {index.replace('USING', f'INDEX {staging}_idx{i} ON {target_schema}.{staging} USING', 1)};"
+            for i, index in enumerate(indexes)
+        )
+        commands.append(f"ANALYZE {target_schema}.{staging};")
+        execute_command(connection, "\n".join(commands))
+    finally:
+        connection.close()
+
+
+def mirror_table(
+    connection,
+    config: DatabaseConfig,
+    table: str,
+    options: dict,
+    source_schema: str,
+    executor: ThreadPoolExecutor,
+    report: Optional[RunReport] = None
+) -> None:
+    """Mirror one source table, then exchange all of its partitions in one transaction."""
+    target_schema = get_mirror_schema(config)
+    source = psycopg2.connect(**config.db_params)
+    try:
+        # Every stream of this table reads the same snapshot, like pg_dump --jobs
+        source.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with source.cursor() as cursor:
+            try:
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+            except psycopg2.Error as e:
+                logger.warning(f"Could not export a snapshot for {table}, streams read independently: {e}")
+                source.rollback()
+                snapshot = None
+        columns = get_source_columns(source, source_schema, table)
+        if not columns:
+            raise ValueError(f"Source table {source_schema}.{table} does not exist")
+        indexes = get_source_indexes(source, source_schema, table)
+        streams = get_streams(source, source_schema, table, options.get('split_by'))
+
+        ensure_mirror_table(connection, target_schema, table, columns, options.get('split_by'))
+        with report_step(report, f"{config.name}.{table}:copy", connection):
+            futures = [
+                executor.submit(
+                    load_stream, config, snapshot, source_schema, target_schema, table, columns, indexes, stream
+                )
+                for stream in streams
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        source.close()
+    fingerprint = get_content_fingerprint(connection, target_schema, columns, streams)
+
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """, (f"{target_schema}.{table}",))
+        old_partitions = [row[0] for row in cursor.fetchall()]
+    connection.rollback()
+
+    swap_commands = []
+    for partition in old_partitions:
+        swap_commands.append(f"ALTER TABLE {target_schema}.{table} DETACH PARTITION {target_schema}.{partition};")
+        swap_commands.append(f"DROP TABLE {target_schema}.{partition};")
+    for stream in streams:
+        staging = f"{stream.partition}_new"
+        swap_commands.append(f"DROP TABLE IF EXISTS {target_schema}.{stream.partition};")
+        swap_commands.append(f"ALTER TABLE {target_schema}.{staging} RENAME TO {stream.partition};")
+        swap_commands.extend(
+            f"ALTER INDEX {target_schema}.{staging}_idx{i} RENAME TO {stream.partition}_idx{i};"
+            for i in range(len(indexes))
+        )
+        swap_commands.append(
+            f"ALTER TABLE {target_schema}.{table} ATTACH PARTITION {target_schema}.{stream.partition} {stream.bound};"
+        )
+    swap_commands.append(f"""
+    INSERT INTO {MIRROR_FINGERPRINT_TABLE} (schema_name, table_name, fingerprint, mirrored_at)
+    VALUES ('{target_schema}', '{table}', '{fingerprint}', now())
+    ON CONFLICT (schema_name, table_name) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, mirrored_at = EXCLUDED.mirrored_at;
+    """)
+    with report_step(report, f"{config.name}.{table}:swap", connection, f"{target_schema}.{table}"):
+        execute_with_lock_retries(connection, "\n".join(swap_commands))
+    logger.info(f"Mirrored {source_schema}.{table} into {target_schema}.{table} ({len(streams)} partitions)")
+
+
+def mirror_table_job(
+    config: DatabaseConfig,
+    table: str,
+    options: dict,
+    source_schema: str,
+    executor: ThreadPoolExecutor,
+    report: Optional[RunReport] = None
+) -> None:
+    """Mirror one table on a connection of its own; its streams run on the shared executor."""
+    connection = get_connection()
+    try:
+        with report_step(report, f"{config.name}.{table}", connection, f"{get_mirror_schema(config)}.{table}"):
+            mirror_table(connection, config, table, options, source_schema, executor, report)
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mirror indexer and MACI tables into local tables with binary COPY.")
+    parser.add_argument('--sources', nargs='+', choices=list(MIRROR_TABLES), default=list(MIRROR_TABLES))
+    parser.add_argument('--tables', nargs='+', help="Only mirror these tables")
+    parser.add_argument('--workers', type=int, default=MIRROR_WORKERS, help="Parallel COPY streams")
+    parser.add_argument('--source-schema', help="Read from this schema instead of the recorded chain_data version")
+    args = parser.parse_args()
+
+    report = RunReport('mirror_tables')
+    status = 'failed'
+    connection = get_connection()
+    try:
+        ensure_fingerprint_table(connection)
+        jobs = []
+        for name in args.sources:
+            config = SOURCE_CONFIGS[name]
+            source_schema = args.source_schema or get_source_schema(config)
+            # Created up front, concurrent CREATE SCHEMA IF NOT EXISTS can fail
+            execute_command(connection, f"CREATE SCHEMA IF NOT EXISTS {get_mirror_schema(config)};")
+            jobs.extend(
+                (config, table, options, source_schema)
+                for table, options in MIRROR_TABLES[name].items()
+                if not args.tables or table in args.tables
+            )
+        # Table jobs mostly wait for their streams, which are bounded by the shared stream executor
+        with ThreadPoolExecutor(max_workers=args.workers) as executor, \
+                ThreadPoolExecutor(max_workers=max(min(args.workers, len(jobs)), 1)) as table_executor:
+            futures = [table_executor.submit(mirror_table_job, *job, executor, report) for job in jobs]
+            for future in futures:
+                future.result()
+        status = 'succeeded'
+    finally:
+        report.save(connection, status)
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Clustering of near-duplicate strings with MinHash and LSH banding.
+
+Every distinct value is cut into character shingles, and a MinHash
+signature of num_perm hashes estimates the Jaccard similarity of the
+shingle sets of two values as the fraction of equal signature entries.
+The signatures are split into bands; values whose signatures agree on a
+whole band land in the same bucket and become candidates. Each candidate
+is compared with the first and the previous value of its bucket only, so
+the work stays linear in the number of values even for large buckets,
+and candidates with an estimated similarity of at least the threshold are
+merged into clusters with a union-find.
+
+With b bands of r rows, values with similarity s become candidates with
+probability 1 - (1 - s^r)^b, an S-curve with its midpoint near
+(1/b)^(1/r); the defaults (8 bands of 8) put it at about 0.77.
+"""
+import logging
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from project_grouping import UnionFind
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 8
+SIMILARITY_THRESHOLD = 0.8
+
+# Multiplier of the 64-bit mixing step
+GOLDEN_RATIO_64 = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shingle_hashes(values: list, shingle_size: int = SHINGLE_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the 64-bit hashes of the character shingles of every value, and where each value's shingles start.
+
+    Values shorter than a shingle are padded, so every value has at least
+    one shingle.
+    """
+    encoded = [value.encode().ljust(shingle_size) for value in values]
+    lengths = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    value_offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    counts = lengths - shingle_size + 1
+    shingle_offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    # Position in the buffer of the first byte of every shingle
+    owners = np.repeat(np.arange(len(encoded)), counts)
+    positions = value_offsets[owners] + np.arange(counts.sum()) - shingle_offsets[owners]
+    hashes = np.zeros(len(positions), dtype=np.uint64)
+    for offset in range(shingle_size):
+        hashes = hashes * np.uint64(257) + buffer[positions + offset]
+    return hashes * GOLDEN_RATIO_64, shingle_offsets
+
+
+def minhash_signatures(
+    values: list,
+    num_perm: int = NUM_PERM,
+    shingle_size: int = SHINGLE_SIZE,
+    seed: int = 1
+) -> np.ndarray:
+    """Return a (len(values), num_perm) uint32 array of MinHash signatures."""
+    hashes, shingle_offsets = shingle_hashes(values, shingle_size)
+    rng = np.random.default_rng(seed)
+    # Multiply-shift hashing: the high 32 bits of a * x + b for odd a
+    multipliers = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+    increments = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+    signatures = np.empty((len(values), num_perm), dtype=np.uint32)
+    for number in range(num_perm):
+        permuted = ((hashes * multipliers[number] + increments[number]) >> np.uint64(32)).astype(np.uint32)
+        signatures[:, number] = np.minimum.reduceat(permuted, shingle_offsets)
+    return signatures
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int = BANDS) -> np.ndarray:
+    """Return the distinct (first, second) row pairs that share a bucket in some band.
+
+    Every row is paired with the first and the previous row of its bucket.
+    """
+    size, num_perm = signatures.shape
+    rows = num_perm // bands
+    pairs = []
+    for band in range(bands):
+        keys = np.zeros(size, dtype=np.uint64)
+        for column in range(band * rows, (band + 1) * rows):
+            keys = (keys ^ signatures[:, column].astype(np.uint64)) * np.uint64(0x100000001B3)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.ones(size, dtype=bool)
+        starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        first = order[np.maximum.accumulate(np.where(starts, np.arange(size), 0))]
+        members = ~starts
+        pairs.append(np.stack([first[members], order[members]], axis=1))
+        pairs.append(np.stack([order[:-1][members[1:]], order[1:][members[1:]]], axis=1))
+    pairs = np.concatenate(pairs)
+    pairs.sort(axis=1)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    combined = np.unique(pairs[:, 0] * size + pairs[:, 1])
+    return np.stack([combined // size, combined % size], axis=1)
+
+
+def estimated_similarities(signatures: np.ndarray, pairs: np.ndarray, chunk_rows: int = 1000000) -> np.ndarray:
+    """Return the MinHash estimate of the Jaccard similarity of every pair."""
+    similarities = np.empty(len(pairs), dtype=np.float32)
+    for start in range(0, len(pairs), chunk_rows):
+        chunk = pairs[start:start + chunk_rows]
+        similarities[start:start + chunk_rows] = (signatures[chunk[:, 0]] == signatures[chunk[:, 1]]).mean(axis=1)
+    return similarities
+
+
+def similar_value_clusters(
+    values: pd.Series,
+    threshold: float = SIMILARITY_THRESHOLD,
+    num_perm: int = NUM_PERM,
+    bands: int = BANDS,
+    shingle_size: int = SHINGLE_SIZE
+) -> pd.Series:
+    """Replace every value with the first value of its cluster of near-duplicates.
+
+    Clusters are the connected components of the candidate pairs with an
+    estimated similarity of at least threshold, so a chain of small edits
+    can link values that are not similar to each other. Missing values
+    stay missing.
+    """
+    present = values.notna()
+    codes, uniques = pd.factorize(values[present].astype(str))
+    uniques = list(uniques)
+    if len(uniques) < 2:
+        return values.copy()
+    signatures = minhash_signatures(uniques, num_perm, shingle_size)
+    pairs = candidate_pairs(signatures, bands)
+    similar = pairs[estimated_similarities(signatures, pairs) >= threshold]
+    sets = UnionFind(len(uniques))
+    for first, second in similar.tolist():
+        sets.union(first, second)
+    roots = np.array(sets.roots())
+    logger.info(
+        f"{len(uniques)} distinct values, {len(pairs)} candidate pairs, {len(similar)} similar, "
+        f"{len(uniques) - len(np.unique(roots))} values merged into near-duplicates"
+    )
+    canonical = values.copy()
+    canonical[present] = np.array(uniques, dtype=object)[roots[codes]]
+    return canonical
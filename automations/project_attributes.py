@@ -0,0 +1,113 @@
+"""Normalization of the attributes project applications are grouped by.
+
+Titles, payout addresses and the rest repeat a lot across rounds, so
+every column is dictionary-encoded with pd.factorize and the string
+operations run once per distinct value; the normalized dictionary is then
+expanded back to the rows with one take. Invalid applications, those
+without a valid payout address or a title, are dropped with a single
+row selection at the end.
+
+The normalizations reproduce the earlier pandas chain exactly, including
+that it cast missing titles, payout addresses and github handles to
+strings first, so a missing title became the title 'none' and a missing
+github handle the handle 'none'; the literal 'nan' became missing again.
+"""
+import logging
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from refresh_report import RunReport, report_step
+
+logger = logging.getLogger(__name__)
+
+ETH_ADDRESS_PATTERN = r'^0x[a-fA-F0-9]{40}$'
+
+
+def normalize_distinct(
+    values: pd.Series,
+    normalize: Callable[[pd.Series], pd.Series],
+    missing_as_text: bool = False
+) -> np.ndarray:
+    """Normalize the distinct values of a column once and return the normalized values of all rows.
+
+    If missing_as_text is set, missing values are normalized as their
+    string form, 'None' for None and 'nan' for NaN, as astype(str) would
+    have made them; otherwise they stay missing.
+    """
+    raw = values.to_numpy(dtype=object)
+    codes, uniques = pd.factorize(raw)
+    normalized = normalize(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+    if missing_as_text:
+        missing = codes == -1
+        normalized = np.concatenate([normalized, normalize(pd.Series(['None', 'nan'], dtype=object)).to_numpy(dtype=object)])
+        codes[missing] = np.where(np.equal(raw[missing], None), len(uniques), len(uniques) + 1)
+    else:
+        # Code -1 takes the last entry
+        normalized = np.append(normalized, np.nan)
+    return normalized[codes]
+
+
+def nan_to_missing(values: pd.Series) -> pd.Series:
+    return values.where(values != 'nan', np.nan)
+
+
+def normalize_payout_addresses(values: pd.Series) -> pd.Series:
+    """Lowercase addresses; anything but a 0x-prefixed 40 hex digit address becomes missing."""
+    values = values.astype(str).str.lower()
+    return values.where(values.str.match(ETH_ADDRESS_PATTERN), np.nan)
+
+
+def normalize_titles(values: pd.Series) -> pd.Series:
+    """Lowercase, drop punctuation and collapse whitespace; empty titles become missing."""
+    values = values.astype(str).str.lower()
+    values = values.str.replace(r'[^\w\s]', '', regex=True)  # Remove punctuation
+    values = values.str.replace(r'\s+', ' ', regex=True)  # Replace multiple spaces with a single space
+    values = values.str.strip()  # Remove leading/trailing whitespace
+    return nan_to_missing(values).replace('', np.nan)
+
+
+def normalize_twitter_handles(values: pd.Series) -> pd.Series:
+    return nan_to_missing(values.str.lower())
+
+
+def normalize_github_handles(values: pd.Series) -> pd.Series:
+    """Reduce github URLs and 'user/repo' strings to the lowercase user or organization."""
+    values = values.astype(str).str.lower()
+    values = values.str.replace('https://github.com/', '', regex=False).str.replace('http://github.com/', '', regex=False)
+    return nan_to_missing(values.str.split('/', n=1).str[0])
+
+
+def normalize_websites(values: pd.Series) -> pd.Series:
+    return nan_to_missing(values)
+
+
+# Column, normalization, and whether missing values are normalized as text
+ATTRIBUTE_NORMALIZATIONS = [
+    ('payout_address', normalize_payout_addresses, True),
+    ('title', normalize_titles, True),
+    ('project_twitter', normalize_twitter_handles, False),
+    ('project_github', normalize_github_handles, True),
+    ('website', normalize_websites, False)
+]
+
+
+def normalize_attributes(data: pd.DataFrame, report: Optional[RunReport] = None, connection=None) -> pd.DataFrame:
+    """Return the applications with a valid payout address and a title, with normalized attributes.
+
+    With a report, every column's normalization is recorded as a step.
+    """
+    normalized = {}
+    for column, normalize, missing_as_text in ATTRIBUTE_NORMALIZATIONS:
+        with report_step(report, f"normalize.{column}", connection):
+            normalized[column] = normalize_distinct(data[column], normalize, missing_as_text)
+
+    with report_step(report, 'normalize.select', connection):
+        keep = pd.notna(normalized['payout_address']) & pd.notna(normalized['title'])
+        data = data.take(np.flatnonzero(keep))
+        for column, values in normalized.items():
+            data[column] = values[keep]
+        data['chain_id'] = data['chain_id'].astype('Int64')
+    logger.info(f"Kept {len(data)} of {len(keep)} applications after normalization")
+    return data
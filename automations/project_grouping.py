@@ -0,0 +1,392 @@
+"""Grouping of project applications that share identifying attributes.
+
+Two applications are linked when they have equal, non-null values for at
+least min_shared_attributes of the grouping attributes (title, website,
+payout address, twitter and github), and a group is a connected component
+of those links.
+
+Rather than enumerating every pair of applications that share a value,
+which is quadratic in the size of the largest value group, the links are
+found through the attribute combinations: two applications share at least
+k attributes exactly when some k-subset of the attributes has equal values
+for both. Every application is therefore merged, in a union-find, with the
+first application of its value group for each k-subset, which touches
+every application once per subset.
+
+The same property makes grouping incremental. Every k-subset value tuple
+of a grouped application is stored as a key pointing at its group, so a
+new application only needs the groups of its own keys: it joins them,
+merging them into the oldest one if there are several, or starts a new
+group. Merged groups point at the group they were merged into, which is
+the persisted union-find state; group ids never change otherwise. A full
+regrouping keeps the ids too, as far as its groups overlap the previous
+ones.
+"""
+import hashlib
+import itertools
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from db_utils import copy_dataframe
+
+logger = logging.getLogger(__name__)
+
+GROUPING_ATTRIBUTES = ['title', 'website', 'payout_address', 'project_twitter', 'project_github']
+
+# Grouping state of the incremental mode
+GROUP_STATE_TABLE = 'public.project_group_state'
+GROUP_MEMBERS_TABLE = 'public.project_group_members'
+GROUP_KEYS_TABLE = 'public.project_group_keys'
+GROUP_PARENTS_TABLE = 'public.project_group_parents'
+
+MEMBER_COLUMNS = [
+    'member_key', 'source', 'project_id', 'group_id', 'title', 'website', 'payout_address',
+    'project_twitter', 'project_github', 'created_at', 'amount_donated', 'chain_id', 'created_at_block'
+]
+
+
+class UnionFind:
+    """Disjoint sets over the integers 0..size-1."""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        parent = self.parent
+        root = item
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression
+        while parent[item] != root:
+            parent[item], item = root, parent[item]
+        return root
+
+    def union(self, first: int, second: int) -> None:
+        first_root = self.find(first)
+        second_root = self.find(second)
+        if first_root != second_root:
+            # The smaller root is kept, so a root is always the first member of its set
+            if first_root < second_root:
+                self.parent[second_root] = first_root
+            else:
+                self.parent[first_root] = second_root
+
+    def roots(self) -> List[int]:
+        return [self.find(item) for item in range(len(self.parent))]
+
+
+def union_value_groups(sets: UnionFind, frame: pd.DataFrame, columns: List[str]) -> int:
+    """Merge the sets of all rows with equal, non-null values in every given column.
+
+    The rows are identified by their position in the frame. Returns the
+    number of unions performed.
+    """
+    values = frame[columns].reset_index(drop=True).dropna()
+    if len(values) == 0:
+        return 0
+    positions = values.index.to_numpy()
+    codes = values.groupby(columns, sort=False).ngroup().to_numpy()
+    firsts = pd.Series(positions).groupby(codes).transform('first').to_numpy()
+    linked = positions != firsts
+    for position, first in zip(positions[linked].tolist(), firsts[linked].tolist()):
+        sets.union(position, first)
+    return int(linked.sum())
+
+
+def assign_group_ids(
+    data: pd.DataFrame,
+    min_shared_attributes: int,
+    attributes: List[str] = GROUPING_ATTRIBUTES
+) -> np.ndarray:
+    """Return the group id of every row of data.
+
+    Groups are numbered in the order of their first row, as
+    networkx.connected_components numbers the components of a graph whose
+    nodes were added in row order.
+    """
+    sets = UnionFind(len(data))
+    subset_size = max(min_shared_attributes, 1)
+    for columns in itertools.combinations(attributes, subset_size):
+        unions = union_value_groups(sets, data, list(columns))
+        logger.debug(f"{unions} links on {', '.join(columns)}")
+    group_ids, _ = pd.factorize(np.array(sets.roots()))
+    return group_ids
+
+
+def keep_group_ids(group_ids: np.ndarray, previous_group_ids: pd.Series, next_group_id: int) -> np.ndarray:
+    """Renumber the groups of a regrouping so that they keep the ids of the previous grouping.
+
+    previous_group_ids holds the previous group id of every row, NaN for
+    rows not grouped before. Every previous id goes to the new group sharing
+    the most rows with it, so a split group keeps its id in its largest part
+    and groups merged into one leave a single id. The other groups get ids
+    from next_group_id (or the highest previous id plus one) on, in the
+    order of their first row.
+    """
+    overlap = pd.DataFrame({'group_id': group_ids, 'previous': previous_group_ids.to_numpy()}).dropna()
+    counts = overlap.groupby(['group_id', 'previous']).size().reset_index(name='rows')
+    counts = counts.sort_values(['rows', 'previous', 'group_id'], ascending=[False, True, True])
+    mapping = {}
+    kept = set()
+    for group_id, previous in zip(counts['group_id'].tolist(), counts['previous'].tolist()):
+        if group_id not in mapping and previous not in kept:
+            mapping[group_id] = int(previous)
+            kept.add(previous)
+    if len(overlap):
+        next_group_id = max(next_group_id, int(overlap['previous'].max()) + 1)
+    for group_id in pd.unique(group_ids).tolist():
+        if group_id not in mapping:
+            mapping[group_id] = next_group_id
+            next_group_id += 1
+    return pd.Series(group_ids).map(mapping).to_numpy(dtype='int64')
+
+
+def attribute_keys(
+    data: pd.DataFrame,
+    min_shared_attributes: int,
+    attributes: List[str] = GROUPING_ATTRIBUTES
+) -> pd.DataFrame:
+    """Return the position and key of every k-subset value tuple of the rows of data.
+
+    Two rows share at least min_shared_attributes attributes exactly when
+    they have a key in common.
+    """
+    frames = []
+    subset_size = max(min_shared_attributes, 1)
+    for columns in itertools.combinations(attributes, subset_size):
+        values = data[list(columns)].reset_index(drop=True).dropna()
+        prefix = '\x1f'.join(columns)
+        keys = [
+            hashlib.sha1('\x1e'.join((prefix,) + tuple(str(value) for value in row)).encode()).hexdigest()
+            for row in values.itertuples(index=False, name=None)
+        ]
+        frames.append(pd.DataFrame({'position': values.index.to_numpy(), 'key': keys}))
+    if not frames:
+        return pd.DataFrame({'position': pd.Series(dtype='int64'), 'key': pd.Series(dtype=object)})
+    return pd.concat(frames, ignore_index=True)
+
+
+def resolve_group(parents: Dict[int, int], group_id: int) -> int:
+    """Follow merged groups to the group they were merged into."""
+    while group_id in parents:
+        group_id = parents[group_id]
+    return group_id
+
+
+def group_new_members(
+    keys: pd.DataFrame,
+    size: int,
+    key_groups: Dict[str, int],
+    next_group_id: int
+) -> Tuple[np.ndarray, Dict[int, int], Dict[str, int]]:
+    """Assign groups to new rows given their keys and the current group of every known key.
+
+    Rows linked to existing groups join the oldest (lowest) of them and
+    the others are merged into it; rows linked to no existing group form
+    new groups, numbered from next_group_id in the order of their first
+    row. Returns the group id of every row, the merged groups with the
+    group each was merged into, and the group of every key not yet known.
+    """
+    linked_groups = sorted(set(key_groups.values()))
+    group_positions = {group_id: size + number for number, group_id in enumerate(linked_groups)}
+    sets = UnionFind(size + len(linked_groups))
+
+    # Rows sharing a key belong together, and with the existing group of the key
+    for key, positions in keys.groupby('key', sort=False)['position']:
+        positions = positions.tolist()
+        for position in positions[1:]:
+            sets.union(positions[0], position)
+        if key in key_groups:
+            sets.union(positions[0], group_positions[key_groups[key]])
+
+    roots = sets.roots()
+    survivors = {}
+    for group_id in linked_groups:
+        # The lowest group id of a component comes first, so it becomes the survivor
+        survivors.setdefault(roots[group_positions[group_id]], group_id)
+    merges = {
+        group_id: survivors[roots[group_positions[group_id]]]
+        for group_id in linked_groups
+        if survivors[roots[group_positions[group_id]]] != group_id
+    }
+
+    row_roots = np.array(roots[:size])
+    group_ids = np.empty(size, dtype='int64')
+    joined = np.array([root in survivors for root in roots[:size]], dtype=bool)
+    group_ids[joined] = [survivors[root] for root in row_roots[joined].tolist()]
+    codes, _ = pd.factorize(row_roots[~joined])
+    group_ids[~joined] = next_group_id + codes
+
+    new_key_groups = {}
+    for key, position in zip(keys['key'].tolist(), keys['position'].tolist()):
+        if key not in key_groups:
+            new_key_groups[key] = int(group_ids[position])
+    return group_ids, merges, new_key_groups
+
+
+def ensure_grouping_tables(connection) -> None:
+    """Create the tables of the grouping state if they are missing."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {GROUP_STATE_TABLE} (
+            id boolean PRIMARY KEY DEFAULT true CHECK (id),
+            min_shared_attributes integer NOT NULL,
+            attributes text NOT NULL,
+            updated_at timestamptz NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS {GROUP_MEMBERS_TABLE} (
+            member_key text PRIMARY KEY,
+            source text NOT NULL,
+            project_id text,
+            group_id bigint NOT NULL,
+            title text,
+            website text,
+            payout_address text,
+            project_twitter text,
+            project_github text,
+            created_at timestamptz,
+            amount_donated double precision,
+            chain_id integer,
+            created_at_block numeric
+        );
+        CREATE INDEX IF NOT EXISTS project_group_members_group_id_idx ON {GROUP_MEMBERS_TABLE} (group_id);
+        CREATE TABLE IF NOT EXISTS {GROUP_KEYS_TABLE} (
+            key text PRIMARY KEY,
+            group_id bigint NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS {GROUP_PARENTS_TABLE} (
+            group_id bigint PRIMARY KEY,
+            parent_id bigint NOT NULL
+        );
+        """)
+    connection.commit()
+
+
+def get_grouping_state(connection) -> Optional[dict]:
+    """Return the settings the grouping state was built with, if it was built."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT min_shared_attributes, attributes FROM {GROUP_STATE_TABLE}")
+        row = cursor.fetchone()
+    connection.rollback()
+    if row is None:
+        return None
+    return {'min_shared_attributes': row[0], 'attributes': row[1].split(',')}
+
+
+def save_grouping_state(cursor, min_shared_attributes: int, attributes: List[str]) -> None:
+    cursor.execute(f"""
+    INSERT INTO {GROUP_STATE_TABLE} (id, min_shared_attributes, attributes, updated_at)
+    VALUES (true, %s, %s, now())
+    ON CONFLICT (id) DO UPDATE
+    SET min_shared_attributes = EXCLUDED.min_shared_attributes, attributes = EXCLUDED.attributes,
+        updated_at = EXCLUDED.updated_at
+    """, (min_shared_attributes, ','.join(attributes)))
+
+
+def rebuild_grouping_state(
+    connection,
+    data: pd.DataFrame,
+    min_shared_attributes: int,
+    attributes: List[str] = GROUPING_ATTRIBUTES
+) -> None:
+    """Replace the grouping state with the members and keys of fully grouped data.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    keys = attribute_keys(data, min_shared_attributes, attributes)
+    keys['group_id'] = data['group_id'].to_numpy()[keys['position'].to_numpy()]
+    keys = keys.drop_duplicates('key')[['key', 'group_id']]
+    with connection.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {GROUP_MEMBERS_TABLE}, {GROUP_KEYS_TABLE}, {GROUP_PARENTS_TABLE}")
+        save_grouping_state(cursor, min_shared_attributes, attributes)
+    copy_dataframe(connection, data[MEMBER_COLUMNS], GROUP_MEMBERS_TABLE)
+    copy_dataframe(connection, keys, GROUP_KEYS_TABLE)
+    logger.info(f"Stored {len(data)} grouped applications and {len(keys)} attribute keys")
+
+
+def clear_grouping_state(connection) -> None:
+    """Remove the grouping state, so the next incremental run regroups from scratch.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {GROUP_STATE_TABLE}, {GROUP_MEMBERS_TABLE}, {GROUP_KEYS_TABLE}, {GROUP_PARENTS_TABLE}")
+
+
+def get_key_groups(connection, keys: List[str]) -> Dict[str, int]:
+    """Return the current group of every given key that is known."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT key, group_id FROM {GROUP_KEYS_TABLE} WHERE key = ANY(%s)", (keys,))
+        key_groups = dict(cursor.fetchall())
+        cursor.execute(f"SELECT group_id, parent_id FROM {GROUP_PARENTS_TABLE}")
+        parents = dict(cursor.fetchall())
+    return {key: resolve_group(parents, group_id) for key, group_id in key_groups.items()}
+
+
+def get_next_group_id(connection) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT GREATEST(
+            (SELECT MAX(group_id) FROM {GROUP_MEMBERS_TABLE}),
+            (SELECT MAX(group_id) FROM {GROUP_PARENTS_TABLE})
+        )
+        """)
+        max_group_id = cursor.fetchone()[0]
+    return 0 if max_group_id is None else max_group_id + 1
+
+
+def add_members(
+    connection,
+    new_members: pd.DataFrame,
+    min_shared_attributes: int,
+    attributes: List[str] = GROUPING_ATTRIBUTES
+) -> Tuple[set, Dict[int, int]]:
+    """Group new applications against the grouping state and store them.
+
+    Sets the group_id column of new_members. Returns the groups the new
+    members joined or formed, and the groups merged away with the group
+    each was merged into. Runs in the caller's transaction; the caller
+    commits.
+    """
+    keys = attribute_keys(new_members, min_shared_attributes, attributes)
+    key_groups = get_key_groups(connection, keys['key'].unique().tolist())
+    group_ids, merges, new_key_groups = group_new_members(
+        keys, len(new_members), key_groups, get_next_group_id(connection)
+    )
+    new_members['group_id'] = group_ids
+
+    with connection.cursor() as cursor:
+        if merges:
+            merged = list(merges)
+            cursor.execute("""
+            CREATE TEMP TABLE project_group_merges (group_id bigint PRIMARY KEY, parent_id bigint NOT NULL)
+            ON COMMIT DROP
+            """)
+            cursor.execute(
+                "INSERT INTO project_group_merges SELECT * FROM unnest(%s::bigint[], %s::bigint[])",
+                (merged, [merges[group_id] for group_id in merged])
+            )
+            cursor.execute(f"""
+            UPDATE {GROUP_MEMBERS_TABLE} m SET group_id = g.parent_id
+            FROM project_group_merges g WHERE m.group_id = g.group_id;
+            -- Keep every merged group one step away from its survivor
+            UPDATE {GROUP_PARENTS_TABLE} p SET parent_id = g.parent_id
+            FROM project_group_merges g WHERE p.parent_id = g.group_id;
+            INSERT INTO {GROUP_PARENTS_TABLE} (group_id, parent_id)
+            SELECT group_id, parent_id FROM project_group_merges;
+            """)
+        cursor.execute(f"UPDATE {GROUP_STATE_TABLE} SET updated_at = now()")
+    copy_dataframe(connection, new_members[MEMBER_COLUMNS], GROUP_MEMBERS_TABLE)
+    copy_dataframe(
+        connection,
+        pd.DataFrame({'key': list(new_key_groups), 'group_id': list(new_key_groups.values())}),
+        GROUP_KEYS_TABLE
+    )
+    logger.info(
+        f"Grouped {len(new_members)} new applications into {len(set(group_ids.tolist()))} groups, "
+        f"merging {len(merges)} groups"
+    )
+    return set(group_ids.tolist()) | set(merges.values()), merges
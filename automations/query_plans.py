@@ -0,0 +1,130 @@
+"""Planner estimates for the statements a refresh runs.
+
+explain_query runs EXPLAIN (VERBOSE, FORMAT JSON) on a query - without
+executing it - and summarizes the plan: the estimated rows and total cost,
+how often each node type of interest appears, and how every relation is
+scanned.
+
+The summaries of the last successful refresh are kept in
+public.matview_refresh_plans, so that a new plan can be compared with
+the previous one. A relation that used to be read through an index and is
+now read with a sequential scan is reported, since that is usually what
+turns a refresh into a timeout.
+"""
+import json
+import logging
+from typing import Dict, List, Optional
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+PLAN_TABLE = 'public.matview_refresh_plans'
+
+INDEX_SCANS = {'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+
+# Node types that are counted in the summaries
+REPORTED_NODES = {
+    'Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Foreign Scan',
+    'Sort', 'Incremental Sort', 'Hash Join', 'Merge Join', 'Nested Loop',
+    'Aggregate', 'WindowAgg', 'Materialize'
+}
+
+
+def walk_plan(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk_plan(child)
+
+
+def summarize_plan(plan: dict) -> dict:
+    """Summarize the top-level plan of EXPLAIN (VERBOSE, FORMAT JSON)."""
+    nodes = {}
+    scans = {}
+    for node in walk_plan(plan['Plan']):
+        node_type = node['Node Type']
+        if node_type in REPORTED_NODES:
+            nodes[node_type] = nodes.get(node_type, 0) + 1
+        if 'Relation Name' in node:
+            relation = f"{node.get('Schema', 'public')}.{node['Relation Name']}"
+            scans.setdefault(relation, set()).add(node_type)
+    return {
+        'rows': plan['Plan']['Plan Rows'],
+        'total_cost': plan['Plan']['Total Cost'],
+        'nodes': nodes,
+        'scans': {relation: sorted(types) for relation, types in sorted(scans.items())}
+    }
+
+
+def explain_query(connection, query: str) -> dict:
+    """Plan a query without executing it and return its summary."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (VERBOSE, FORMAT JSON) {query}")
+        result = cursor.fetchone()[0]
+    connection.rollback()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]
+    return summarize_plan(plan)
+
+
+def find_scan_regressions(previous: dict, current: dict) -> List[str]:
+    """Return the relations that were read through an index in previous and only sequentially in current."""
+    regressions = []
+    for relation, types in current['scans'].items():
+        before = set(previous['scans'].get(relation, []))
+        if before & INDEX_SCANS and 'Seq Scan' in types and not set(types) & INDEX_SCANS:
+            regressions.append(relation)
+    return regressions
+
+
+def ensure_plan_table(connection) -> None:
+    """Create the plan history table if it is missing."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PLAN_TABLE} (
+            matview text PRIMARY KEY,
+            definition text NOT NULL,
+            plan jsonb NOT NULL,
+            recorded_at timestamptz NOT NULL DEFAULT now()
+        );
+        """)
+    connection.commit()
+
+
+def get_stored_plans(connection) -> Dict[str, dict]:
+    """Return the plan summaries recorded by the last successful refresh of every view."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (PLAN_TABLE,))
+        if not cursor.fetchone()[0]:
+            connection.rollback()
+            return {}
+        cursor.execute(f"SELECT matview, definition, plan FROM {PLAN_TABLE}")
+        stored = {
+            matview: {'definition': definition, **(json.loads(plan) if isinstance(plan, str) else plan)}
+            for matview, definition, plan in cursor.fetchall()
+        }
+    connection.rollback()
+    return stored
+
+
+def save_plans(connection, plans: Dict[str, Optional[dict]]) -> None:
+    """Record the plan summaries of the rebuilt views. Failures are logged, never raised."""
+    rows = [
+        (matview, plan['definition'], json.dumps({key: value for key, value in plan.items() if key != 'definition'}))
+        for matview, plan in plans.items()
+        if plan is not None
+    ]
+    if not rows:
+        return
+    try:
+        ensure_plan_table(connection)
+        with connection.cursor() as cursor:
+            cursor.executemany(f"""
+            INSERT INTO {PLAN_TABLE} (matview, definition, plan, recorded_at)
+            VALUES (%s, %s, %s, now())
+            ON CONFLICT (matview) DO UPDATE
+            SET definition = EXCLUDED.definition, plan = EXCLUDED.plan, recorded_at = EXCLUDED.recorded_at
+            """, rows)
+        connection.commit()
+    except psycopg2.Error as e:
+        connection.rollback()
+        logger.warning(f"Could not record the plans in {PLAN_TABLE}: {e}")
@@ -4,6 +4,8 @@ import logging
 import argparse
 from dotenv import load_dotenv
 
+from refresh_report import RunReport
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -65,11 +67,19 @@ def main():
     {query};
     """
 
+    report = RunReport('refresh_allo_leaderboard')
+    status = 'failed'
+    report_connection = psycopg2.connect(**DB_PARAMS)
     try:
-        execute_command(command)
+        with report.step('allo_gmv_leaderboard_events', report_connection, 'experimental_views.allo_gmv_leaderboard_events'):
+            execute_command(command)
         logger.info("Successfully executed the command")
+        status = 'succeeded'
     except Exception as e:
         logger.error(f"Failed to complete operation: {e}", exc_info=True)
+    finally:
+        report.save(report_connection, status)
+        report_connection.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
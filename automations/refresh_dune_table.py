@@ -1,12 +1,11 @@
-from dune_client.client import DuneClient
-import pandas as pd
+import argparse
 import logging
 import os
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
-import hashlib
 import psycopg2
 
+from dune_loader import ingest_leaderboard_events
+
 
 
 # Set up logging
@@ -63,53 +62,25 @@ def execute_command(logger, connection, command: str, params: tuple = None) -> N
         connection.rollback()
         raise
 
-def refresh_dune_table(dune_api_key, logger):
+def refresh_dune_table(dune_api_key, logger, full_refresh=False):
     try:
-        # Initialize Dune client and get query results
-        logger.info("Initializing Dune client")
-        dune = DuneClient(dune_api_key)
-        logger.info("Fetching latest results from query 4118421")
-        query_result = dune.get_latest_result(4118421)
-        logger.info("Successfully retrieved query results")
-        query_result_df = pd.DataFrame(query_result.result.rows)
-        
-        # Sort dataframe and add row number column
-        query_result_df = query_result_df.sort_values(by=['tx_timestamp','role', 'address', 'gmv'])
-        query_result_df['row_number'] = range(1, len(query_result_df) + 1)
-        
-        # Create hash_id by concatenating and hashing relevant columns
-        query_result_df['event_signature'] = query_result_df.apply(
-            lambda row: hashlib.sha256(
-                f"{row['tx_timestamp']}{row['tx_hash']}{row['address']}{row['gmv']}{row['role']}{row['row_number']}".encode()
-            ).hexdigest(),
-            axis=1
+        # Bring the store up to date, fetching only new rows unless full_refresh is set
+        connection = get_connection(logger)
+        ingest_leaderboard_events(
+            connection, dune_api_key, 4118421, 'public.allov2_distribution_events_for_leaderboard_store', full_refresh
         )
 
-        # validation
-        if len(query_result_df) == 0:
-            raise ValueError("Empty result set from Dune")
-
-        # Convert dataframe to SQL values
-        values = []
-        for _, row in query_result_df.iterrows():
-            value_list = [
-                f"'{str(v)}'" if isinstance(v, (str, pd.Timestamp)) else str(v) if v is not None else 'NULL'
-                for v in row.values
-            ]
-            values.append(f"({', '.join(value_list)})")
-
-        create_command = f"""
+        # Create allov2_distribution_events_for_leaderboard_new from the store, then swap it in
+        execute_command(logger, connection, """
+        DROP MATERIALIZED VIEW IF EXISTS public.allov2_distribution_events_for_leaderboard_new CASCADE;
+        CREATE MATERIALIZED VIEW public.allov2_distribution_events_for_leaderboard_new AS
+        SELECT * FROM public.allov2_distribution_events_for_leaderboard_store;
         DROP MATERIALIZED VIEW IF EXISTS public.allov2_distribution_events_for_leaderboard CASCADE;
-        CREATE MATERIALIZED VIEW public.allov2_distribution_events_for_leaderboard AS
-        SELECT * FROM (
-            VALUES {','.join(values)}
-        ) AS t({', '.join(f'"{col}"' for col in query_result_df.columns)});
-        """
-
-        # Get database connection and execute command
-        connection = get_connection(logger)
-        execute_command(logger, connection, create_command)
-        logger.info(f"Successfully created materialized view with {len(query_result_df)} rows")
+        ALTER MATERIALIZED VIEW public.allov2_distribution_events_for_leaderboard_new
+        RENAME TO allov2_distribution_events_for_leaderboard;
+        DROP TABLE IF EXISTS public.allov2_distribution_events_for_leaderboard_store_old CASCADE;
+        """)
+        logger.info("Successfully created materialized view from the Dune store")
 
     except Exception as e:
         logger.error(f"Failed to refresh Dune table: {e}")
@@ -119,7 +90,14 @@ def refresh_dune_table(dune_api_key, logger):
             connection.close()
 
 def main():
-    refresh_dune_table(DUNE_API_KEY, logger)
+    parser = argparse.ArgumentParser(description="Refresh the Dune leaderboard view.")
+    parser.add_argument(
+        '--full-refresh',
+        action='store_true',
+        help="Reload the whole Dune result instead of fetching only the rows after the last ingested one"
+    )
+    args = parser.parse_args()
+    refresh_dune_table(DUNE_API_KEY, logger, args.full_refresh)
 
 if __name__ == "__main__":
     main()
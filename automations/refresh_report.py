@@ -0,0 +1,322 @@
+"""Structured per-step reports for refresh runs.
+
+A RunReport records every step of a run: when it started and finished,
+whether it succeeded, how many rows and bytes the relation it built has,
+and - where the pg_stat_statements extension is installed - the temp and
+shared buffer blocks of the statements that mention that relation.
+Reports created with trace_memory also record the peak Python memory
+allocated during every step, traced with tracemalloc.
+
+At the end of a run the report is written to a JSON file and appended to
+the public.refresh_runs history table. A step is flagged as regressed
+when it took longer than REGRESSION_THRESHOLD times its median over the
+last REGRESSION_WINDOW successful runs.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import psycopg2
+
+from matview_stats import estimate_row_count
+
+logger = logging.getLogger(__name__)
+
+RUNS_TABLE = 'public.refresh_runs'
+
+# Directory the JSON run reports are written to
+REPORT_DIR = os.environ.get('REFRESH_REPORT_DIR', 'reports')
+
+# A step regresses if it is this many times slower than its rolling median...
+REGRESSION_THRESHOLD = float(os.environ.get('REFRESH_REGRESSION_THRESHOLD', 1.5))
+# ...and at least this many seconds slower, so that short steps do not flap
+REGRESSION_MIN_SECONDS = float(os.environ.get('REFRESH_REGRESSION_MIN_SECONDS', 10))
+# Number of previous successful runs the median is taken over
+REGRESSION_WINDOW = int(os.environ.get('REFRESH_REGRESSION_WINDOW', 10))
+# Steps with fewer previous runs than this are never flagged
+REGRESSION_MIN_HISTORY = 3
+
+STATEMENT_COUNTERS = ['calls', 'shared_blks_hit', 'shared_blks_read', 'temp_blks_read', 'temp_blks_written']
+
+
+def has_pg_stat_statements(connection) -> bool:
+    """Return True if the pg_stat_statements view can be queried."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('pg_stat_statements') IS NOT NULL")
+            available = cursor.fetchone()[0]
+            if available:
+                cursor.execute("SELECT 1 FROM pg_stat_statements LIMIT 1")
+    except psycopg2.Error:
+        available = False
+    connection.rollback()
+    return available
+
+
+def statement_counters(connection, relation: str) -> Dict[str, int]:
+    """Sum the pg_stat_statements counters of this database's statements that mention a relation."""
+    sums = ', '.join(f"COALESCE(SUM({counter}), 0)::bigint" for counter in STATEMENT_COUNTERS)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT {sums}
+        FROM pg_stat_statements
+        WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+        AND query ILIKE %s
+        """, (f"%{relation}%",))
+        counters = dict(zip(STATEMENT_COUNTERS, cursor.fetchone()))
+    connection.rollback()
+    return counters
+
+
+def relation_size(connection, relation: str) -> Optional[int]:
+    """Return the total on-disk size of a relation including indexes and partitions, or None if it does not exist."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT CASE WHEN relkind = 'p'
+            THEN (SELECT SUM(pg_total_relation_size(relid))::bigint FROM pg_partition_tree(oid))
+            ELSE pg_total_relation_size(oid)
+        END
+        FROM pg_class
+        WHERE oid = to_regclass(%s)
+        """, (relation,))
+        row = cursor.fetchone()
+    connection.rollback()
+    return row[0] if row else None
+
+
+class RunReport:
+    """Collects the steps of one run of a script. Steps may run on several threads.
+
+    With trace_memory, steps must not overlap, as every step resets the
+    traced peak.
+    """
+
+    def __init__(self, script: str, trace_memory: bool = False):
+        self.script = script
+        self.trace_memory = trace_memory
+        self.run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+        self.started_at = datetime.now(timezone.utc)
+        self.steps = []
+        self._lock = threading.Lock()
+        self._statements_available = None
+
+    def _statements(self, connection) -> bool:
+        if self._statements_available is None:
+            self._statements_available = has_pg_stat_statements(connection)
+        return self._statements_available
+
+    @contextmanager
+    def step(self, name: str, connection, relation: Optional[str] = None):
+        """Record a step. If relation (schema.name) is given, its rows, size and statement counters are captured.
+
+        Measurement failures are logged and never fail the step itself.
+        """
+        record = {
+            'step': name,
+            'relation': relation,
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'status': 'running'
+        }
+        counters_before = None
+        if relation and self._statements(connection):
+            try:
+                counters_before = statement_counters(connection, relation)
+            except psycopg2.Error as e:
+                connection.rollback()
+                logger.warning(f"Could not read pg_stat_statements before step {name}: {e}")
+
+        memory_before = self._start_memory_trace() if self.trace_memory else None
+        start_time = time.time()
+        try:
+            yield record
+            record['status'] = 'succeeded'
+        except BaseException as e:
+            record['status'] = 'failed'
+            record['error'] = str(e)
+            raise
+        finally:
+            record['finished_at'] = datetime.now(timezone.utc).isoformat()
+            record['duration_seconds'] = round(time.time() - start_time, 3)
+            if memory_before is not None:
+                record['peak_memory_bytes'] = max(tracemalloc.get_traced_memory()[1] - memory_before, 0)
+            if relation and record['status'] == 'succeeded':
+                self._measure(connection, record, relation, counters_before)
+            with self._lock:
+                self.steps.append(record)
+
+    @staticmethod
+    def _start_memory_trace() -> int:
+        """Reset the traced peak and return the memory traced so far."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            # Python 3.8 has no reset_peak; restarting forgets the earlier allocations
+            tracemalloc.stop()
+            tracemalloc.start()
+        return tracemalloc.get_traced_memory()[0]
+
+    def _measure(self, connection, record: dict, relation: str, counters_before: Optional[Dict[str, int]]) -> None:
+        try:
+            schema, name = relation.split('.', 1)
+            record['rows'] = estimate_row_count(connection, schema, name)
+            record['relation_bytes'] = relation_size(connection, relation)
+            if counters_before is not None:
+                counters_after = statement_counters(connection, relation)
+                for counter in STATEMENT_COUNTERS:
+                    record[counter] = counters_after[counter] - counters_before[counter]
+        except psycopg2.Error as e:
+            connection.rollback()
+            logger.warning(f"Could not measure {relation} after step {record['step']}: {e}")
+
+    def to_dict(self, status: str) -> dict:
+        finished_at = datetime.now(timezone.utc)
+        return {
+            'run_id': self.run_id,
+            'script': self.script,
+            'status': status,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': finished_at.isoformat(),
+            'duration_seconds': round((finished_at - self.started_at).total_seconds(), 3),
+            'steps': sorted(self.steps, key=lambda step: step['started_at'])
+        }
+
+    def save(self, connection, status: str = 'succeeded', report_dir: str = REPORT_DIR) -> dict:
+        """Flag regressions, write the JSON report and append the steps to the history table.
+
+        Failing to store the report is logged but never raised, so reporting
+        cannot fail a refresh.
+        """
+        report = self.to_dict(status)
+        # The run may have failed in the middle of a transaction
+        connection.rollback()
+        try:
+            ensure_runs_table(connection)
+            flag_regressions(connection, self.script, report['steps'])
+        except psycopg2.Error as e:
+            connection.rollback()
+            logger.warning(f"Could not compare run {self.run_id} with previous runs: {e}")
+
+        report['regressions'] = [step['step'] for step in report['steps'] if step.get('regressed')]
+        for step in report['steps']:
+            if step.get('regressed'):
+                logger.warning(
+                    f"Step {step['step']} regressed: {step['duration_seconds']:.1f}s "
+                    f"vs. median {step['median_seconds']:.1f}s"
+                )
+
+        try:
+            os.makedirs(report_dir, exist_ok=True)
+            path = os.path.join(report_dir, f"{self.script}_{self.run_id}.json")
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+            logger.info(f"Wrote run report to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write run report: {e}")
+
+        try:
+            insert_steps(connection, report)
+        except psycopg2.Error as e:
+            connection.rollback()
+            logger.warning(f"Could not record run {self.run_id} in {RUNS_TABLE}: {e}")
+        return report
+
+
+def report_step(report: Optional[RunReport], name: str, connection, relation: Optional[str] = None):
+    """Return report.step(...), or a no-op context if there is no report."""
+    if report is None:
+        return nullcontext()
+    return report.step(name, connection, relation)
+
+
+def ensure_runs_table(connection) -> None:
+    """Create the run history table if it is missing."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RUNS_TABLE} (
+            run_id text NOT NULL,
+            script text NOT NULL,
+            step text NOT NULL,
+            relation text,
+            status text NOT NULL,
+            started_at timestamptz NOT NULL,
+            finished_at timestamptz NOT NULL,
+            duration_seconds double precision NOT NULL,
+            rows bigint,
+            relation_bytes bigint,
+            calls bigint,
+            shared_blks_hit bigint,
+            shared_blks_read bigint,
+            temp_blks_read bigint,
+            temp_blks_written bigint,
+            median_seconds double precision,
+            regressed boolean NOT NULL DEFAULT false,
+            error text,
+            PRIMARY KEY (run_id, step)
+        );
+        ALTER TABLE {RUNS_TABLE} ADD COLUMN IF NOT EXISTS peak_memory_bytes bigint;
+        CREATE INDEX IF NOT EXISTS refresh_runs_script_step_idx
+        ON {RUNS_TABLE} (script, step, started_at DESC);
+        """)
+    connection.commit()
+
+
+def flag_regressions(connection, script: str, steps: List[dict]) -> None:
+    """Set median_seconds and regressed on each step from the step's previous successful runs."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT step, percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_seconds), COUNT(*)
+        FROM (
+            SELECT step, duration_seconds,
+                   ROW_NUMBER() OVER (PARTITION BY step ORDER BY started_at DESC) AS recency
+            FROM {RUNS_TABLE}
+            WHERE script = %s AND status = 'succeeded'
+        ) history
+        WHERE recency <= %s
+        GROUP BY step
+        """, (script, REGRESSION_WINDOW))
+        medians = {step: (median, count) for step, median, count in cursor.fetchall()}
+    connection.rollback()
+
+    for step in steps:
+        median, count = medians.get(step['step'], (None, 0))
+        step['median_seconds'] = median
+        step['regressed'] = (
+            step['status'] == 'succeeded'
+            and count >= REGRESSION_MIN_HISTORY
+            and step['duration_seconds'] > median * REGRESSION_THRESHOLD
+            and step['duration_seconds'] - median > REGRESSION_MIN_SECONDS
+        )
+
+
+def insert_steps(connection, report: dict) -> None:
+    """Append the steps of a run report to the history table."""
+    columns = [
+        'run_id', 'script', 'step', 'relation', 'status', 'started_at', 'finished_at',
+        'duration_seconds', 'rows', 'relation_bytes', *STATEMENT_COUNTERS,
+        'median_seconds', 'regressed', 'error', 'peak_memory_bytes'
+    ]
+    rows = [
+        tuple(
+            report[column] if column in ('run_id', 'script') else step.get(column, False if column == 'regressed' else None)
+            for column in columns
+        )
+        for step in report['steps']
+    ]
+    if not rows:
+        return
+    placeholders = ', '.join(['%s'] * len(columns))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {RUNS_TABLE} ({', '.join(columns)}) VALUES ({placeholders})",
+            rows
+        )
+    connection.commit()
@@ -0,0 +1,158 @@
+"""Dependency-aware scheduler for refresh steps.
+
+Each step is a callable that receives a database connection. Steps run on a
+thread pool where every worker owns one connection. A step becomes ready once
+all of the steps it depends on have finished, and whenever a worker is free
+the ready step with the highest priority starts.
+"""
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerConnections:
+    """Hands every worker thread its own lazily opened connection."""
+
+    def __init__(self, connection_factory: Callable):
+        self.connection_factory = connection_factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or connection.closed:
+            connection = self.connection_factory()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close_all(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                if not connection.closed:
+                    connection.close()
+            self._connections = []
+
+
+def topological_order(dependencies: Dict[str, List[str]]) -> List[str]:
+    """Return the steps in dependency order, raising ValueError on unknown steps or cycles."""
+    for step, upstream in dependencies.items():
+        unknown = [name for name in upstream if name not in dependencies]
+        if unknown:
+            raise ValueError(f"Step {step} depends on unknown steps: {unknown}")
+
+    remaining = {step: set(upstream) for step, upstream in dependencies.items()}
+    order = []
+    while remaining:
+        ready = sorted(step for step, upstream in remaining.items() if not upstream)
+        if not ready:
+            raise ValueError(f"Dependency cycle between steps: {sorted(remaining)}")
+        for step in ready:
+            order.append(step)
+            del remaining[step]
+        for upstream in remaining.values():
+            upstream.difference_update(ready)
+    return order
+
+
+def critical_path_costs(dependencies: Dict[str, List[str]], costs: Dict[str, float]) -> Dict[str, float]:
+    """Return for every step its cost plus the most expensive chain of steps that wait for it.
+
+    Starting the steps with the longest remaining path first keeps the
+    slowest chain from being started last. Steps without a cost count as 0.
+    """
+    downstream = {step: [] for step in dependencies}
+    for step, upstream in dependencies.items():
+        for name in upstream:
+            downstream[name].append(step)
+    paths = {}
+    for step in reversed(topological_order(dependencies)):
+        paths[step] = costs.get(step, 0) + max((paths[name] for name in downstream[step]), default=0)
+    return paths
+
+
+def run_dag(
+    tasks: Dict[str, Callable],
+    dependencies: Dict[str, List[str]],
+    connection_factory: Callable,
+    max_workers: int = 4,
+    priorities: Optional[Dict[str, float]] = None
+) -> None:
+    """Run every task once its dependencies have completed.
+
+    Args:
+        tasks: Step name -> callable taking a connection
+        dependencies: Step name -> names of steps that must finish first
+        connection_factory: Opens a new connection for a worker thread
+        max_workers: Number of worker threads (and connections)
+        priorities: Optional step name -> priority; whenever a worker is free,
+            the ready step with the highest priority is started
+
+    Raises:
+        RuntimeError: If any step fails. No new steps are started after a
+            failure, but steps already running are allowed to finish.
+    """
+    dependencies = {step: list(dependencies.get(step, [])) for step in tasks}
+    topological_order(dependencies)
+    priorities = priorities or {}
+
+    pending = {step: set(upstream) for step, upstream in dependencies.items()}
+    completed = set()
+    failures = {}
+    running = {}
+    # Ready steps wait in a heap rather than in the executor's FIFO queue, so a
+    # step that becomes ready later still starts before lower priority steps
+    # that were ready earlier
+    ready = []
+    connections = WorkerConnections(connection_factory)
+
+    def run_step(step: str) -> float:
+        start_time = time.time()
+        logger.info(f"Starting step {step}")
+        tasks[step](connections.get())
+        duration = time.time() - start_time
+        logger.info(f"Finished step {step} in {duration:.2f} seconds")
+        return duration
+
+    def release_ready_steps() -> None:
+        for step in [step for step, upstream in pending.items() if upstream <= completed]:
+            del pending[step]
+            heapq.heappush(ready, (-priorities.get(step, 0), step))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                if not failures:
+                    release_ready_steps()
+                    while ready and len(running) < max_workers:
+                        _, step = heapq.heappop(ready)
+                        running[executor.submit(run_step, step)] = step
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logger.error(f"Step {step} failed: {error}")
+                        failures[step] = error
+                    else:
+                        completed.add(step)
+    finally:
+        connections.close_all()
+
+    if failures:
+        skipped = sorted(list(pending) + [step for _, step in ready])
+        if skipped:
+            logger.error(f"Skipped steps after failure: {', '.join(skipped)}")
+        first_error = next(iter(failures.values()))
+        raise RuntimeError(f"Refresh steps failed: {', '.join(sorted(failures))}") from first_error
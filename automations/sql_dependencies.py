@@ -0,0 +1,213 @@
+"""Find and rewrite the relations a SQL query reads.
+
+This is a small tokenizer rather than a full SQL parser. It understands
+comments, string literals, quoted identifiers, CTE names and function calls
+well enough to find every relation that follows FROM or JOIN in the queries
+under automations/queries/, regardless of whitespace or line breaks.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Set
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<line_comment>--[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<dollar_string>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+  | (?P<string>[EeBbXx]?'(?:[^']|'')*')
+  | (?P<quoted_identifier>"(?:[^"]|"")*")
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+  | (?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Keywords after which an opening parenthesis starts a subquery or a list,
+# rather than the argument list of a function call
+NON_FUNCTION_KEYWORDS = {
+    'all', 'and', 'any', 'as', 'between', 'by', 'case', 'else', 'except', 'exists',
+    'from', 'in', 'intersect', 'join', 'lateral', 'materialized', 'not', 'on', 'or',
+    'returning', 'select', 'some', 'then', 'union', 'using', 'values', 'when',
+    'where', 'with'
+}
+
+# Words that can follow a relation name in a FROM clause and are not an alias
+CLAUSE_KEYWORDS = {
+    'cross', 'except', 'fetch', 'for', 'full', 'group', 'having', 'inner', 'intersect',
+    'join', 'left', 'limit', 'natural', 'offset', 'on', 'order', 'right', 'union',
+    'using', 'where', 'window'
+}
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    start: int
+    end: int
+
+    @property
+    def value(self) -> str:
+        """Identifier value: lower-cased for bare words, unquoted for quoted identifiers."""
+        if self.kind == 'quoted_identifier':
+            return self.text[1:-1].replace('""', '"')
+        return self.text.lower()
+
+
+class RelationReference(NamedTuple):
+    schema: Optional[str]
+    name: str
+    start: int
+    end: int
+    alias: Optional[str] = None
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.schema}.{self.name}" if self.schema else self.name
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Split SQL into tokens, dropping whitespace and comments."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(sql):
+        kind = match.lastgroup
+        if kind == 'tag':
+            kind = 'dollar_string'
+        if kind in ('space', 'line_comment', 'block_comment'):
+            continue
+        tokens.append(Token(kind, match.group(), match.start(), match.end()))
+    return tokens
+
+
+def _is_identifier(token: Token) -> bool:
+    return token.kind in ('word', 'quoted_identifier')
+
+
+def _is_word(token: Optional[Token], *words: str) -> bool:
+    return token is not None and token.kind == 'word' and token.text.lower() in words
+
+
+def find_cte_names(tokens: List[Token]) -> Set[str]:
+    """Return the names of all common table expressions defined in the query."""
+    names = set()
+    for i, token in enumerate(tokens):
+        if not _is_identifier(token) or i == 0:
+            continue
+        previous = tokens[i - 1]
+        if not (_is_word(previous, 'with', 'recursive') or previous.text == ','):
+            continue
+        j = i + 1
+        # Optional column list: name (col1, col2) AS (...)
+        if j < len(tokens) and tokens[j].text == '(':
+            depth = 0
+            while j < len(tokens):
+                if tokens[j].text == '(':
+                    depth += 1
+                elif tokens[j].text == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                j += 1
+            j += 1
+        if j < len(tokens) and _is_word(tokens[j], 'as'):
+            j += 1
+            while j < len(tokens) and _is_word(tokens[j], 'not', 'materialized'):
+                j += 1
+            if j < len(tokens) and tokens[j].text == '(':
+                names.add(token.value)
+    return names
+
+
+def _read_relation(tokens: List[Token], i: int):
+    """Read a possibly schema-qualified name starting at tokens[i].
+
+    Returns (schema, name, start, end, next_index) or None if tokens[i] does not
+    start a relation name (a subquery, VALUES list or function call).
+    """
+    if i >= len(tokens) or not _is_identifier(tokens[i]) or _is_word(tokens[i], 'lateral', 'only'):
+        return None
+    schema = None
+    name_token = tokens[i]
+    j = i + 1
+    if j + 1 < len(tokens) and tokens[j].text == '.' and _is_identifier(tokens[j + 1]):
+        schema = name_token.value
+        name_token = tokens[j + 1]
+        j += 2
+    if j < len(tokens) and tokens[j].text == '(':
+        # Set-returning function such as jsonb_array_elements(...)
+        return None
+    return schema, name_token.value, tokens[i].start, name_token.end, j
+
+
+def find_relation_references(sql: str) -> List[RelationReference]:
+    """Return every relation read in FROM and JOIN clauses, excluding CTEs."""
+    tokens = tokenize(sql)
+    cte_names = find_cte_names(tokens)
+    references = []
+    # One entry per open parenthesis: True if it is a function call's argument list
+    paren_stack = []
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.text == '(':
+            previous = tokens[i - 1] if i > 0 else None
+            is_function = (
+                previous is not None
+                and _is_identifier(previous)
+                and not _is_word(previous, *NON_FUNCTION_KEYWORDS)
+            )
+            paren_stack.append(is_function)
+        elif token.text == ')':
+            if paren_stack:
+                paren_stack.pop()
+        elif _is_word(token, 'from', 'join') and not (paren_stack and paren_stack[-1]):
+            # FROM inside a function call, e.g. EXTRACT(EPOCH FROM ts), is not a relation
+            j = i + 1
+            while True:
+                relation = _read_relation(tokens, j)
+                if relation is None:
+                    break
+                schema, name, start, end, j = relation
+                # Read an optional alias, then continue with comma-separated relations
+                alias = None
+                if _is_word(tokens[j] if j < len(tokens) else None, 'as'):
+                    j += 1
+                if j < len(tokens) and _is_identifier(tokens[j]) and not _is_word(tokens[j], *CLAUSE_KEYWORDS):
+                    alias = tokens[j].value
+                    j += 1
+                if schema is not None or name not in cte_names:
+                    references.append(RelationReference(schema, name, start, end, alias))
+                if j < len(tokens) and tokens[j].text == ',' and token.text.lower() == 'from':
+                    j += 1
+                    continue
+                break
+        i += 1
+    return references
+
+
+def find_dependencies(sql: str) -> Set[str]:
+    """Return the qualified (schema.name) or bare names of all relations a query reads."""
+    return {reference.qualified_name for reference in find_relation_references(sql)}
+
+
+def rewrite_relations(sql: str, replacements: Dict[str, str], default_schema: str = 'public') -> str:
+    """Point relation references at other objects.
+
+    Args:
+        sql: The query to rewrite
+        replacements: Qualified name (schema.name) -> SQL text to substitute,
+            e.g. {'public.donations': 'public.donations_new'}
+        default_schema: Schema assumed for unqualified references
+
+    Only relations in FROM and JOIN clauses are rewritten; column references,
+    CTEs, comments and string literals that happen to match are left alone.
+    """
+    pieces = []
+    position = 0
+    for reference in find_relation_references(sql):
+        qualified_name = f"{reference.schema or default_schema}.{reference.name}"
+        if qualified_name not in replacements:
+            continue
+        pieces.append(sql[position:reference.start])
+        pieces.append(replacements[qualified_name])
+        position = reference.end
+    pieces.append(sql[position:])
+    return ''.join(pieces)
@@ -0,0 +1,199 @@
+"""Publish DataFrames as Postgres tables with COPY and an atomic swap.
+
+The rows are streamed into a typed staging table ({name}_staging_<run id>,
+so overlapping runs never share one) with COPY FROM STDIN,
+PUBLISH_CHUNK_ROWS rows at a time, optionally split over several
+connections that copy in parallel. The staging table is indexed and
+analyzed, and then replaces the live table in one short transaction, so
+readers see either the old or the new rows, never a missing or half
+loaded table.
+
+A live table that views depend on cannot be swapped: the views would keep
+reading the old table. Its rows are then replaced in place from the
+staging table instead, which needs the columns to be unchanged. That
+transaction lasts as long as copying the rows over, so it deletes the old
+rows rather than truncating the table: readers keep seeing the old rows
+until it commits instead of waiting for an ACCESS EXCLUSIVE lock, and the
+deleted rows are left to autovacuum.
+"""
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+import psycopg2
+
+from db_utils import copy_dataframe, get_column_types, get_store_columns
+
+logger = logging.getLogger(__name__)
+
+# Rows serialized and sent per COPY chunk
+PUBLISH_CHUNK_ROWS = int(os.environ.get('PUBLISH_CHUNK_ROWS', 50000))
+
+# Connections copying into the staging table at the same time
+PUBLISH_WORKERS = int(os.environ.get('PUBLISH_WORKERS', 1))
+
+SWAP_LOCK_TIMEOUT = os.environ.get('SWAP_LOCK_TIMEOUT', '5s')
+SWAP_LOCK_RETRIES = int(os.environ.get('SWAP_LOCK_RETRIES', 10))
+
+
+def quote_table(table: str) -> str:
+    """Quote every part of a (schema.)name, keeping the case of mixed-case names."""
+    return '.'.join(f'"{part}"' for part in table.split('.'))
+
+
+def publish_column_types(df: pd.DataFrame, column_types: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Return column -> type for every column of df, in column order.
+
+    Naive datetimes become timestamp without time zone, as to_sql made them.
+    """
+    column_types = dict(column_types or {})
+    for column in df.columns:
+        if column not in column_types and df[column].dtype.kind == 'M' and getattr(df[column].dt, 'tz', None) is None:
+            column_types[column] = 'timestamp without time zone'
+    return get_column_types(df, column_types)
+
+
+def get_dependent_views(connection, table: str) -> List[str]:
+    """Return the views and materialized views that read the table."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT DISTINCT v.oid::regclass::text
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class v ON v.oid = r.ev_class
+        WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = to_regclass(%s) AND v.oid <> d.refobjid
+        """, (table,))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def copy_partition(connection_params: Dict, df: pd.DataFrame, staging: str, chunk_rows: int) -> None:
+    """Copy df into the staging table on a connection of its own."""
+    connection = psycopg2.connect(**connection_params)
+    try:
+        copy_dataframe(connection, df, staging, chunk_rows)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def execute_swap(connection, command: str) -> None:
+    """Run the swap, retrying when its locks are not granted within SWAP_LOCK_TIMEOUT.
+
+    A statement waiting for an ACCESS EXCLUSIVE lock queues every new reader
+    behind it, so it gives up after a short wait and is retried with a
+    growing pause. The last attempt waits as long as needed.
+    """
+    for attempt in range(SWAP_LOCK_RETRIES + 1):
+        try:
+            with connection.cursor() as cursor:
+                if attempt < SWAP_LOCK_RETRIES:
+                    cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+                cursor.execute(command)
+            connection.commit()
+            return
+        except psycopg2.errors.LockNotAvailable:
+            connection.rollback()
+            logger.warning(f"Could not get locks within {SWAP_LOCK_TIMEOUT} (attempt {attempt + 1}), retrying...")
+            time.sleep(min(2 ** attempt, 60))
+        except Exception:
+            connection.rollback()
+            raise
+
+
+def publish_table(
+    connection,
+    df: pd.DataFrame,
+    table: str,
+    column_types: Optional[Dict[str, str]] = None,
+    indexes: Optional[List[List[str]]] = None,
+    chunk_rows: int = PUBLISH_CHUNK_ROWS,
+    workers: int = PUBLISH_WORKERS,
+    connection_params: Optional[Dict] = None
+) -> None:
+    """Replace the table (schema.name or name) with the rows of df.
+
+    Args:
+        column_types: Column -> type; other columns get a type inferred from their dtype
+        indexes: Column lists, each indexed on the new table before it is published
+        chunk_rows: Rows per COPY chunk
+        workers: Parallel COPY connections; more than one needs connection_params
+        connection_params: psycopg2.connect arguments for the parallel connections
+    """
+    start_time = time.time()
+    types = publish_column_types(df, column_types)
+    schema, _, name = table.rpartition('.')
+    prefix = f"{schema}." if schema else ''
+    live = quote_table(table)
+    staging_suffix = f"staging_{uuid.uuid4().hex[:8]}"
+    staging = quote_table(f"{prefix}{name}_{staging_suffix}")
+    index_names = [f"{name}_{'_'.join(columns)}_idx" for columns in indexes or []]
+    if workers > 1 and connection_params is None:
+        logger.warning("Parallel COPY needs connection_params, copying on one connection")
+        workers = 1
+
+    try:
+        with connection.cursor() as cursor:
+            columns_sql = ', '.join(f'"{column}" {column_type}' for column, column_type in types.items())
+            cursor.execute(f"CREATE TABLE {staging} ({columns_sql})")
+        if workers > 1:
+            # The parallel connections only see the staging table once it is committed
+            connection.commit()
+            partition_rows = -(-len(df) // workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(copy_partition, connection_params, df.iloc[start:start + partition_rows], staging, chunk_rows)
+                    for start in range(0, len(df), partition_rows)
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            copy_dataframe(connection, df, staging, chunk_rows)
+        logger.info(f"Copied {len(df)} rows into {staging} on {workers} connection(s) in {time.time() - start_time:.1f}s")
+
+        with connection.cursor() as cursor:
+            for index_name, columns in zip(index_names, indexes or []):
+                column_list = ', '.join(f'"{column}"' for column in columns)
+                cursor.execute(f'CREATE INDEX "{index_name}_{staging_suffix}" ON {staging} ({column_list})')
+            cursor.execute(f"ANALYZE {staging}")
+        connection.commit()
+
+        dependent_views = get_dependent_views(connection, live)
+        if dependent_views:
+            if get_store_columns(connection, live) != get_store_columns(connection, staging):
+                raise ValueError(
+                    f"Columns of {table} changed, but it cannot be replaced while {', '.join(dependent_views)} read it"
+                )
+            connection.rollback()
+            column_list = ', '.join(f'"{column}"' for column in types)
+            execute_swap(connection, f"""
+            DELETE FROM {live};
+            INSERT INTO {live} ({column_list}) SELECT {column_list} FROM {staging};
+            DROP TABLE {staging};
+            ANALYZE {live};
+            """)
+            logger.info(f"Replaced the rows of {table} in place, {', '.join(dependent_views)} read it")
+        else:
+            connection.rollback()
+            swap_commands = [
+                f"DROP TABLE IF EXISTS {live};",
+                f'ALTER TABLE {staging} RENAME TO "{name}";'
+            ]
+            swap_commands.extend(
+                f'ALTER INDEX {quote_table(f"{prefix}{index_name}_{staging_suffix}")} RENAME TO "{index_name}";'
+                for index_name in index_names
+            )
+            execute_swap(connection, "\n".join(swap_commands))
+    except Exception:
+        try:
+            connection.rollback()
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+            connection.commit()
+        except psycopg2.Error as e:
+            logger.warning(f"Could not drop {staging}: {e}")
+        raise
+    logger.info(f"Published {len(df)} rows to {table} in {time.time() - start_time:.1f}s")
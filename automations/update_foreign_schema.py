@@ -8,6 +8,7 @@ from typing import Dict, Optional, List
 from datetime import datetime, timedelta
 import requests
 
+from db_utils import read_query
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,8 +23,30 @@ try:
 except ImportError:
     logger.info("dotenv not installed, skipping .env file loading")
 
+# postgres_fdw options managed on every foreign server. fetch_size is the
+# number of rows fetched per round trip (postgres_fdw defaults to 100),
+# use_remote_estimate lets the planner ask the remote server for row
+# estimates, and async_capable (PostgreSQL 14+) lets an Append scan several
+# foreign tables at once. extensions lists extensions installed on both
+# sides whose functions may be pushed down. Any other option, such as
+# host or schema_name, is left as it is.
+MANAGED_FDW_OPTIONS = ('fetch_size', 'use_remote_estimate', 'extensions', 'async_capable')
+
+DEFAULT_SERVER_OPTIONS = {
+    'fetch_size': '10000',
+    'use_remote_estimate': 'true',
+    'async_capable': 'true'
+}
+
 class DatabaseConfig:
-    def __init__(self, name: str, tables_config: Dict, db_params: Dict):
+    def __init__(
+        self,
+        name: str,
+        tables_config: Dict,
+        db_params: Dict,
+        server_options: Optional[Dict[str, str]] = None,
+        table_options: Optional[Dict[str, Dict[str, str]]] = None
+    ):
         self.name = name
         self.server = name
         self.schema = name
@@ -31,6 +54,9 @@ class DatabaseConfig:
         self.tables_to_import = tables_config.get('import', [])
         self.tables_to_create = tables_config.get('create', [])
         self.db_params = db_params
+        # Server options apply to every foreign table, table options override them per table
+        self.server_options = {**DEFAULT_SERVER_OPTIONS, **(server_options or {})}
+        self.table_options = table_options or {}
 
 # Configuration for different database targets
 MACI_CONFIG = DatabaseConfig(
@@ -58,6 +84,9 @@ MACI_CONFIG = DatabaseConfig(
         'dbname': os.getenv('MACI_DB_NAME'),
         'user': os.getenv('MACI_DB_USER'),
         'password': os.getenv('MACI_DB_PASSWORD')
+    },
+    table_options={
+        'contributions': {'fetch_size': '50000'}
     }
 )
 
@@ -87,6 +116,11 @@ INDEXER_CONFIG = DatabaseConfig(
         'dbname': os.getenv('INDEXER_DB_NAME'),
         'user': os.getenv('INDEXER_DB_USER'),
         'password': os.getenv('INDEXER_DB_PASSWORD')
+    },
+    table_options={
+        # Full scans of the largest tables on every base view rebuild
+        'donations': {'fetch_size': '50000'},
+        'applications': {'fetch_size': '50000'}
     }
 )
 
@@ -205,11 +239,7 @@ def run_query(query: str, db_params: Dict) -> Optional[pd.DataFrame]:
     """Run a query and return the results as a DataFrame."""
     try:
         with pg.connect(**db_params) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query)
-                col_names = [desc[0] for desc in cur.description]
-                results = pd.DataFrame(cur.fetchall(), columns=col_names)
-                return results
+            return read_query(conn, query)
     except pg.Error as e:
         logger.error(f"ERROR: Could not execute the query. {e}")
         return None
@@ -268,6 +298,57 @@ def create_table_from_definition(
     )
     execute_command(create_command, db_params)
 
+def parse_fdw_options(options: Optional[List[str]]) -> Dict[str, str]:
+    """Turn a srvoptions/ftoptions array ('key=value' entries) into a dict."""
+    return dict(option.split('=', 1) for option in options or [])
+
+def fdw_options_clause(current: Dict[str, str], desired: Dict[str, str]) -> Optional[str]:
+    """Return the OPTIONS (...) clause that turns the managed options in current into desired, or None if they match."""
+    actions = []
+    for option in MANAGED_FDW_OPTIONS:
+        value = desired.get(option)
+        if value is None:
+            if option in current:
+                actions.append(f"DROP {option}")
+        elif current.get(option) != value:
+            quoted = str(value).replace("'", "''")
+            actions.append(f"{'SET' if option in current else 'ADD'} {option} '{quoted}'")
+    if not actions:
+        return None
+    return f"OPTIONS ({', '.join(actions)})"
+
+def sync_fdw_options(config: DatabaseConfig, db_params: Dict) -> None:
+    """Apply the server and table options of a configuration with ALTER SERVER / ALTER FOREIGN TABLE.
+
+    Managed options that are no longer configured are dropped, so removing
+    an option from the configuration restores the postgres_fdw default.
+    """
+    servers = run_query(f"""
+    SELECT srvoptions FROM pg_foreign_server WHERE srvname = '{config.server}'
+    """, db_params)
+    if servers is None or servers.empty:
+        logger.warning(f"Foreign server {config.server} does not exist, skipping its options")
+        return
+    clause = fdw_options_clause(parse_fdw_options(servers['srvoptions'][0]), config.server_options)
+    if clause:
+        logger.info(f"Setting options of server {config.server}: {clause}")
+        execute_command(f"ALTER SERVER {config.server} {clause};", db_params)
+
+    tables = run_query(f"""
+    SELECT c.relname, t.ftoptions
+    FROM pg_foreign_table t
+    JOIN pg_class c ON c.oid = t.ftrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = '{config.schema}'
+    """, db_params)
+    if tables is None:
+        return
+    for table, options in zip(tables['relname'], tables['ftoptions']):
+        clause = fdw_options_clause(parse_fdw_options(options), config.table_options.get(table, {}))
+        if clause:
+            logger.info(f"Setting options of foreign table {config.schema}.{table}: {clause}")
+            execute_command(f"ALTER FOREIGN TABLE {config.schema}.{table} {clause};", db_params)
+
 def get_latest_schema_version(db_params: Dict) -> Optional[int]:
     """Get the latest schema version from the database, supporting 2 or 3 digit versions."""
     version_query = '''
@@ -283,6 +364,10 @@ def get_latest_schema_version(db_params: Dict) -> Optional[int]:
         return None
     
     version = version_result['latest_schema_version'][0]
+    if pd.isna(version):
+        logger.error("No schema version found in the database")
+        return None
+    version = int(version)
     logger.info(f"Found latest schema version: {version}")
     return version
 
@@ -364,6 +449,10 @@ def main():
         indexer_version = update_schema(INDEXER_CONFIG)
         if indexer_version:
             updates.append(f"Indexer to {indexer_version}")
+
+        # Keep the FDW options in sync on every run, also when no schema changed
+        for config in (MACI_CONFIG, INDEXER_CONFIG):
+            sync_fdw_options(config, DB_PARAMS)
             
         if updates:
             logger.info(f"Successfully updated schemas: {', '.join(updates)}")
@@ -4,6 +4,8 @@ import logging
 import time
 from decimal import Decimal
 
+from refresh_report import RunReport
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -178,18 +180,23 @@ def refresh_matview(connection, matview):
 
 def main():
     connection = None
+    report = RunReport('update_local_indexer_tables')
+    status = 'failed'
     try:
         connection = get_connection()
         for matview in MATVIEW_CONFIGS:
             logger.info(f"Starting refresh for materialized view {matview}")
             start_time = time.time()
-            refresh_matview(connection, matview)
+            with report.step(matview, connection, f"public.{matview}"):
+                refresh_matview(connection, matview)
             end_time = time.time()
             logger.info(f"Finished refresh for materialized view {matview} in {end_time - start_time:.2f} seconds")
+        status = 'succeeded'
     except Exception as e:
         logger.error(f"An error occurred during execution: {e}", exc_info=True)
     finally:
         if connection:
+            report.save(connection, status)
             connection.close()
 
 if __name__ == "__main__":
@@ -1,16 +1,46 @@
 import os
+import argparse
 import psycopg2
 import logging
 import time
 from decimal import Decimal
-from typing import Dict, Optional, List
-from dune_client.client import DuneClient
-import pandas as pd 
+from typing import Callable, Dict, Optional, List
+from functools import partial
 import hashlib
+import json
+import re
+import requests
 
+from dune_loader import ingest_leaderboard_events
+from dune_results import get_latest_execution_id
+from matview_stats import collect_view_stats, compare_stats, estimate_row_count
+from query_plans import explain_query, find_scan_regressions, get_stored_plans, save_plans
+from refresh_report import RunReport, report_step
+from refresh_scheduler import critical_path_costs, run_dag, topological_order
+from sql_dependencies import find_relation_references, rewrite_relations
 
+
+# Limits donations and applications to 1000 rows; dependent views are then incoherent.
+# For realistic local runs use scripts/synthetic_indexer.py instead.
 TEST_MODE = False
 
+# Number of worker connections used to build independent views in parallel
+REFRESH_WORKERS = int(os.environ.get('REFRESH_WORKERS', 4))
+
+# Swaps wait at most this long for their locks, so that they never queue
+# readers behind them for longer, and are retried this many times before
+# a final attempt without a timeout
+SWAP_LOCK_TIMEOUT = os.environ.get('SWAP_LOCK_TIMEOUT', '5s')
+SWAP_LOCK_RETRIES = int(os.environ.get('SWAP_LOCK_RETRIES', 10))
+
+# Schemas the indexer and MACI tables are read from. These are the
+# postgres_fdw foreign schemas by default; set them to indexer_mirror and
+# maci_mirror to read the local copies made by mirror_tables.py instead.
+SOURCE_SCHEMAS = {
+    'indexer': os.environ.get('INDEXER_SOURCE_SCHEMA', 'indexer'),
+    'maci': os.environ.get('MACI_SOURCE_SCHEMA', 'maci')
+}
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -40,27 +70,52 @@ BASE_MATVIEWS = {
     'applications': {
         'index_columns': ['id', 'chain_id', 'round_id'],
         'order_by': 'id DESC, chain_id DESC, round_id DESC',
-        'amount_column': None
+        'amount_column': None,
+        'merge_strategy': 'anti_join',
+        'secondary_indexes': [
+            {'columns': ['round_id', 'chain_id']},
+            {'columns': ['project_id']}
+        ],
+        'fingerprint_aggregates': [
+            'COUNT(*)', 'MAX(created_at_block)', 'MAX(status_updated_at_block)',
+            'SUM(total_amount_donated_in_usd)'
+        ]
     },
     'rounds': {
         'index_columns': ['id', 'chain_id'],
         'order_by': 'id DESC, chain_id DESC',
-        'amount_column': 'total_amount_donated_in_usd + CASE WHEN matching_distribution IS NOT NULL THEN match_amount_in_usd ELSE 0 END'
+        'amount_column': 'total_amount_donated_in_usd + CASE WHEN matching_distribution IS NOT NULL THEN match_amount_in_usd ELSE 0 END',
+        'fingerprint_aggregates': [
+            'COUNT(*)', 'MAX(created_at_block)', 'MAX(updated_at_block)',
+            'SUM(total_amount_donated_in_usd)', 'SUM(match_amount_in_usd)', 'COUNT(matching_distribution)'
+        ]
     },
      'donations': {
          'index_columns': ['id'],
          'order_by': 'id DESC',
-         'amount_column': 'amount_in_usd'
+         'amount_column': 'amount_in_usd',
+         'watermark_column': 'block_number',  # new indexer rows are upserted into the chain partitions
+         'partition_by': 'chain_id',  # public.donations is a table with one partition per chain
+         'merge_strategy': 'anti_join',  # avoids sorting both tiers; see scripts/benchmark_merge_strategies.py
+         'secondary_indexes': [
+             {'columns': ['round_id', 'chain_id']},
+             {'columns': ['donor_address']},
+             {'columns': ['recipient_address']},
+             {'columns': ['timestamp'], 'method': 'brin'}
+         ],
+         'fingerprint_aggregates': ['COUNT(*)', 'MAX(block_number)', 'SUM(amount_in_usd)']
      },
     'applications_payouts': {
         'index_columns': ['id'],
         'order_by': 'id DESC',
-        'amount_column': 'amount_in_usd'
+        'amount_column': 'amount_in_usd',
+        'fingerprint_aggregates': ['COUNT(*)', 'MAX(timestamp)', 'SUM(amount_in_usd)']
     },
     'round_roles': {
         'index_columns': ['chain_id', 'round_id', 'address', 'role'],
         'order_by': 'chain_id DESC, round_id DESC, address DESC, role DESC',
-        'amount_column': None
+        'amount_column': None,
+        'fingerprint_aggregates': ['COUNT(*)', 'MAX(created_at_block)']
     },
     'allov2_distribution_events_for_leaderboard': {
         'index_columns': ['tx_timestamp', 'event_signature'],
@@ -70,26 +125,71 @@ BASE_MATVIEWS = {
     }
 }
 
+# Per-view, per-chain high-water marks (of watermark_column) of views with partition_by
+WATERMARK_TABLE = 'public.matview_refresh_watermarks'
+
+# Columns whose maxima mark changes of foreign tables read by dependent views
+FOREIGN_CHANGE_COLUMNS = [
+    'id', 'block_number', 'created_at_block', 'updated_at_block', 'status_updated_at_block',
+    'created_at', 'updated_at', 'timestamp'
+]
+
+# Source fingerprints of each view as of its last successful refresh
+FINGERPRINT_TABLE = 'public.matview_refresh_fingerprints'
+
+# Content fingerprints of the tables mirrored by mirror_tables.py, recorded with every swap
+MIRROR_FINGERPRINT_TABLE = 'public.mirror_table_fingerprints'
+
+# Completed _new views of the current (possibly interrupted) refresh
+CHECKPOINT_TABLE = 'public.matview_refresh_checkpoints'
+
+# Per-chain source fingerprints of the partitions of views with partition_by
+PARTITION_TABLE = 'public.matview_refresh_partitions'
+
+# Chains that are never loaded; partitioned views have no partition for them
+EXCLUDED_CHAIN_IDS = [11155111]
+
+DUNE_LEADERBOARD_QUERY_ID = 4118421
+
+# Besides the unique index on index_columns, every view can declare
+# secondary_indexes, each with either 'columns' or an 'expression' and an
+# optional 'method' (btree by default, e.g. brin for append-ordered
+# timestamps). They are built in parallel once {view}_new exists.
 DEPENDENT_MATVIEWS = {
     'indexer_matching': {
         'query_file': 'automations/queries/indexer_matching.sql',
         'amount_column': 'match_amount_in_usd',
-        'schema': 'public'  
+        'schema': 'public'
     },
     'all_donations': {
         'query_file': 'automations/queries/all_donations.sql',
         'amount_column': 'amount_in_usd',
-        'schema': 'public'
+        'schema': 'public',
+        'secondary_indexes': [
+            {'columns': ['round_id', 'chain_id']},
+            {'expression': 'LOWER(donor_address)'},
+            {'expression': 'LOWER(recipient_address)'},
+            {'columns': ['timestamp'], 'method': 'brin'}
+        ]
     },
     'all_matching': {
         'query_file': 'automations/queries/all_matching.sql',
         'amount_column': 'match_amount_in_usd',
-        'schema': 'public'
+        'schema': 'public',
+        'secondary_indexes': [
+            {'columns': ['round_id', 'chain_id']},
+            {'expression': 'LOWER(recipient_address)'},
+            {'columns': ['timestamp'], 'method': 'brin'}
+        ]
     },
     'allo_gmv_leaderboard_events': {
         'query_file': 'automations/queries/allo_gmv_with_ens.sql',
         'amount_column': 'gmv',
-        'schema': 'experimental_views'
+        'schema': 'experimental_views',
+        'secondary_indexes': [
+            {'expression': 'LOWER(address)'},
+            {'columns': ['tx_timestamp'], 'method': 'brin'}
+        ]
     }
 }
 
@@ -126,100 +226,168 @@ def execute_command(connection, command: str, params: tuple = None) -> None:
         connection.rollback()  # Ensure we rollback on error
         raise
 
-def get_matview_total(connection, matview: str, config: dict, schema: str = 'public') -> Optional[Decimal]:
-    amount_column = config.get('amount_column')
-    if not amount_column:
-        return None 
-
-    query = f"""
-    SELECT SUM({amount_column})
-    FROM {schema}.{matview}
-    WHERE {amount_column} IS NOT NULL
-    """
+def execute_with_lock_retries(connection, command: str) -> None:
+    """Execute a command that takes exclusive locks without blocking readers for long.
     
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-            return result[0] if result and result[0] else Decimal('0')
-    except psycopg2.Error as e:
-        logger.error(f"Error fetching matview total for {schema}.{matview}: {e}")
-        return None
+    While a statement waits for an ACCESS EXCLUSIVE lock, every new query
+    on the relation queues behind it. The command therefore gives up after
+    SWAP_LOCK_TIMEOUT and is retried with a growing pause, letting
+    long-running readers finish. The last attempt waits as long as needed.
+    """
+    for attempt in range(SWAP_LOCK_RETRIES):
+        try:
+            execute_command(connection, f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';\n{command}")
+            return
+        except psycopg2.errors.LockNotAvailable:
+            logger.warning(f"Could not get locks within {SWAP_LOCK_TIMEOUT} (attempt {attempt + 1}), retrying...")
+            time.sleep(min(2 ** attempt, 60))
+    logger.warning(f"Locks still busy after {SWAP_LOCK_RETRIES} attempts, waiting for them")
+    execute_command(connection, command)
 
-def cleanup_leftover_views(connection) -> None:
-    """Clean up any leftover _new views and tables from previous failed runs."""
+def cleanup_leftover_views(connection, keep: Optional[List[str]] = None) -> None:
+    """Clean up any leftover _new views and tables from previous failed runs.
+    
+    Args:
+        keep (list): Views whose checkpointed _new version is reused by this
+            run; everything else is dropped together with its checkpoint
+    """
     logger.info("Cleaning up any leftover _new views and tables...")
+    keep = keep or []
     
     cleanup_commands = []
     
     # Clean up base views
-    for matview in BASE_MATVIEWS.keys():
-        cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS public.{matview}_new CASCADE;")
+    for matview, config in BASE_MATVIEWS.items():
+        if is_partitioned(config):
+            # An interrupted full rebuild leaves a partitioned _new table and its partitions
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                SELECT relname, relkind FROM pg_class
+                WHERE relnamespace = 'public'::regnamespace
+                AND (relname = %s OR relname LIKE %s) AND relkind IN ('r', 'p', 'm')
+                """, (f"{matview}_new", f"{matview}\\_chain\\_%\\_new"))
+                leftovers = cursor.fetchall()
+            connection.rollback()
+            cleanup_commands.extend(drop_relation_sql(relkind, 'public', name) for name, relkind in leftovers)
+        elif matview not in keep:
+            cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS public.{matview}_new CASCADE;")
     
     # Clean up dependent views
     for matview, config in DEPENDENT_MATVIEWS.items():
         schema = config.get('schema', 'public')
-        cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_new CASCADE;")
+        if matview not in keep:
+            cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_new CASCADE;")
     
+    kept = ', '.join(f"'{matview}'" for matview in keep)
+    cleanup_commands.append(
+        f"DELETE FROM {CHECKPOINT_TABLE}" + (f" WHERE matview NOT IN ({kept});" if keep else ";")
+    )
     execute_command(connection, "\n".join(cleanup_commands))
 
-# Add new function for Dune refresh
-def refresh_dune_base_view(connection, dune_api_key: str) -> None:
-    """Refresh the Dune-based view using the API."""
-    try:
-        # Initialize Dune client and get query results
-        logger.info("Initializing Dune client")
-        dune = DuneClient(dune_api_key)
-        logger.info("Fetching latest results from query 4118421")
-        query_result = dune.get_latest_result(4118421)
-        logger.info("Successfully retrieved query results")
-        query_result_df = pd.DataFrame(query_result.result.rows)
-        # Sort dataframe and add row number column
-        query_result_df = query_result_df.sort_values(by=['tx_timestamp','role', 'address', 'gmv'])
-        query_result_df['row_number'] = range(1, len(query_result_df) + 1)
-        
-        # Create hash_id by concatenating and hashing relevant columns
-        query_result_df['event_signature'] = query_result_df.apply(
-            lambda row: hashlib.sha256(
-                f"{row['tx_timestamp']}{row['tx_hash']}{row['address']}{row['gmv']}{row['role']}{row['row_number']}".encode()
-            ).hexdigest(),
-            axis=1
-        )
+def ensure_checkpoint_table(connection) -> None:
+    """Create the checkpoint table if it is missing."""
+    execute_command(connection, f"""
+    CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+        matview text PRIMARY KEY,
+        fingerprint text NOT NULL,
+        built_at timestamptz NOT NULL DEFAULT now()
+    );
+    """)
 
-        # validation
-        if len(query_result_df) == 0:
-            raise ValueError("Empty result set from Dune")
+def save_checkpoint(connection, matview: str, fingerprint: str) -> None:
+    """Record that {matview}_new is complete and which source fingerprint it was built from."""
+    execute_command(connection, f"""
+    INSERT INTO {CHECKPOINT_TABLE} (matview, fingerprint, built_at)
+    VALUES (%s, %s, now())
+    ON CONFLICT (matview) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, built_at = EXCLUDED.built_at;
+    """, (matview, fingerprint))
 
-        # Convert dataframe to SQL values
-        values = []
-        for _, row in query_result_df.iterrows():
-            value_list = [
-                f"'{str(v)}'" if isinstance(v, (str, pd.Timestamp)) else str(v) if v is not None else 'NULL'
-                for v in row.values
-            ]
-            values.append(f"({', '.join(value_list)})")
+def find_reusable_views(
+    connection,
+    rebuilt_views: List[str],
+    dependencies: Dict[str, List[str]],
+    fingerprints: Dict[str, Optional[str]],
+    concurrent_views: Optional[List[str]] = None
+) -> List[str]:
+    """Return the views whose _new version left behind by an interrupted run can be swapped in as is.
+    
+    A _new view is reusable if it still exists, its checkpoint was recorded
+    with the current source fingerprint, and every view it reads that is
+    rebuilt in this run is reusable as well (a rebuilt input is dropped
+    with CASCADE, taking the _new views that read it along). Partitioned
+    views have no _new version; they are refreshed in place on every run
+    and skip the chains that are already up to date. The same goes for
+    concurrent_views, which are refreshed in place in this run.
+    """
+    in_place = set(concurrent_views or []) | {
+        view for view in rebuilt_views if is_partitioned(BASE_MATVIEWS.get(view, {}))
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT matview, fingerprint FROM {CHECKPOINT_TABLE}")
+        checkpoints = dict(cursor.fetchall())
+        reusable = []
+        for matview in topological_order({view: [up for up in dependencies[view] if up in rebuilt_views] for view in rebuilt_views}):
+            fingerprint = fingerprints.get(matview)
+            if matview in in_place or fingerprint is None or checkpoints.get(matview) != fingerprint:
+                continue
+            if any(up in rebuilt_views and up not in reusable and up not in in_place for up in dependencies[matview]):
+                continue
+            cursor.execute(
+                "SELECT to_regclass(%s) IS NOT NULL",
+                (f"{get_view_schema(matview)}.{matview}_new",)
+            )
+            if cursor.fetchone()[0]:
+                reusable.append(matview)
+    connection.rollback()
+    return reusable
 
-        create_command = f"""
+# Add new function for Dune refresh
+def refresh_dune_base_view(connection, dune_api_key: str, full_refresh: bool = False) -> None:
+    """Bring the Dune store up to date through the API and create the view from it.
+    
+    Only the rows after the last ingested one are fetched, unless
+    full_refresh is set or nothing was ingested yet.
+    """
+    try:
+        ingest_leaderboard_events(
+            connection, dune_api_key, DUNE_LEADERBOARD_QUERY_ID, get_dune_store('allov2_distribution_events_for_leaderboard'),
+            full_refresh
+        )
+        execute_command(connection, f"""
         DROP MATERIALIZED VIEW IF EXISTS public.allov2_distribution_events_for_leaderboard_new CASCADE;
         CREATE MATERIALIZED VIEW public.allov2_distribution_events_for_leaderboard_new AS
-        SELECT * FROM (
-            VALUES {','.join(values)}
-        ) AS t({', '.join(f'"{col}"' for col in query_result_df.columns)});
-        """
-
-        execute_command(connection, create_command)
-        logger.info(f"Successfully created materialized view with {len(query_result_df)} rows")
+        SELECT * FROM {get_dune_store('allov2_distribution_events_for_leaderboard')};
+        """)
+        logger.info("Successfully created materialized view from the Dune store")
 
     except Exception as e:
         logger.error(f"Failed to refresh Dune view: {e}")
         raise
 
+def get_dune_store(matview: str) -> str:
+    """Return the table the rows of a Dune view are ingested into."""
+    return f"public.{matview}_store"
 
-def create_base_matview(connection, matview: str, config: dict, test_mode: bool = False) -> None:
-    """Create a new base materialized view.
+
+def chain_filter(chain_id: Optional[int] = None, alias: str = '') -> str:
+    """Return the chain predicate of the source queries: one chain, or all chains that are not excluded."""
+    if chain_id is not None:
+        return f"{alias}chain_id = {int(chain_id)}"
+    return ' AND '.join(f"{alias}chain_id != {excluded}" for excluded in EXCLUDED_CHAIN_IDS)
+
+def build_merge_query(matview: str, config: dict, test_mode: bool = False, chain_id: Optional[int] = None) -> str:
+    """Build the SELECT that merges indexer and static rows, preferring the indexer copy.
+    
+    The merge_strategy config key selects how duplicates are resolved:
+    'window' (the default) ranks the union of both tiers with ROW_NUMBER,
+    'anti_join' takes every indexer row plus the static rows whose key has
+    no indexer match. Both return the same columns, including source and
+    row_num.
     
     Args:
         test_mode (bool): If True, limits data for faster testing
+        chain_id (int): Only merge the rows of this chain, e.g. for one partition
     """
     index_columns = ', '.join(config['index_columns'])
     
@@ -231,10 +399,14 @@ def create_base_matview(connection, matview: str, config: dict, test_mode: bool
         limit1 = ""
         limit2 = ""
 
+    merge_strategy = config.get('merge_strategy', 'window')
+    if merge_strategy == 'anti_join':
+        return build_anti_join_merge_query(matview, config, limit1, limit2, chain_id)
+    if merge_strategy != 'window':
+        raise ValueError(f"Unknown merge strategy for {matview}: {merge_strategy}")
+
     # Base SQL structure with subqueries wrapped in parentheses
-    base_sql = """
-    DROP MATERIALIZED VIEW IF EXISTS public.{matview}_new CASCADE;
-    CREATE MATERIALIZED VIEW public.{matview}_new AS
+    merge_sql = """
     WITH ranked_data AS (
         SELECT 
             *,
@@ -248,70 +420,347 @@ def create_base_matview(connection, matview: str, config: dict, test_mode: bool
             ) as row_num
         FROM (
             (SELECT *, 'indexer' as source 
-            FROM indexer.{matview} 
-            WHERE chain_id != 11155111
+            FROM {indexer_schema}.{matview} 
+            WHERE {chain_filter}
             {limit1})
             UNION ALL
             (SELECT *, 'static' as source 
             FROM static_indexer_chain_data_75.{matview} 
-            WHERE chain_id != 11155111
+            WHERE {chain_filter}
             {limit2})
         ) combined_data
     )
-    SELECT * FROM ranked_data WHERE row_num = 1;
+    SELECT * FROM ranked_data WHERE row_num = 1
     """
     
-    create_command = base_sql.format(
+    return merge_sql.format(
         matview=matview,
+        indexer_schema=SOURCE_SCHEMAS['indexer'],
         index_columns=index_columns,
+        chain_filter=chain_filter(chain_id),
         limit1=limit1,
         limit2=limit2
     )
+
+def build_anti_join_merge_query(
+    matview: str,
+    config: dict,
+    limit1: str = "",
+    limit2: str = "",
+    chain_id: Optional[int] = None
+) -> str:
+    """Build the anti-join merge: all indexer rows, plus static rows without an indexer match.
     
-    execute_command(connection, create_command)
+    This avoids sorting the union of both tiers. The indexer rows are read
+    once into a materialized CTE, and the static tier is scanned once and
+    anti-joined against it, typically by hashing the CTE's keys. An index
+    on the static keys would not help: every static row without a match is
+    returned, so the static tier is always the outer side. Like the
+    primary keys they mirror, index_columns must be unique and non-null
+    within each tier.
+    """
+    key_match = ' AND '.join(
+        f"i.{column} = s.{column}" for column in config['index_columns']
+    )
+    merge_sql = """
+    WITH indexer_data AS MATERIALIZED (
+        SELECT *
+        FROM {indexer_schema}.{matview}
+        WHERE {chain_filter}
+        {limit1}
+    )
+    (SELECT *, 'indexer' as source, 1::bigint as row_num
+    FROM indexer_data)
+    UNION ALL
+    (SELECT s.*, 'static' as source, 1::bigint as row_num
+    FROM static_indexer_chain_data_75.{matview} s
+    WHERE {static_chain_filter}
+    AND NOT EXISTS (
+        SELECT 1 FROM indexer_data i
+        WHERE {key_match}
+    )
+    {limit2})
+    """
 
-def create_dependent_matview(connection, matview: str, config: dict) -> None:
-    query_file = config['query_file']
-    schema = config.get('schema', 'public')
+    return merge_sql.format(
+        matview=matview,
+        indexer_schema=SOURCE_SCHEMAS['indexer'],
+        key_match=key_match,
+        chain_filter=chain_filter(chain_id),
+        static_chain_filter=chain_filter(chain_id, 's.'),
+        limit1=limit1,
+        limit2=limit2
+    )
+
+def ensure_watermark_table(connection) -> None:
+    """Create the watermark table used by incremental refreshes if it is missing."""
+    execute_command(connection, f"""
+    CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+        matview text NOT NULL,
+        chain_id integer NOT NULL,
+        watermark numeric NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (matview, chain_id)
+    );
+    """)
+
+def get_stored_watermarks(connection, matview: str) -> Dict[int, Decimal]:
+    """Return the per-chain watermarks recorded by the last incremental refresh."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT chain_id, watermark FROM {WATERMARK_TABLE} WHERE matview = %s",
+            (matview,)
+        )
+        return {chain_id: watermark for chain_id, watermark in cursor.fetchall()}
+
+def get_source_watermarks(connection, matview: str, config: dict) -> Dict[int, Decimal]:
+    """Return the current per-chain maximum of the watermark column in the indexer.
     
-    with open(query_file, 'r') as file:
-        query = file.read()
+    The aggregate is pushed down to the indexer by postgres_fdw, so this only
+    transfers one row per chain.
+    """
+    watermark_column = config['watermark_column']
+    query = f"""
+    SELECT chain_id, MAX({watermark_column})
+    FROM {SOURCE_SCHEMAS['indexer']}.{matview}
+    WHERE {chain_filter()}
+    GROUP BY chain_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        return {
+            chain_id: watermark
+            for chain_id, watermark in cursor.fetchall()
+            if watermark is not None
+        }
 
-    if matview == 'allo_gmv_leaderboard_events':
-        # Find the first CTE
-        with_start = query.find('WITH')
-        first_select = query.find('SELECT', with_start)
-        
-        # Insert our table mappings right after the WITH
-        base_tables_cte = """
-            donations AS (SELECT * FROM public.donations_new),
-            rounds AS (SELECT * FROM public.rounds_new),
-            applications AS (SELECT * FROM public.applications_new),
-            applications_payouts AS (SELECT * FROM public.applications_payouts_new),
-            allov2_distribution_events_for_leaderboard AS (SELECT * FROM public.allov2_distribution_events_for_leaderboard_new),
-            chain_mapping AS (
-        """
-        
-        # Stitch it together
-        new_query = (
-            query[:with_start + 4] +  # "WITH"
-            "\n" + base_tables_cte + 
-            query[first_select:]  # start from the SELECT of first CTE
+def find_chains_changed_below_watermark(
+    connection,
+    matview: str,
+    config: dict,
+    stored_watermarks: Dict[int, Decimal],
+    stored_fingerprints: Dict[int, str]
+) -> List[int]:
+    """Return the chains whose indexer rows changed at or below their stored watermark.
+    
+    The fingerprint stored with a chain's watermark hashes the aggregates in
+    fingerprint_aggregates over all of its rows at that time. Recomputing
+    them over the rows at or below the watermark gives the same hash unless
+    such a row was updated or deleted since, which the watermark alone
+    cannot see. Changes that leave every aggregate unchanged stay invisible,
+    so the aggregates should cover the columns that change in place (e.g.
+    MAX(status_updated_at_block)). Chains without a stored fingerprint count
+    as changed.
+    """
+    chains = sorted(chain_id for chain_id in stored_watermarks if chain_id in stored_fingerprints)
+    changed = sorted(chain_id for chain_id in stored_watermarks if chain_id not in stored_fingerprints)
+    if not chains:
+        return changed
+    watermark_column = config['watermark_column']
+    aggregates = ', '.join(config.get('fingerprint_aggregates', ['COUNT(*)']))
+    predicates = ' OR '.join(
+        f"(chain_id = %s AND ({watermark_column} <= %s OR {watermark_column} IS NULL))" for _ in chains
+    )
+    params = [value for chain_id in chains for value in (chain_id, stored_watermarks[chain_id])]
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT chain_id, {aggregates}
+        FROM {SOURCE_SCHEMAS['indexer']}.{matview}
+        WHERE {chain_filter()}
+        AND ({predicates})
+        GROUP BY chain_id
+        """, tuple(params))
+        below = {row[0]: hash_text(json.dumps(list(row[1:]), default=str)) for row in cursor.fetchall()}
+    connection.rollback()
+    changed.extend(chain_id for chain_id in chains if below.get(chain_id) != stored_fingerprints[chain_id])
+    return sorted(changed)
+
+def get_table_columns(connection, schema: str, table: str) -> List[str]:
+    """Return the column names of a table in ordinal order."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+        ORDER BY ordinal_position
+        """, (schema, table))
+        return [row[0] for row in cursor.fetchall()]
+
+def watermark_insert_sql(matview: str, watermarks: Dict[int, Decimal]) -> str:
+    """Build the statements that replace the stored watermarks of a view."""
+    values = ', '.join(
+        f"('{matview}', {int(chain_id)}, {watermark})"
+        for chain_id, watermark in sorted(watermarks.items())
+    )
+    commands = [f"DELETE FROM {WATERMARK_TABLE} WHERE matview = '{matview}';"]
+    if values:
+        commands.append(
+            f"INSERT INTO {WATERMARK_TABLE} (matview, chain_id, watermark) VALUES {values};"
         )
-        
-        logger.info(f"Original query start:\n{query[:500]}...")
-        logger.info(f"Modified query start:\n{new_query[:500]}...")
-        
-        query = new_query
-    else:
-        # For other views, use the existing string replacement logic
-        for view in list(BASE_MATVIEWS.keys()) + list(DEPENDENT_MATVIEWS.keys()):
-            from_pattern = f"FROM {view} "
-            if from_pattern in query:
-                query = query.replace(from_pattern, f"FROM {view}_new ")
-            join_pattern = f"JOIN {view} "
-            if join_pattern in query:
-                query = query.replace(join_pattern, f"JOIN {view}_new ")
+    return "\n".join(commands)
+
+def watermark_upsert_sql(matview: str, watermarks: Dict[int, Decimal]) -> str:
+    """Build the statement that sets the stored watermarks of some chains, keeping the others."""
+    if not watermarks:
+        return ""
+    values = ', '.join(
+        f"('{matview}', {int(chain_id)}, {watermark})"
+        for chain_id, watermark in sorted(watermarks.items())
+    )
+    return f"""
+    INSERT INTO {WATERMARK_TABLE} (matview, chain_id, watermark) VALUES {values}
+    ON CONFLICT (matview, chain_id) DO UPDATE
+    SET watermark = EXCLUDED.watermark, updated_at = now();
+    """
+
+def get_query_columns(connection, query: str) -> List[str]:
+    """Return the column names a query produces without fetching any rows."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+        return [desc[0] for desc in cursor.description]
+
+def apply_incremental_changes(
+    connection,
+    matview: str,
+    config: dict,
+    stored_watermarks: Dict[int, Decimal],
+    source_watermarks: Dict[int, Decimal],
+    target: str
+) -> None:
+    """Upsert indexer rows above the stored watermarks into target, a partitioned view.
+    
+    Rows updated or deleted at or below a watermark are not seen here;
+    callers rebuild the chains find_chains_changed_below_watermark
+    reports before upserting the others.
+    """
+    watermark_column = config['watermark_column']
+    predicates = []
+    params = []
+    for chain_id, source_watermark in sorted(source_watermarks.items()):
+        stored_watermark = stored_watermarks.get(chain_id)
+        if stored_watermark is None:
+            predicates.append("chain_id = %s")
+            params.append(chain_id)
+        elif source_watermark > stored_watermark:
+            predicates.append(f"(chain_id = %s AND {watermark_column} > %s)")
+            params.extend([chain_id, stored_watermark])
+
+    if not predicates:
+        logger.info(f"No new indexer rows for {matview}, {target} is up to date")
+        return
+
+    columns = get_table_columns(connection, *target.split('.', 1))
+    key_columns = get_key_columns(config)
+    update_columns = ', '.join(
+        f'"{column}" = EXCLUDED."{column}"'
+        for column in columns
+        if column not in key_columns
+    )
+    upsert_command = f"""
+    INSERT INTO {target}
+    SELECT *, 'indexer' as source, 1::bigint as row_num
+    FROM {SOURCE_SCHEMAS['indexer']}.{matview}
+    WHERE {chain_filter()}
+    AND ({' OR '.join(predicates)})
+    ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {update_columns};
+    {watermark_upsert_sql(matview, source_watermarks)}
+    """
+    logger.info(f"Upserting new indexer rows for {matview} on {len(predicates)} chain(s)...")
+    execute_command(connection, upsert_command, tuple(params))
+
+def create_base_matview(connection, matview: str, config: dict, test_mode: bool = False) -> None:
+    """Create a new base materialized view.
+    
+    Args:
+        test_mode (bool): If True, limits data for faster testing
+    """
+    select_sql = build_merge_query(matview, config, test_mode)
+
+    create_command = f"""
+    DROP MATERIALIZED VIEW IF EXISTS public.{matview}_new CASCADE;
+    CREATE MATERIALIZED VIEW public.{matview}_new AS
+    {select_sql};
+    """
+    
+    execute_command(connection, create_command)
+
+def get_view_schema(matview: str) -> str:
+    """Return the schema a managed view lives in."""
+    if matview in DEPENDENT_MATVIEWS:
+        return DEPENDENT_MATVIEWS[matview].get('schema', 'public')
+    return 'public'
+
+def read_view_query(config: dict) -> str:
+    """Read the SQL definition of a dependent view, pointed at the configured SOURCE_SCHEMAS."""
+    with open(config['query_file'], 'r') as file:
+        query = file.read()
+    replacements = {
+        f"{reference.schema}.{reference.name}": f'{SOURCE_SCHEMAS[reference.schema]}."{reference.name}"'
+        for reference in find_relation_references(query)
+        if reference.schema in SOURCE_SCHEMAS and SOURCE_SCHEMAS[reference.schema] != reference.schema
+    }
+    return rewrite_relations(query, replacements)
+
+def get_view_dependencies() -> Dict[str, List[str]]:
+    """Map every managed view to the managed views its SQL definition reads.
+    
+    Unqualified relation names are resolved against the public schema, which
+    is where the refresh creates them.
+    """
+    managed = {
+        f"{get_view_schema(matview)}.{matview}": matview
+        for matview in list(BASE_MATVIEWS) + list(DEPENDENT_MATVIEWS)
+    }
+    dependencies = {matview: [] for matview in BASE_MATVIEWS}
+    for matview, config in DEPENDENT_MATVIEWS.items():
+        upstream = []
+        for reference in find_relation_references(read_view_query(config)):
+            name = managed.get(f"{reference.schema or 'public'}.{reference.name}")
+            if name is not None and name != matview and name not in upstream:
+                upstream.append(name)
+        dependencies[matview] = upstream
+    return dependencies
+
+def plan_refresh(dependencies: Dict[str, List[str]], views: Optional[List[str]] = None) -> List[str]:
+    """Return the views to rebuild: the requested views plus everything downstream of them.
+    
+    Every view that reads a rebuilt view has to be rebuilt as well, because
+    the swap drops the previous version of its inputs with CASCADE.
+    
+    Args:
+        dependencies: View -> views it reads, from get_view_dependencies
+        views: Views whose inputs changed; None rebuilds everything
+    """
+    if views is None:
+        return list(dependencies)
+    unknown = [matview for matview in views if matview not in dependencies]
+    if unknown:
+        raise ValueError(f"Unknown materialized views: {', '.join(unknown)}")
+
+    selected = set(views)
+    changed = True
+    while changed:
+        changed = False
+        for matview, upstream in dependencies.items():
+            if matview not in selected and selected.intersection(upstream):
+                selected.add(matview)
+                changed = True
+    return [matview for matview in dependencies if matview in selected]
+
+def create_dependent_matview(connection, matview: str, config: dict, rebuilt_views: List[str]) -> None:
+    """Create {matview}_new from its query file.
+    
+    References to views that are rebuilt in this run are pointed at their
+    _new versions; all other relations, including partitioned views (which
+    are refreshed in place), are read as they are.
+    """
+    schema = config.get('schema', 'public')
+    replacements = {
+        f"{get_view_schema(view)}.{view}": f"{get_view_schema(view)}.{view}_new"
+        for view in rebuilt_views
+        if not is_partitioned(BASE_MATVIEWS.get(view, {}))
+    }
+    query = rewrite_relations(read_view_query(config), replacements)
 
     create_command = f"""
     DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_new CASCADE;
@@ -321,40 +770,612 @@ def create_dependent_matview(connection, matview: str, config: dict) -> None:
     """
     
     logger.info(f"Creating {matview}_new with schema {schema}")
-    if matview == 'allo_gmv_leaderboard_events':
-        # Extra logging for our problematic view
-        logger.info(f"Final create command start:\n{create_command[:1000]}...")
-    
     execute_command(connection, create_command)
 
-def create_indexes(connection, matview: str, config: dict) -> None:
-    """Create indexes for a materialized view."""
+def get_key_columns(config: dict) -> List[str]:
+    """Return the unique key of a view: index_columns, plus the partition column of partitioned views."""
+    key_columns = list(config['index_columns'])
+    if config.get('partition_by') and config['partition_by'] not in key_columns:
+        # Unique indexes on a partitioned table must include the partition key
+        key_columns.append(config['partition_by'])
+    return key_columns
+
+def get_index_specs(config: dict) -> List[dict]:
+    """Return the indexes declared for a view, each with a stable name suffix.
+    
+    The unique index on index_columns comes first, followed by the
+    secondary_indexes.
+    """
+    specs = []
     if 'index_columns' in config:
-        index_columns = ', '.join(config['index_columns'])
-        index_name = f"{matview}_idx"
-        
-        index_command = f"""
-        CREATE UNIQUE INDEX IF NOT EXISTS {index_name}
-        ON public.{matview} ({index_columns});
-        """
-        
-        execute_command(connection, index_command)
+        specs.append({'columns': get_key_columns(config), 'unique': True, 'suffix': 'key'})
+    for spec in config.get('secondary_indexes', []):
+        method = spec.get('method', 'btree')
+        if 'expression' in spec:
+            parts = re.findall(r'[a-z0-9]+', spec['expression'].lower())
+        else:
+            parts = list(spec['columns'])
+        specs.append(dict(spec, suffix='_'.join(parts + ['brin' if method == 'brin' else 'idx'])))
+    return specs
+
+def get_index_name(relation: str, spec: dict) -> str:
+    """Return the name of a declared index on {relation}, kept within the 63 character limit."""
+    name = f"{relation}_{spec['suffix']}"
+    if len(name) > 63:
+        name = f"{name[:54]}_{hash_text(name)[:8]}"
+    return name
+
+def build_index_sql(schema: str, relation: str, spec: dict) -> str:
+    """Build the statement that creates a declared index on {schema}.{relation}."""
+    if 'expression' in spec:
+        elements = f"({spec['expression']})"
+    else:
+        elements = ', '.join(f'"{column}"' for column in spec['columns'])
+    return f"""
+    CREATE {'UNIQUE ' if spec.get('unique') else ''}INDEX IF NOT EXISTS {get_index_name(relation, spec)}
+    ON {schema}.{relation} USING {spec.get('method', 'btree')} ({elements});
+    """
+
+def create_index(connection, matview: str, spec: dict, live: bool = False) -> None:
+    """Create one declared index on {matview}_new, or on the live view if live is set."""
+    relation = matview if live else f"{matview}_new"
+    execute_command(connection, build_index_sql(get_view_schema(matview), relation, spec))
+
+def create_index_step(
+    connection,
+    matview: str,
+    spec: dict,
+    live: bool = False,
+    report: Optional[RunReport] = None
+) -> None:
+    """Build step for one index of {matview}_new (or of the live view)."""
+    with report_step(report, f"{matview}:index:{spec['suffix']}", connection):
+        create_index(connection, matview, spec, live)
+
+def index_swap_commands(matview: str, config: dict) -> List[str]:
+    """Return the swap statements for one view, renaming its indexes along with it.
+    
+    Index names follow the view name, so {view}_new_key becomes {view}_key
+    and the retired {view}_key becomes {view}_old_key. Otherwise the
+    next run's {view}_new indexes would collide with the live ones.
+    """
+    schema = get_view_schema(matview)
+    specs = get_index_specs(config)
+    commands = [
+        f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_old CASCADE;",
+        f"ALTER MATERIALIZED VIEW IF EXISTS {schema}.{matview} RENAME TO {matview}_old;"
+    ]
+    commands.extend(
+        f"ALTER INDEX IF EXISTS {schema}.{get_index_name(matview, spec)} RENAME TO {get_index_name(f'{matview}_old', spec)};"
+        for spec in specs
+    )
+    commands.append(f"ALTER MATERIALIZED VIEW {schema}.{matview}_new RENAME TO {matview};")
+    commands.extend(
+        f"ALTER INDEX IF EXISTS {schema}.{get_index_name(f'{matview}_new', spec)} RENAME TO {get_index_name(matview, spec)};"
+        for spec in specs
+    )
+    return commands
+
+def is_partitioned(config: dict) -> bool:
+    """Return True for views stored as a table partitioned by partition_by."""
+    return bool(config.get('partition_by'))
+
+def get_relkind(connection, schema: str, name: str) -> Optional[str]:
+    """Return the pg_class relkind of a relation, or None if it does not exist."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+        """, (schema, name))
+        row = cursor.fetchone()
+    connection.rollback()
+    return row[0] if row else None
+
+def drop_relation_sql(relkind: Optional[str], schema: str, name: str) -> str:
+    """Build the DROP statement for a relation of the given kind (nothing if it does not exist)."""
+    if relkind is None:
+        return ""
+    kind = 'MATERIALIZED VIEW' if relkind == 'm' else 'TABLE'
+    return f"DROP {kind} IF EXISTS {schema}.{name} CASCADE;"
+
+def partition_name(matview: str, chain_id: int) -> str:
+    """Return the name of the partition of public.{matview} that holds one chain."""
+    return f"{matview}_chain_{int(chain_id)}"
+
+def get_partitions(connection, matview: str) -> Dict[int, str]:
+    """Return chain id -> partition name for the partitions attached to public.{matview}."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """, (f"public.{matview}",))
+        rows = cursor.fetchall()
+    connection.rollback()
+    partitions = {}
+    for name, bound in rows:
+        match = re.search(r"IN \('?(-?\d+)'?\)", bound or '')
+        if match:
+            partitions[int(match.group(1))] = name
+    return partitions
+
+def ensure_partition_table(connection) -> None:
+    """Create the per-chain partition fingerprint table if it is missing."""
+    execute_command(connection, f"""
+    CREATE TABLE IF NOT EXISTS {PARTITION_TABLE} (
+        matview text NOT NULL,
+        chain_id integer NOT NULL,
+        fingerprint text NOT NULL,
+        refreshed_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (matview, chain_id)
+    );
+    """)
+
+def get_chain_fingerprints(connection, matview: str, config: dict) -> Dict[int, str]:
+    """Return chain id -> hash of that chain's indexer aggregates."""
+    return {
+        row[0]: hash_text(json.dumps(row[1:], default=str))
+        for row in get_indexer_fingerprint(connection, matview, config)
+    }
+
+def get_stored_chain_fingerprints(connection, matview: str) -> Dict[int, str]:
+    """Return the chain fingerprints the partitions of a view were last refreshed from."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT chain_id, fingerprint FROM {PARTITION_TABLE} WHERE matview = %s", (matview,))
+        fingerprints = dict(cursor.fetchall())
+    connection.rollback()
+    return fingerprints
+
+def chain_fingerprint_upsert_sql(matview: str, fingerprints: Dict[int, str]) -> str:
+    """Build the statement that records the fingerprints of some partitions."""
+    if not fingerprints:
+        return ""
+    values = ', '.join(
+        f"('{matview}', {int(chain_id)}, '{fingerprint}')"
+        for chain_id, fingerprint in sorted(fingerprints.items())
+    )
+    return f"""
+    INSERT INTO {PARTITION_TABLE} (matview, chain_id, fingerprint) VALUES {values}
+    ON CONFLICT (matview, chain_id) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, refreshed_at = now();
+    """
+
+def partition_index_renames(schema: str, old_name: str, new_name: str, config: dict) -> List[str]:
+    """Return the statements that rename the declared indexes of a relation along with it."""
+    return [
+        f"ALTER INDEX IF EXISTS {schema}.{get_index_name(old_name, spec)} RENAME TO {get_index_name(new_name, spec)};"
+        for spec in get_index_specs(config)
+    ]
+
+def build_partition(connection, matview: str, config: dict, parent: str, chain_id: int, test_mode: bool = False) -> str:
+    """Fill and index a standalone table with one chain's merged rows, ready to attach to public.{parent}.
+    
+    Returns the name of the table, {partition}_new. Its CHECK constraint
+    matches the partition bound, so attaching it does not scan it again.
+    """
+    staging = f"{partition_name(matview, chain_id)}_new"
+    column = config['partition_by']
+    execute_command(connection, f"""
+    DROP TABLE IF EXISTS public.{staging} CASCADE;
+    CREATE TABLE public.{staging} (LIKE public.{parent} INCLUDING DEFAULTS);
+    ALTER TABLE public.{staging} ADD CONSTRAINT partition_check
+        CHECK ({column} IS NOT NULL AND {column} = {int(chain_id)});
+    INSERT INTO public.{staging}
+    {build_merge_query(matview, config, test_mode, chain_id)};
+    """)
+    for spec in get_index_specs(config):
+        execute_command(connection, build_index_sql('public', staging, spec))
+    return staging
+
+def rebuild_partition(
+    connection,
+    matview: str,
+    config: dict,
+    chain_id: int,
+    partitions: Dict[int, str],
+    watermark: Optional[Decimal],
+    fingerprint: Optional[str]
+) -> List[str]:
+    """Rebuild, validate and swap the partition of a single chain.
+    
+    The new partition is built next to the live one; detaching the old
+    partition and attaching the new one happens in one short transaction.
+    Returns the validation warnings.
+    """
+    partition = partition_name(matview, chain_id)
+    staging = build_partition(connection, matview, config, matview, chain_id)
+    old_stats = None
+    if chain_id in partitions:
+        old_stats = collect_view_stats(
+            connection, 'public', partitions[chain_id], config.get('amount_column'), config.get('index_columns')
+        )
+    new_stats = collect_view_stats(
+        connection, 'public', staging, config.get('amount_column'), config.get('index_columns')
+    )
+    warnings = compare_stats(f"{matview} (chain {chain_id})", old_stats, new_stats)
+
+    swap_commands = []
+    if chain_id in partitions:
+        swap_commands.append(f"ALTER TABLE public.{matview} DETACH PARTITION public.{partitions[chain_id]};")
+        swap_commands.append(f"DROP TABLE public.{partitions[chain_id]};")
+    swap_commands.append(f"DROP TABLE IF EXISTS public.{partition};")
+    swap_commands.append(f"ALTER TABLE public.{staging} RENAME TO {partition};")
+    swap_commands.extend(partition_index_renames('public', staging, partition, config))
+    swap_commands.append(
+        f"ALTER TABLE public.{matview} ATTACH PARTITION public.{partition} FOR VALUES IN ({int(chain_id)});"
+    )
+    if watermark is not None:
+        swap_commands.append(watermark_upsert_sql(matview, {chain_id: watermark}))
+    if fingerprint is not None:
+        swap_commands.append(chain_fingerprint_upsert_sql(matview, {chain_id: fingerprint}))
+    execute_with_lock_retries(connection, "\n".join(swap_commands))
+    return warnings
+
+def rebuild_partitioned_view(
+    connection,
+    matview: str,
+    config: dict,
+    source_watermarks: Dict[int, Decimal],
+    chain_fingerprints: Dict[int, str],
+    test_mode: bool = False
+) -> List[str]:
+    """Build public.{matview} as a new partitioned table with every chain and swap it in.
+    
+    Used on the first run (including replacing the materialized view of
+    earlier versions), on full refreshes and when the source columns changed.
+    The replaced relation is renamed to {matview}_old and dropped during
+    cleanup, like the _old views. Returns the validation warnings.
+    """
+    column = config['partition_by']
+    merge_query = build_merge_query(matview, config, test_mode)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT DISTINCT chain_id
+        FROM static_indexer_chain_data_75.{matview}
+        WHERE {chain_filter()}
+        """)
+        chains = sorted(set(source_watermarks) | {row[0] for row in cursor.fetchall()})
+    connection.rollback()
+
+    logger.info(f"Building partitioned public.{matview}_new with {len(chains)} chain partitions...")
+    create_commands = [
+        drop_relation_sql(get_relkind(connection, 'public', f"{matview}_new"), 'public', f"{matview}_new"),
+        f"CREATE TABLE public.{matview}_template AS {merge_query} WITH NO DATA;",
+        f"CREATE TABLE public.{matview}_new (LIKE public.{matview}_template) PARTITION BY LIST ({column});",
+        f"DROP TABLE public.{matview}_template;"
+    ]
+    # Indexes on the parent are attached to the matching partition indexes
+    create_commands.extend(build_index_sql('public', f"{matview}_new", spec) for spec in get_index_specs(config))
+    execute_command(connection, "\n".join(create_commands))
+    for chain_id in chains:
+        staging = build_partition(connection, matview, config, f"{matview}_new", chain_id, test_mode)
+        execute_command(
+            connection,
+            f"ALTER TABLE public.{matview}_new ATTACH PARTITION public.{staging} FOR VALUES IN ({int(chain_id)});"
+        )
+
+    old_relkind = get_relkind(connection, 'public', matview)
+    warnings = compare_stats(
+        matview,
+        collect_view_stats(connection, 'public', matview, config.get('amount_column'), config.get('index_columns')),
+        collect_view_stats(connection, 'public', f"{matview}_new", config.get('amount_column'), config.get('index_columns'))
+    )
+
+    swap_commands = [drop_relation_sql(get_relkind(connection, 'public', f"{matview}_old"), 'public', f"{matview}_old")]
+    if old_relkind == 'm':
+        swap_commands.append(f"ALTER MATERIALIZED VIEW public.{matview} RENAME TO {matview}_old;")
+    elif old_relkind is not None:
+        swap_commands.append(f"ALTER TABLE public.{matview} RENAME TO {matview}_old;")
+        for old_partition in get_partitions(connection, matview).values():
+            swap_commands.append(f"ALTER TABLE public.{old_partition} RENAME TO {old_partition}_old;")
+            swap_commands.extend(partition_index_renames('public', old_partition, f"{old_partition}_old", config))
+    swap_commands.extend(partition_index_renames('public', matview, f"{matview}_old", config))
+    swap_commands.append(f"ALTER TABLE public.{matview}_new RENAME TO {matview};")
+    swap_commands.extend(partition_index_renames('public', f"{matview}_new", matview, config))
+    for chain_id in chains:
+        partition = partition_name(matview, chain_id)
+        swap_commands.append(f"ALTER TABLE public.{partition}_new RENAME TO {partition};")
+        swap_commands.extend(partition_index_renames('public', f"{partition}_new", partition, config))
+    swap_commands.append(f"DELETE FROM {PARTITION_TABLE} WHERE matview = '{matview}';")
+    if test_mode:
+        # A limited build must not be mistaken for a complete one
+        swap_commands.append(f"DELETE FROM {WATERMARK_TABLE} WHERE matview = '{matview}';")
+    else:
+        swap_commands.append(watermark_insert_sql(matview, source_watermarks))
+        swap_commands.append(chain_fingerprint_upsert_sql(matview, chain_fingerprints))
+    execute_with_lock_retries(connection, "\n".join(swap_commands))
+    return warnings
+
+def refresh_partitioned_view(
+    connection,
+    matview: str,
+    config: dict,
+    test_mode: bool = False,
+    full_refresh: bool = False,
+    report: Optional[RunReport] = None
+) -> None:
+    """Bring the chain partitions of public.{matview} up to date, one chain at a time.
+    
+    Unlike the other views, a partitioned view is updated in place rather
+    than swapped with a _new version at the end of the run. For each chain:
+    
+    - a chain whose aggregates are unchanged is skipped;
+    - a chain whose watermark moved forward and whose rows at or below the
+      old watermark are unchanged (see find_chains_changed_below_watermark)
+      gets the new indexer rows upserted into its partition;
+    - a chain that was reindexed (its watermark went backwards), changed
+      below its watermark or is new gets its partition rebuilt, validated
+      and swapped on its own.
+    
+    The whole table is rebuilt when it does not exist yet, on a full
+    refresh, in test mode and when the source columns changed. Excluded
+    chains never get a partition.
+    """
+    if config['partition_by'] != 'chain_id':
+        raise ValueError(f"Only chain_id partitions are supported, not {config['partition_by']} ({matview})")
+    ensure_watermark_table(connection)
+    ensure_partition_table(connection)
+    source_watermarks = get_source_watermarks(connection, matview, config)
+    chain_fingerprints = get_chain_fingerprints(connection, matview, config)
+
+    relkind = get_relkind(connection, 'public', matview)
+    columns_changed = relkind == 'p' and get_table_columns(connection, 'public', matview) != get_query_columns(
+        connection, build_merge_query(matview, config)
+    )
+    if columns_changed:
+        logger.warning(f"Columns of {matview} changed, rebuilding all partitions")
+    if relkind != 'p' or full_refresh or test_mode or columns_changed:
+        with report_step(report, f"{matview}:partitions", connection, f"public.{matview}") as record:
+            warnings = rebuild_partitioned_view(
+                connection, matview, config, source_watermarks, chain_fingerprints, test_mode
+            )
+            if record is not None:
+                record['warnings'] = warnings
+        return
+
+    partitions = get_partitions(connection, matview)
+    stored_watermarks = get_stored_watermarks(connection, matview)
+    connection.rollback()
+    stored_fingerprints = get_stored_chain_fingerprints(connection, matview)
+    chains = [chain_id for chain_id in sorted(set(partitions) | set(source_watermarks)) if chain_id not in EXCLUDED_CHAIN_IDS]
+    # A chain that disappeared from the indexer keeps only its static rows
+    fingerprints = {chain_id: chain_fingerprints.get(chain_id, hash_text('absent')) for chain_id in chains}
+    advanced = {
+        chain_id: stored_watermarks[chain_id] for chain_id in chains
+        if chain_id in partitions and stored_fingerprints.get(chain_id) != fingerprints[chain_id]
+        and source_watermarks.get(chain_id) is not None and stored_watermarks.get(chain_id) is not None
+        and source_watermarks[chain_id] > stored_watermarks[chain_id]
+    }
+    # Rows updated or deleted below the watermark cannot be upserted
+    changed_below = find_chains_changed_below_watermark(connection, matview, config, advanced, stored_fingerprints)
+    if changed_below:
+        logger.info(f"Chains {changed_below} of {matview} changed below their watermark, rebuilding their partitions")
+    upserted_chains = []
+    for chain_id in chains:
+        fingerprint = fingerprints[chain_id]
+        if chain_id in partitions and stored_fingerprints.get(chain_id) == fingerprint:
+            continue
+        source_watermark = source_watermarks.get(chain_id)
+        if chain_id in advanced and chain_id not in changed_below:
+            upserted_chains.append(chain_id)
+            continue
+        logger.info(f"Rebuilding partition of {matview} for chain {chain_id}...")
+        with report_step(report, f"{matview}:partition:{chain_id}", connection, f"public.{partition_name(matview, chain_id)}") as record:
+            warnings = rebuild_partition(
+                connection, matview, config, chain_id, partitions, source_watermark, fingerprint
+            )
+            if record is not None:
+                record['warnings'] = warnings
+
+    if upserted_chains:
+        with report_step(report, f"{matview}:upsert", connection):
+            apply_incremental_changes(
+                connection, matview, config,
+                {chain_id: stored_watermarks[chain_id] for chain_id in upserted_chains},
+                {chain_id: source_watermarks[chain_id] for chain_id in upserted_chains},
+                target=f"public.{matview}"
+            )
+            execute_command(connection, chain_fingerprint_upsert_sql(
+                matview, {chain_id: chain_fingerprints[chain_id] for chain_id in upserted_chains}
+            ))
 
-def validate_refresh(connection, matview: str, config: dict, old_total: Optional[Decimal]) -> None:
-    """Validate the refresh operation for a materialized view."""
-    new_total = get_matview_total(connection, matview, config)
+def get_view_definition(matview: str, config: dict, test_mode: bool = False) -> Optional[str]:
+    """Return the query a live view is defined by, or None if it is not defined by a fixed query.
     
-    if old_total is not None and new_total is not None:
-        if new_total < old_total:
-            logger.warning(
-                f"Total amount for {matview} has decreased: {old_total} -> {new_total}"
+    Partitioned views are tables the refresh updates chain by chain, so
+    they have no definition to re-run. The Dune view reads a store that
+    refresh_concurrently_step ingests the new Dune rows into first.
+    """
+    if matview in DEPENDENT_MATVIEWS:
+        return read_view_query(config)
+    if config.get('refresh_type') == 'dune':
+        return f"SELECT * FROM {get_dune_store(matview)}"
+    if is_partitioned(config):
+        return None
+    return build_merge_query(matview, config, test_mode)
+
+def can_refresh_concurrently(connection, matview: str, config: dict, test_mode: bool = False) -> bool:
+    """Return True if the live view can be brought up to date with REFRESH MATERIALIZED VIEW CONCURRENTLY.
+    
+    That requires a populated view with a unique index on plain columns
+    and no predicate, and a stored definition that still matches the
+    current query (compared through a temporary view, as deparsed by
+    pg_get_viewdef). Otherwise the view has to be rebuilt and swapped.
+    """
+    query = get_view_definition(matview, config, test_mode)
+    if query is None:
+        return False
+    relation = f"{get_view_schema(matview)}.{matview}"
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+            SELECT c.relispopulated AND EXISTS (
+                SELECT 1 FROM pg_index i
+                WHERE i.indrelid = c.oid AND i.indisunique AND i.indisvalid
+                AND i.indpred IS NULL AND i.indexprs IS NULL
             )
-        elif new_total > old_total:
-            logger.info(
-                f"Total amount for {matview} has increased: {old_total} -> {new_total}"
+            FROM pg_class c
+            WHERE c.oid = to_regclass(%s) AND c.relkind = 'm'
+            """, (relation,))
+            row = cursor.fetchone()
+            if not row or not row[0]:
+                return False
+            cursor.execute(f"CREATE TEMPORARY VIEW refresh_definition_check AS {query}")
+            cursor.execute(
+                "SELECT pg_get_viewdef('refresh_definition_check'::regclass) = pg_get_viewdef(to_regclass(%s))",
+                (relation,)
             )
-        else:
-            logger.info(f"Total amount for {matview} remains unchanged at {new_total}")
+            return cursor.fetchone()[0]
+    except psycopg2.Error as e:
+        logger.warning(f"Could not compare the definition of {relation}, it will be swapped: {e}")
+        return False
+    finally:
+        connection.rollback()
+
+def find_concurrent_views(
+    connection,
+    rebuilt_views: List[str],
+    dependencies: Dict[str, List[str]],
+    test_mode: bool = False,
+    full_refresh: bool = False
+) -> List[str]:
+    """Return the rebuilt views that can be refreshed in place with REFRESH ... CONCURRENTLY.
+    
+    A view whose input is swapped has to be swapped as well: its stored
+    definition points at the input's old version, which is dropped after
+    the swap. On a full refresh the Dune view is always swapped, as a full
+    reload may replace its store.
+    """
+    in_place = [view for view in rebuilt_views if is_partitioned(BASE_MATVIEWS.get(view, {}))]
+    concurrent = []
+    for matview in topological_order({view: [up for up in dependencies[view] if up in rebuilt_views] for view in rebuilt_views}):
+        if matview in in_place:
+            continue
+        if any(up in rebuilt_views and up not in in_place for up in dependencies[matview]):
+            continue
+        config = BASE_MATVIEWS.get(matview) or DEPENDENT_MATVIEWS[matview]
+        if full_refresh and config.get('refresh_type') == 'dune':
+            continue
+        if can_refresh_concurrently(connection, matview, config, test_mode):
+            in_place.append(matview)
+            concurrent.append(matview)
+    return concurrent
+
+def refresh_concurrently_step(
+    connection,
+    matview: str,
+    full_refresh: bool = False,
+    report: Optional[RunReport] = None
+) -> None:
+    """Refresh a live view in place; readers keep seeing the old rows until it commits.
+    
+    The Dune view has its new rows ingested into its store first, so only
+    those are written to the view.
+    """
+    relation = f"{get_view_schema(matview)}.{matview}"
+    if BASE_MATVIEWS.get(matview, {}).get('refresh_type') == 'dune':
+        with report_step(report, f"{matview}:ingest", connection, get_dune_store(matview)):
+            ingest_leaderboard_events(
+                connection, os.environ['DUNE_API_KEY'], DUNE_LEADERBOARD_QUERY_ID,
+                get_dune_store(matview), full_refresh
+            )
+    logger.info(f"Refreshing {relation} concurrently...")
+    with report_step(report, f"{matview}:refresh_concurrently", connection, relation):
+        execute_command(connection, f"REFRESH MATERIALIZED VIEW CONCURRENTLY {relation};")
+
+def get_planned_query(matview: str, config: dict, test_mode: bool = False) -> str:
+    """Return the query {matview}_new is built from, for planning.
+    
+    Dependent views are planned against the live versions of the views they
+    read, as the _new versions do not exist yet. The Dune view is planned
+    as a scan of its store, before the new Dune rows are ingested.
+    """
+    if matview in DEPENDENT_MATVIEWS:
+        return read_view_query(config)
+    if config.get('refresh_type') == 'dune':
+        return get_view_definition(matview, config, test_mode)
+    return build_merge_query(matview, config, test_mode)
+
+def plan_views(connection, matviews: List[str], test_mode: bool = False) -> Dict[str, Optional[dict]]:
+    """EXPLAIN the build query of every view without running it. Views that cannot be planned get None."""
+    plans = {}
+    for matview in matviews:
+        config = BASE_MATVIEWS.get(matview) or DEPENDENT_MATVIEWS[matview]
+        query = get_planned_query(matview, config, test_mode)
+        try:
+            plans[matview] = {'definition': hash_text(query), **explain_query(connection, query)}
+        except psycopg2.Error as e:
+            connection.rollback()
+            logger.warning(f"Could not plan {matview}: {e}")
+            plans[matview] = None
+    return plans
+
+def find_plan_warnings(plans: Dict[str, Optional[dict]], stored_plans: Dict[str, dict]) -> List[str]:
+    """Warn about relations that the last successful refresh read through an index and that are now scanned sequentially."""
+    warnings = []
+    for matview, plan in plans.items():
+        previous = stored_plans.get(matview)
+        if plan is None or previous is None:
+            continue
+        cause = " after a change to its query" if previous['definition'] != plan['definition'] else ""
+        for relation in find_scan_regressions(previous, plan):
+            warning = f"{matview} now reads {relation} with a sequential scan instead of an index{cause}"
+            logger.warning(warning)
+            warnings.append(warning)
+    return warnings
+
+def plan_path_costs(
+    rebuilt_views: List[str],
+    dependencies: Dict[str, List[str]],
+    plans: Dict[str, Optional[dict]]
+) -> Dict[str, float]:
+    """Return the estimated cost of every rebuilt view plus its most expensive chain of downstream views."""
+    costs = {matview: plan['total_cost'] for matview, plan in plans.items() if plan is not None}
+    return critical_path_costs(
+        {matview: [view for view in dependencies[matview] if view in rebuilt_views] for matview in rebuilt_views},
+        costs
+    )
+
+def plan_materialized_views(
+    connection,
+    test_mode: bool = False,
+    views: Optional[List[str]] = None,
+    force: bool = False
+) -> Dict[str, Optional[dict]]:
+    """Print the plan estimates of every view a refresh would rebuild, without building anything.
+    
+    Views are selected like refresh_materialized_views does. For every view
+    the estimated rows, total cost, cost of the longest chain of views
+    waiting for it and the notable plan nodes are printed, and relations
+    that lost their index scan since the last successful refresh are warned
+    about.
+    """
+    dependencies = get_view_dependencies()
+    if views is None and not force:
+        fingerprints = compute_view_fingerprints(connection, dependencies, test_mode)
+        views = find_changed_views(connection, fingerprints)
+        if not views:
+            logger.info("No view sources changed since the last refresh, nothing would be rebuilt")
+            return {}
+    rebuilt_views = plan_refresh(dependencies, views)
+    plans = plan_views(connection, rebuilt_views, test_mode)
+    warnings = find_plan_warnings(plans, get_stored_plans(connection))
+    paths = plan_path_costs(rebuilt_views, dependencies, plans)
+
+    print(f"{'view':<40}{'rows':>12}{'cost':>16}{'path cost':>16}  nodes")
+    for matview in sorted(rebuilt_views, key=lambda view: -paths[view]):
+        plan = plans[matview]
+        if plan is None:
+            print(f"{matview:<40}{'-':>12}{'-':>16}{paths[matview]:>16.0f}  (could not be planned)")
+            continue
+        nodes = ', '.join(f"{node} x{count}" for node, count in sorted(plan['nodes'].items()))
+        print(f"{matview:<40}{plan['rows']:>12}{plan['total_cost']:>16.0f}{paths[matview]:>16.0f}  {nodes}")
+    for warning in warnings:
+        print(f"WARNING: {warning}")
+    return plans
 
 def check_view_exists(connection, schema: str, matview: str) -> bool:
     """Check if a materialized view exists and log its status and data."""
@@ -373,10 +1394,8 @@ def check_view_exists(connection, schema: str, matview: str) -> bool:
             logger.info(f"View status: {'EXISTS' if exists else 'DOES NOT EXIST'}")
             if exists:
                 try:
-                    # If it exists, check its data
-                    cursor.execute(f"SELECT COUNT(*) FROM {schema}.{matview}")
-                    count = cursor.fetchone()[0]
-                    logger.info(f"Row count: {count}")
+                    # If it exists, check its data without scanning it
+                    logger.info(f"Estimated row count: {estimate_row_count(connection, schema, matview)}")
                 except psycopg2.Error as e:
                     logger.error(f"Error checking row count: {e}")
             return exists
@@ -385,86 +1404,509 @@ def check_view_exists(connection, schema: str, matview: str) -> bool:
         return False
 
 
-def refresh_materialized_views(connection, test_mode: bool = False) -> None:
+def hash_text(text: str) -> str:
+    """Return the SHA-256 hex digest of a string."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def get_indexer_fingerprint(connection, matview: str, config: dict) -> list:
+    """Return per-chain aggregates of indexer.{matview}.
+    
+    postgres_fdw pushes the aggregates down to the indexer, so only one row
+    per chain is transferred.
+    """
+    aggregates = ', '.join(config.get('fingerprint_aggregates', ['COUNT(*)']))
+    query = f"""
+    SELECT chain_id, {aggregates}
+    FROM {SOURCE_SCHEMAS['indexer']}.{matview}
+    WHERE {chain_filter()}
+    GROUP BY chain_id
+    ORDER BY chain_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        return [list(row) for row in cursor.fetchall()]
+
+def get_relation_fingerprint(connection, schema: str, name: str) -> Optional[str]:
+    """Return a cheap change marker for a relation that is not managed by this script.
+    
+    Local tables and materialized views use their cumulative
+    insert/update/delete counters from pg_stat_all_tables. The mirrors of
+    mirror_tables.py get new partitions on every run, so they use the
+    content fingerprint the mirror recorded in MIRROR_FINGERPRINT_TABLE;
+    other partitioned tables use the counters of every leaf partition, with
+    its relfilenode, so a partition that was replaced counts as changed.
+    Foreign tables use the maxima of their
+    FOREIGN_CHANGE_COLUMNS, which postgres_fdw pushes down as one remote
+    aggregate instead of counting the remote table. A foreign table without
+    any of those columns, and other relation kinds, return None, which
+    means "assume changed".
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        SELECT c.oid, c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+        """, (schema, name))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        oid, relkind = row
+        if relkind == 'f':
+            cursor.execute("""
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = %s AND attnum > 0 AND NOT attisdropped AND attname = ANY(%s)
+            """, (oid, FOREIGN_CHANGE_COLUMNS))
+            columns = sorted(row[0] for row in cursor.fetchall())
+            if not columns:
+                return None
+            maxima = ', '.join(f'MAX("{column}")' for column in columns)
+            cursor.execute(f'SELECT {maxima} FROM "{schema}"."{name}"')
+            return f"max:{':'.join(f'{column}={value}' for column, value in zip(columns, cursor.fetchone()))}"
+        if relkind in ('r', 'm'):
+            cursor.execute("""
+            SELECT n_tup_ins, n_tup_upd, n_tup_del
+            FROM pg_stat_all_tables
+            WHERE relid = %s
+            """, (oid,))
+            stats = cursor.fetchone()
+            return f"stats:{oid}:{stats[0]}:{stats[1]}:{stats[2]}" if stats else None
+        if relkind == 'p':
+            cursor.execute("SELECT to_regclass(%s)", (MIRROR_FINGERPRINT_TABLE,))
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(
+                    f"SELECT fingerprint FROM {MIRROR_FINGERPRINT_TABLE} WHERE schema_name = %s AND table_name = %s",
+                    (schema, name)
+                )
+                mirrored = cursor.fetchone()
+                if mirrored is not None:
+                    return f"mirror:{mirrored[0]}"
+            cursor.execute("""
+            SELECT t.relid::regclass::text, c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del
+            FROM pg_partition_tree(%s) t
+            JOIN pg_class c ON c.oid = t.relid
+            LEFT JOIN pg_stat_all_tables s ON s.relid = t.relid
+            WHERE t.isleaf
+            ORDER BY 1
+            """, (oid,))
+            leaves = cursor.fetchall()
+            return "partitions:" + hash_text(json.dumps(leaves)) if leaves else f"partitions:{oid}:empty"
+    return None
+
+def compute_view_fingerprints(
+    connection,
+    dependencies: Dict[str, List[str]],
+    test_mode: bool = False
+) -> Dict[str, Optional[str]]:
+    """Fingerprint the sources and definition of every managed view.
+    
+    Base views hash their view definition, the per-chain indexer aggregates
+    in fingerprint_aggregates and the static tier table. The Dune view hashes
+    the latest execution id. Dependent views hash their SQL file, the
+    fingerprints of the managed views they read and the change markers of
+    every other relation they read. A None fingerprint means the sources
+    could not be fingerprinted and the view is always rebuilt.
+    """
+    fingerprints = {}
+    for matview in dependencies:
+        try:
+            if matview in BASE_MATVIEWS:
+                config = BASE_MATVIEWS[matview]
+                if config.get('refresh_type') == 'dune':
+                    dune_api_key = os.environ.get('DUNE_API_KEY')
+                    if not dune_api_key:
+                        fingerprints[matview] = None
+                        continue
+                    parts = {
+                        'dune_execution_id': get_latest_execution_id(dune_api_key, DUNE_LEADERBOARD_QUERY_ID)
+                    }
+                    markers = [parts['dune_execution_id']]
+                else:
+                    parts = {
+                        'definition': hash_text(build_merge_query(matview, config, test_mode)),
+                        'config': config,
+                        'indexer': get_indexer_fingerprint(connection, matview, config),
+                        'static': get_relation_fingerprint(connection, 'static_indexer_chain_data_75', matview)
+                    }
+                    markers = [parts['static']]
+            else:
+                config = DEPENDENT_MATVIEWS[matview]
+                query = read_view_query(config)
+                managed = {f"{get_view_schema(view)}.{view}" for view in dependencies}
+                external = sorted({
+                    f"{reference.schema or 'public'}.{reference.name}"
+                    for reference in find_relation_references(query)
+                } - managed)
+                parts = {
+                    'definition': hash_text(query),
+                    'upstream': {view: fingerprints[view] for view in dependencies[matview]},
+                    'external': {
+                        relation: get_relation_fingerprint(connection, *relation.split('.', 1))
+                        for relation in external
+                    }
+                }
+                markers = list(parts['upstream'].values()) + list(parts['external'].values())
+            if None in markers:
+                fingerprints[matview] = None
+            else:
+                fingerprints[matview] = hash_text(json.dumps(parts, sort_keys=True, default=str))
+        except (psycopg2.Error, requests.RequestException) as e:
+            logger.warning(f"Could not fingerprint sources of {matview}, it will be rebuilt: {e}")
+            connection.rollback()
+            fingerprints[matview] = None
+    return fingerprints
+
+def ensure_fingerprint_table(connection) -> None:
+    """Create the fingerprint table if it is missing."""
+    execute_command(connection, f"""
+    CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} (
+        matview text PRIMARY KEY,
+        fingerprint text NOT NULL,
+        refreshed_at timestamptz NOT NULL DEFAULT now()
+    );
+    """)
+
+def find_changed_views(connection, fingerprints: Dict[str, Optional[str]]) -> List[str]:
+    """Return the views whose fingerprint differs from the last successful refresh."""
+    ensure_fingerprint_table(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT matview, fingerprint FROM {FINGERPRINT_TABLE}")
+        stored = dict(cursor.fetchall())
+        changed = []
+        for matview, fingerprint in fingerprints.items():
+            cursor.execute(
+                "SELECT to_regclass(%s) IS NOT NULL",
+                (f"{get_view_schema(matview)}.{matview}",)
+            )
+            exists = cursor.fetchone()[0]
+            if fingerprint is None or not exists or stored.get(matview) != fingerprint:
+                changed.append(matview)
+    connection.rollback()
+    return changed
+
+def save_fingerprints(connection, fingerprints: Dict[str, Optional[str]]) -> None:
+    """Record the fingerprints the rebuilt views were built from."""
+    commands = []
+    for matview, fingerprint in fingerprints.items():
+        if fingerprint is None:
+            commands.append(f"DELETE FROM {FINGERPRINT_TABLE} WHERE matview = '{matview}';")
+        else:
+            commands.append(f"""
+            INSERT INTO {FINGERPRINT_TABLE} (matview, fingerprint, refreshed_at)
+            VALUES ('{matview}', '{fingerprint}', now())
+            ON CONFLICT (matview) DO UPDATE
+            SET fingerprint = EXCLUDED.fingerprint, refreshed_at = EXCLUDED.refreshed_at;
+            """)
+    if commands:
+        execute_command(connection, "\n".join(commands))
+
+def build_base_view(
+    connection,
+    matview: str,
+    config: dict,
+    test_mode: bool = False,
+    full_refresh: bool = False,
+    report: Optional[RunReport] = None
+) -> None:
+    """Create {matview}_new for a base view. Its indexes are separate steps.
+    
+    Partitioned views are refreshed in place instead, partition by partition.
+    """
+    if is_partitioned(config):
+        logger.info(f"Refreshing the partitions of {matview}...")
+        with report_step(report, f"{matview}:create", connection, f"public.{matview}"):
+            refresh_partitioned_view(connection, matview, config, test_mode, full_refresh, report)
+        return
+    logger.info(f"Creating {matview}_new...")
+    with report_step(report, f"{matview}:create", connection, f"public.{matview}_new"):
+        if config.get('refresh_type') == 'dune':
+            refresh_dune_base_view(connection, os.environ['DUNE_API_KEY'], full_refresh)
+        else:
+            create_base_matview(connection, matview, config, test_mode)
+
+def build_dependent_view(
+    connection,
+    matview: str,
+    config: dict,
+    rebuilt_views: List[str],
+    report: Optional[RunReport] = None
+) -> None:
+    """Create {matview}_new for a dependent view. Its indexes are separate steps."""
+    logger.info(f"Creating {matview}_new...")
+    schema = config.get('schema', 'public')
+    with report_step(report, f"{matview}:create", connection, f"{schema}.{matview}_new"):
+        create_dependent_matview(connection, matview, config, rebuilt_views)
+
+def collect_stats_step(
+    connection,
+    stats: dict,
+    key: tuple,
+    schema: str,
+    name: str,
+    config: dict,
+    exact: bool = True,
+    report: Optional[RunReport] = None
+) -> None:
+    """Collect the validation statistics of one view into stats[key]."""
+    with report_step(report, f"{key[1]}:stats_{key[0]}", connection):
+        stats[key] = collect_view_stats(
+            connection, schema, name, config.get('amount_column'), config.get('index_columns'), exact
+        )
+
+def run_checkpointed(connection, build: Callable, matview: str, fingerprint: Optional[str]) -> None:
+    """Run a build step, then checkpoint the finished _new view."""
+    build(connection)
+    if fingerprint is not None:
+        save_checkpoint(connection, matview, fingerprint)
+
+def reuse_view(connection, matview: str, report: Optional[RunReport] = None) -> None:
+    """Stand-in build step for a view whose checkpointed _new version is reused."""
+    with report_step(report, f"{matview}:reuse", connection):
+        logger.info(f"Reusing {matview}_new from an interrupted run")
+
+def build_refresh_tasks(
+    rebuilt_views: List[str],
+    dependencies: Dict[str, List[str]],
+    test_mode: bool = False,
+    full_refresh: bool = False,
+    stats: Optional[dict] = None,
+    exact_stats: bool = True,
+    report: Optional[RunReport] = None,
+    fingerprints: Optional[Dict[str, Optional[str]]] = None,
+    reused_views: Optional[List[str]] = None,
+    concurrent_views: Optional[List[str]] = None
+):
+    """Return the build step for every rebuilt view and the steps each one waits for.
+    
+    A view starts as soon as the rebuilt views it reads are built. Inputs
+    that are not rebuilt in this run are read as they are.
+    
+    If stats is given, validation steps are added as well: "{view}:before"
+    scans the live base view and "{view}:after" scans {view}_new once it is
+    built, storing ViewStats under ('before', view) and ('after', view).
+    They run alongside the builds, so validation adds no separate passes.
+    
+    Every declared index of a view is a separate "{view}:index:{suffix}"
+    step that starts once {view}_new exists, so the indexes of one view are
+    built in parallel with each other and with the views downstream of it.
+    The "{view}:after" statistics do not wait for them.
+    
+    If report is given, every build, index and validation step is recorded in it.
+    
+    Views in reused_views keep their existing _new version. Every other
+    view is checkpointed with its entry in fingerprints once built, so an
+    interrupted run can be resumed.
+    
+    Views in concurrent_views are not rebuilt but refreshed in place with
+    REFRESH MATERIALIZED VIEW CONCURRENTLY, after their "{view}:before"
+    statistics are taken; their statistics and indexes are on the live view.
+    """
+    fingerprints = fingerprints or {}
+    reused_views = reused_views or []
+    concurrent_views = concurrent_views or []
+    # Views that are swapped at the end; the views reading them read their _new version
+    swapped_views = [
+        view for view in rebuilt_views
+        if view not in concurrent_views and not is_partitioned(BASE_MATVIEWS.get(view, {}))
+    ]
+    tasks = {}
+    task_dependencies = {}
+    if stats is not None:
+        for matview in rebuilt_views:
+            config = BASE_MATVIEWS.get(matview) or DEPENDENT_MATVIEWS[matview]
+            if is_partitioned(config):
+                # Validated partition by partition while it is refreshed
+                continue
+            schema = get_view_schema(matview)
+            if matview in BASE_MATVIEWS or matview in concurrent_views:
+                tasks[f"{matview}:before"] = partial(
+                    collect_stats_step, stats=stats, key=('before', matview),
+                    schema=schema, name=matview, config=config, exact=exact_stats, report=report
+                )
+                task_dependencies[f"{matview}:before"] = []
+            tasks[f"{matview}:after"] = partial(
+                collect_stats_step, stats=stats, key=('after', matview), schema=schema,
+                name=matview if matview in concurrent_views else f"{matview}_new",
+                config=config, exact=exact_stats, report=report
+            )
+            task_dependencies[f"{matview}:after"] = [matview]
+    for matview in rebuilt_views:
+        if matview in reused_views:
+            tasks[matview] = partial(reuse_view, matview=matview, report=report)
+        elif matview in concurrent_views:
+            tasks[matview] = partial(
+                refresh_concurrently_step, matview=matview, full_refresh=full_refresh, report=report
+            )
+        elif is_partitioned(BASE_MATVIEWS.get(matview, {})):
+            # Refreshed in place, so there is no _new view to checkpoint
+            tasks[matview] = partial(
+                build_base_view, matview=matview, config=BASE_MATVIEWS[matview],
+                test_mode=test_mode, full_refresh=full_refresh, report=report
+            )
+        else:
+            if matview in BASE_MATVIEWS:
+                build = partial(
+                    build_base_view, matview=matview, config=BASE_MATVIEWS[matview],
+                    test_mode=test_mode, full_refresh=full_refresh, report=report
+                )
+            else:
+                build = partial(
+                    build_dependent_view, matview=matview, config=DEPENDENT_MATVIEWS[matview],
+                    rebuilt_views=swapped_views, report=report
+                )
+            tasks[matview] = partial(
+                run_checkpointed, build=build, matview=matview, fingerprint=fingerprints.get(matview)
+            )
+        task_dependencies[matview] = [
+            upstream for upstream in dependencies[matview] if upstream in rebuilt_views
+        ]
+        if matview in concurrent_views and f"{matview}:before" in tasks:
+            task_dependencies[matview].append(f"{matview}:before")
+        config = BASE_MATVIEWS.get(matview) or DEPENDENT_MATVIEWS[matview]
+        if is_partitioned(config):
+            # Every partition is indexed before it is attached
+            continue
+        # Reused views get theirs too; indexes that survived the interruption are skipped.
+        # Views refreshed concurrently only get the indexes declared since they were built.
+        for spec in get_index_specs(config):
+            task = f"{matview}:index:{spec['suffix']}"
+            tasks[task] = partial(
+                create_index_step, matview=matview, spec=spec, live=matview in concurrent_views, report=report
+            )
+            task_dependencies[task] = [matview]
+    return tasks, task_dependencies
+
+def refresh_materialized_views(
+    connection,
+    test_mode: bool = False,
+    full_refresh: bool = False,
+    max_workers: int = REFRESH_WORKERS,
+    views: Optional[List[str]] = None,
+    force: bool = False,
+    exact_stats: bool = True,
+    resume: bool = True,
+    concurrent: bool = False
+) -> None:
     """Refresh all materialized views while maintaining dependencies.
     
+    Unless views are named explicitly or force is set, only views whose
+    source fingerprint changed since the last successful refresh are rebuilt,
+    together with the views downstream of them.
+    
     Args:
         test_mode (bool): If True, uses limited data for faster testing
+        full_refresh (bool): If True, rebuilds partitioned views and the Dune store from scratch
+        max_workers (int): Number of connections used to build views in parallel
+        views (list): Only rebuild these views and the views downstream of them
+        force (bool): If True, rebuilds views even if their sources are unchanged
+        exact_stats (bool): If False, validation compares reltuples row
+            estimates instead of scanning the views
+        resume (bool): If True, reuses _new views completed by an interrupted
+            run when they were built from the current sources
+        concurrent (bool): If True, views with a unique index whose
+            definition is unchanged are refreshed in place with REFRESH
+            MATERIALIZED VIEW CONCURRENTLY instead of being swapped, so
+            readers are never blocked by them
+    
+    Every step is recorded in a RunReport, which is written to a JSON file
+    and to public.refresh_runs whether or not the refresh succeeds.
     """
+    report = RunReport('update_materialized_views')
+    status = 'failed'
     try:
-        # # Step 0: Cleanup any leftover views (with error handling)
-        # try:
-        #     cleanup_leftover_views(connection)
-        # except Exception as e:
-        #     logger.warning(f"Cleanup of leftover views failed: {e}")
-            # Continue with the refresh process
-
-        # Step 1: Store current totals for validation (base views only)
-        logger.info("Recording current totals...")
-        old_totals = {}
-        for matview, config in BASE_MATVIEWS.items():
-            old_totals[matview] = get_matview_total(connection, matview, config)
-
-        # Step 2: Create all new base views
-        logger.info("Creating new base materialized views...")
-        for matview, config in BASE_MATVIEWS.items():
-            logger.info(f"Creating {matview}_new...")
-            if config.get('refresh_type') == 'dune':
-                # Get Dune API key from environment
-                dune_api_key = os.environ.get('DUNE_API_KEY')
-                if not dune_api_key:
-                    raise ValueError("DUNE_API_KEY environment variable is required")
-                refresh_dune_base_view(connection, dune_api_key)
-            else:
-                create_base_matview(connection, matview, config, test_mode)
-            create_indexes(connection, f"{matview}_new", config)
+        dependencies = get_view_dependencies()
+        logger.info("Fingerprinting view sources...")
+        with report.step('fingerprint', connection):
+            fingerprints = compute_view_fingerprints(connection, dependencies, test_mode)
+            if views is None and not (force or full_refresh):
+                views = find_changed_views(connection, fingerprints)
+        if not views and not (force or full_refresh):
+            logger.info("No view sources changed since the last refresh, nothing to rebuild")
+            status = 'unchanged'
+            return
+        rebuilt_views = plan_refresh(dependencies, views)
+        base_views = {m: c for m, c in BASE_MATVIEWS.items() if m in rebuilt_views}
+        dependent_views = {m: c for m, c in DEPENDENT_MATVIEWS.items() if m in rebuilt_views}
+        logger.info(f"Views to rebuild: {', '.join(rebuilt_views)}")
+        concurrent_views = find_concurrent_views(
+            connection, rebuilt_views, dependencies, test_mode, full_refresh
+        ) if concurrent else []
+        if concurrent_views:
+            logger.info(f"Refreshing concurrently in place: {', '.join(concurrent_views)}")
+
+        # Step 0: Resume an interrupted run. _new views that were completed
+        # from the current sources are kept, all other leftovers are dropped.
+        ensure_checkpoint_table(connection)
+        with report.step('cleanup_leftovers', connection):
+            reused_views = find_reusable_views(
+                connection, rebuilt_views, dependencies, fingerprints, concurrent_views
+            ) if resume else []
+            cleanup_leftover_views(connection, keep=reused_views)
+            if reused_views:
+                # Re-check, as dropping a leftover cascades to the _new views reading it
+                reused_views = find_reusable_views(
+                    connection, rebuilt_views, dependencies, fingerprints, concurrent_views
+                )
+                logger.info(f"Reusing _new views from an interrupted run: {', '.join(reused_views)}")
+
+        if any(config.get('refresh_type') == 'dune' for config in base_views.values()):
+            if not os.environ.get('DUNE_API_KEY'):
+                raise ValueError("DUNE_API_KEY environment variable is required")
 
-        # Step 3: Create all new dependent views
-        logger.info("Creating new dependent materialized views...")
-        for matview, config in DEPENDENT_MATVIEWS.items():
-            logger.info(f"Creating {matview}_new...")
-            create_dependent_matview(connection, matview, config)
-            if 'index_columns' in config:
-                create_indexes(connection, f"{matview}_new", config)
+        # Plan every build, to start the most expensive chains first and to
+        # catch relations that lost their index scan since the last run
+        with report.step('plan', connection) as step:
+            plans = plan_views(connection, [m for m in rebuilt_views if m not in reused_views], test_mode)
+            step['warnings'] = find_plan_warnings(plans, get_stored_plans(connection))
+
+        # Steps 1-3: Create all new base and dependent views, running
+        # independent views in parallel on separate connections. Validation
+        # statistics of the current base views and of every new view are
+        # collected by lower-priority steps in the same run.
+        logger.info(f"Creating new materialized views with {max_workers} workers...")
+        stats = {}
+        tasks, task_dependencies = build_refresh_tasks(
+            rebuilt_views, dependencies, test_mode, full_refresh, stats, exact_stats, report,
+            fingerprints, reused_views, concurrent_views
+        )
+        # Builds come first, the ones heading the costliest chains before the others
+        paths = plan_path_costs(rebuilt_views, dependencies, plans)
+        longest = max(paths.values(), default=0) or 1
+        priorities = {matview: 2 + paths[matview] / longest for matview in rebuilt_views}
+        priorities.update({task: 1 for task in tasks if ':index:' in task})
+        run_dag(tasks, task_dependencies, get_connection, max_workers=max_workers, priorities=priorities)
 
         # Step 4: Atomic swap of all views
         logger.info("Performing atomic swap of all views...")
         swap_commands = ["BEGIN;"]
 
         # Add swap commands for all views
-        for matview, config in BASE_MATVIEWS.items():
-            schema = 'public'  # base views are always in public
-            swap_commands.extend([
-                f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_old CASCADE;",
-                f"ALTER MATERIALIZED VIEW IF EXISTS {schema}.{matview} RENAME TO {matview}_old;",
-                f"ALTER MATERIALIZED VIEW {schema}.{matview}_new RENAME TO {matview};"
-            ])
-
-        for matview, config in DEPENDENT_MATVIEWS.items():
-            schema = config.get('schema', 'public')
-            swap_commands.extend([
-                f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_old CASCADE;",
-                f"ALTER MATERIALIZED VIEW IF EXISTS {schema}.{matview} RENAME TO {matview}_old;",
-                f"ALTER MATERIALIZED VIEW {schema}.{matview}_new RENAME TO {matview};"
-            ])
+        for matview, config in {**base_views, **dependent_views}.items():
+            if not is_partitioned(config) and matview not in concurrent_views:
+                swap_commands.extend(index_swap_commands(matview, config))
 
+        # The swapped _new views no longer exist, so neither do their checkpoints
+        swapped = ', '.join(f"'{matview}'" for matview in rebuilt_views)
+        swap_commands.append(f"DELETE FROM {CHECKPOINT_TABLE} WHERE matview IN ({swapped});")
         swap_commands.append("COMMIT;")
 
 
-        execute_command(connection, "\n".join(swap_commands))
+        with report.step('swap', connection):
+            execute_with_lock_retries(connection, "\n".join(swap_commands))
 
         logger.info("=== POST-SWAP HEALTH CHECK ===")
         check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
 
         # Step 5: Validate
         logger.info("Validating refreshed views...")
-        for matview, config in BASE_MATVIEWS.items():
-            validate_refresh(connection, matview, config, old_totals[matview])
-            
-        for matview, config in DEPENDENT_MATVIEWS.items():
-            schema = config.get('schema', 'public')
-            new_total = get_matview_total(connection, matview, config, schema)
-            logger.info(f"New dependent view {schema}.{matview} total: {new_total}")
+        with report.step('validate', connection) as step:
+            step['warnings'] = []
+            for matview in rebuilt_views:
+                if is_partitioned(BASE_MATVIEWS.get(matview, {})):
+                    continue
+                step['warnings'].extend(
+                    compare_stats(matview, stats.get(('before', matview)), stats.get(('after', matview)))
+                )
 
         logger.info("=== PRE-CLEANUP HEALTH CHECK ===")
         check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
@@ -472,12 +1914,22 @@ def refresh_materialized_views(connection, test_mode: bool = False) -> None:
         # Step 6: Cleanup
         logger.info("Cleaning up old views...")
         cleanup_commands = []
-        for matview, config in BASE_MATVIEWS.items():
-            cmd = f"DROP MATERIALIZED VIEW IF EXISTS public.{matview}_old CASCADE;"
-            cleanup_commands.append(cmd)
+        for matview, config in base_views.items():
+            if is_partitioned(config):
+                # Only left behind when the whole table was rebuilt, as a
+                # partitioned table or as the materialized view it replaced
+                cmd = drop_relation_sql(get_relkind(connection, 'public', f"{matview}_old"), 'public', f"{matview}_old")
+                cleanup_commands.append(cmd)
+            else:
+                cmd = f"DROP MATERIALIZED VIEW IF EXISTS public.{matview}_old CASCADE;"
+                cleanup_commands.append(cmd)
             logger.info(f"Adding cleanup command for base view: {cmd}")
+            if config.get('refresh_type') == 'dune':
+                cmd = f"DROP TABLE IF EXISTS public.{matview}_store_old CASCADE;"
+                cleanup_commands.append(cmd)
+                logger.info(f"Adding cleanup command for replaced store: {cmd}")
 
-        for matview, config in DEPENDENT_MATVIEWS.items():
+        for matview, config in dependent_views.items():
             schema = config.get('schema', 'public')
             cmd = f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_old CASCADE;"
             cleanup_commands.append(cmd)
@@ -488,26 +1940,91 @@ def refresh_materialized_views(connection, test_mode: bool = False) -> None:
         for cmd in cleanup_commands:
             logger.info(f"Will execute: {cmd}")
 
-        execute_command(connection, "\n".join(cleanup_commands))
+        with report.step('cleanup', connection):
+            execute_command(connection, "\n".join(cleanup_commands))
 
         logger.info("=== POST-CLEANUP HEALTH CHECK ===")
         check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
 
+        # Step 7: Remember what the rebuilt views were built from
+        ensure_fingerprint_table(connection)
+        save_fingerprints(connection, {matview: fingerprints[matview] for matview in rebuilt_views})
+        save_plans(connection, plans)
+        status = 'succeeded'
+
 
     except Exception as e:
         logger.error(f"Failed to refresh materialized views: {e}", exc_info=True)
         raise
+    finally:
+        report.save(connection, status)
 
 def main():
     """Main execution function."""
     connection = None
     start_time = time.time()
     
-    # Add argument parsing
+    parser = argparse.ArgumentParser(description="Refresh the Grants DB materialized views.")
+    parser.add_argument(
+        '--full-refresh',
+        action='store_true',
+        help="Rebuild partitioned views and the Dune store from scratch instead of upserting new rows"
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=REFRESH_WORKERS,
+        help="Number of database connections used to build independent views in parallel"
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help="Rebuild views even if their sources have not changed since the last refresh"
+    )
+    parser.add_argument(
+        '--fast-validation',
+        action='store_true',
+        help="Validate with pg_class row estimates instead of scanning every view"
+    )
+    parser.add_argument(
+        '--no-resume',
+        action='store_true',
+        help="Rebuild every view instead of reusing _new views left by an interrupted run"
+    )
+    parser.add_argument(
+        '--concurrent',
+        action='store_true',
+        help="Refresh views with a unique index in place with REFRESH MATERIALIZED VIEW CONCURRENTLY "
+             "instead of swapping them, so readers are never blocked"
+    )
+    parser.add_argument(
+        '--views',
+        nargs='+',
+        help="Only rebuild these views and the views that depend on them"
+    )
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help="Only EXPLAIN the views that would be rebuilt and print their estimates, without building anything"
+    )
+    args = parser.parse_args()
     
     try:
         connection = get_connection()
-        refresh_materialized_views(connection, test_mode=TEST_MODE)
+        if args.plan:
+            plan_materialized_views(connection, test_mode=TEST_MODE, views=args.views, force=args.force)
+            return
+        refresh_materialized_views(
+            connection,
+            test_mode=TEST_MODE,
+            full_refresh=args.full_refresh,
+            max_workers=args.workers,
+            views=args.views,
+            force=args.force,
+            exact_stats=not args.fast_validation,
+            resume=not args.no_resume,
+            concurrent=args.concurrent
+        )
         
         end_time = time.time()
         logger.info(f"Total refresh time: {end_time - start_time:.2f} seconds")
@@ -2,13 +2,20 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timezone
 import psycopg2 as pg
-import networkx as nx
-import itertools
-from collections import defaultdict
-from sqlalchemy import create_engine
 import os
+import argparse
 import logging
 
+from db_utils import copy_dataframe, read_query
+from near_duplicates import similar_value_clusters
+from project_attributes import normalize_attributes
+from project_grouping import (
+    GROUP_MEMBERS_TABLE, GROUPING_ATTRIBUTES, add_members, assign_group_ids, clear_grouping_state,
+    ensure_grouping_tables, get_grouping_state, get_next_group_id, keep_group_ids, rebuild_grouping_state
+)
+from refresh_report import RunReport, report_step
+from table_publisher import publish_table
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -31,31 +38,16 @@ dbname = 'Grants'
 user = os.environ['DB_USER']
 password = os.environ['DB_PASSWORD']
 
-def run_query(query):
-    """Run query and return results"""
+def run_query(query, params=None):
+    """Run query and return results, read in chunks from a server-side cursor"""
+    conn = pg.connect(host=host, port=port, dbname=dbname, user=user, password=password)
     try:
-        conn = pg.connect(host=host, port=port, dbname=dbname, user=user, password=password)
-        cur = conn.cursor()
-        cur.execute(query)
-        col_names = [desc[0] for desc in cur.description]
-        results = pd.DataFrame(cur.fetchall(), columns=col_names)
+        return read_query(conn, query, params)
     except pg.Error as e:
         print(f"ERROR: Could not execute the query. {e}")
+        raise
     finally:
         conn.close()
-    return results
-
-def clean_github(url_or_name):
-    if pd.isna(url_or_name):
-        return np.nan
-    # Remove 'https://github.com/' if it's present
-    url_or_name = url_or_name.replace('https://github.com/', '').replace('http://github.com/', '')
-    if '/' in url_or_name:
-        # If it's a URL or a 'username/repo' string, split by '/' and take the first part
-        return url_or_name.split('/')[0].lower()
-    else:
-        # If it's a username, return it as is
-        return url_or_name.lower()
 
 cgrants_query = '''
     SELECT
@@ -66,6 +58,7 @@ cgrants_query = '''
         cg.twitter AS project_twitter,
         cg.github AS project_github,
         cg.createdon AS created_at,
+        cg.grantid::text AS member_key,
         ad.amount_donated, 
         ad.last_donation,
         'cGrants' as source
@@ -80,7 +73,7 @@ cgrants_query = '''
             public."cgrantsContributions"
         GROUP BY
             grant_id
-    ) ad ON cg.grantid = ad.grant_id;
+    ) ad ON cg.grantid = ad.grant_id
     '''
 
 indexer_query = '''
@@ -93,106 +86,285 @@ indexer_query = '''
         metadata #>> '{application, recipient}' AS payout_address,
         TO_TIMESTAMP(CAST((metadata #>> '{application, project, createdAt}') AS bigint)/1000) AS "created_at",
         total_amount_donated_in_usd AS "amount_donated",
+        chain_id || ':' || round_id || ':' || id AS member_key,
+        chain_id,
+        created_at_block,
         'indexer' AS source
     FROM
         applications
     WHERE 
-        chain_id != 11155111 ;
+        chain_id != 11155111
+    '''
+
+# Current donation totals of the indexer applications, to keep the stored totals up to date
+indexer_amounts_query = '''
+    SELECT
+        chain_id || ':' || round_id || ':' || id AS member_key,
+        total_amount_donated_in_usd AS "amount_donated"
+    FROM
+        applications
+    WHERE 
+        chain_id != 11155111
     '''
 # Set the minimum number of shared attributes required to draw an edge
 min_shared_attributes = 3  # Change this value as needed
+# Set to e.g. 0.8 to also count near-duplicate titles and websites as shared (estimated Jaccard similarity of their character shingles)
+similarity_threshold = None
+SIMILARITY_ATTRIBUTES = ['title', 'website']
 
-cgrants_data = run_query(cgrants_query)
-indexer_data = run_query(indexer_query)
-cgrants_data['project_id'] = cgrants_data['project_id'].astype(str)
-data = pd.concat([cgrants_data, indexer_data], ignore_index=True)
-
-# Pre-cleaning
-eth_address_pattern = r'^0x[a-fA-F0-9]{40}$'
-data['payout_address'] = data['payout_address'].astype(str)
-data['payout_address'] = data['payout_address'].str.lower()
-data = data[data['payout_address'].str.match(eth_address_pattern)]
-data['title'] = data['title'].astype(str)
-data['title'] = data['title'].str.lower()
-data['title'] = data['title'].str.replace(r'[^\w\s]', '', regex=True)  # Remove punctuation
-data['title'] = data['title'].str.replace(r'\s+', ' ', regex=True)  # Replace multiple spaces with a single space
-data['title'] = data['title'].str.strip()  # Remove leading/trailing whitespace
-data['project_twitter'] = data['project_twitter'].str.lower()
-data['project_github'] = data['project_github'].astype(str)
-data['project_github'] = data['project_github'].str.lower()
-data['project_github'] = data['project_github'].apply(clean_github)
-data.replace('nan', np.nan, inplace=True)
-
-# Convert empty strings to NaN and drop them
-data['title'].replace('', np.nan, inplace=True)
-data.dropna(subset=['title'], inplace=True)
-# Reset group_id 
-data['group_id'] = 0
-
-# Create a graph
-G = nx.Graph()
-# Add nodes
-for i, row in data.iterrows():
-    G.add_node(i)
-# Create a counter for shared attributes
-shared_attributes_counter = defaultdict(int)
-# Count shared attributes
-for attribute in ['title', 'website', 'payout_address', 'project_twitter', 'project_github']:
-    attribute_data = data.dropna(subset=[attribute])
-    for _, group in attribute_data.groupby(attribute):
-        for i1, i2 in itertools.combinations(group.index, 2):
-            pair = tuple(sorted((i1, i2)))  # Create a pair tuple
-            shared_attributes_counter[pair] += 1
-# Add edges for pairs with at least min_shared_attributes shared attributes
-for pair, count in shared_attributes_counter.items():
-    if count >= min_shared_attributes:
-        G.add_edge(*pair)
-# Find connected components and assign group IDs
-group_id = 0
-for component in nx.connected_components(G):
-    data.loc[list(component), 'group_id'] = group_id
-    group_id += 1
-
-data['group_id'] = data['group_id'].astype(str)
-project_lookup = data[['group_id', 'project_id', 'source']]
-project_lookup = project_lookup.sort_values(by='group_id')
-
-## UPLOAD project_lookup TO POSTGRES
-table = 'project_lookup'
-engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{dbname}')
-try:
-    project_lookup.to_sql(table, engine, if_exists='replace', index=False)
-    print(f"Data successfully written to database table {table}.")
-except Exception as e:
-    print("Failed to write data to database:", e)
-
-# Create a DataFrame of the latest group information
-group_info = data
-
-# Group by 'group_id' and calculate sum of 'amount_donated' and max of 'created_at'
-group_info_agg = group_info.groupby('group_id').agg({'amount_donated': 'sum', 'created_at': 'max', 'project_id': 'count'})
-group_info_agg.columns = ['total_amount_donated', 'latest_created_application', 'application_count']
-# Merge the aggregated data back to the group_info DataFrame
-group_info = pd.merge(group_info, group_info_agg, on='group_id')
-# Sort by created_at then keep the last row for each group_id
-group_info.sort_values(by='created_at', inplace=True)
-group_info.drop_duplicates(subset='group_id', keep='last', inplace=True)
-
-# Sort by 'total_amount_donated' in descending order
-group_info.sort_values(by='total_amount_donated', ascending=False, inplace=True)
-# CLEAN UP THE DATA
-group_info.drop([ 'created_at', 'amount_donated', 'last_donation'], axis=1, inplace=True)
-group_info.rename(columns={'project_id': 'latest_created_project_id'}, inplace=True)
-
-# Reorder the columns in the group_info DataFrame
-group_info.rename(columns={'website': 'latest_website', 'payout_address': 'latest_payout_address', 'project_twitter': 'latest_project_twitter', 'project_github': 'latest_project_github', 'source': 'latest_source'}, inplace=True)
-project_groups_summary = group_info[['group_id', 'title', 'latest_created_project_id', 'latest_website', 'latest_payout_address', 'latest_project_twitter', 'latest_project_github', 'latest_source',  'total_amount_donated', 'application_count', 'latest_created_application']]
-project_groups_summary.reset_index(drop=True, inplace=True)
-## UPLOAD project_groups_summary TO POSTGRES
-table = 'project_groups_summary'
-engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{dbname}')
-try:
-    project_groups_summary.to_sql(table, engine, if_exists='replace', index=False)
-    print(f"Data successfully written to database table {table}.")
-except Exception as e:
-    print("Failed to write data to database:", e)
+SUMMARY_COLUMNS = ['group_id', 'title', 'latest_created_project_id', 'latest_website', 'latest_payout_address', 'latest_project_twitter', 'latest_project_github', 'latest_source',  'total_amount_donated', 'application_count', 'latest_created_application']
+
+
+def summarize_groups(group_info):
+    """Return one summary row per group: its latest application and the totals of all of them."""
+    # Group by 'group_id' and calculate sum of 'amount_donated' and max of 'created_at'
+    group_info_agg = group_info.groupby('group_id').agg({'amount_donated': 'sum', 'created_at': 'max', 'project_id': 'count'})
+    group_info_agg.columns = ['total_amount_donated', 'latest_created_application', 'application_count']
+    # Merge the aggregated data back to the group_info DataFrame
+    group_info = pd.merge(group_info, group_info_agg, on='group_id')
+    # Sort by created_at then keep the last row for each group_id
+    group_info.sort_values(by='created_at', inplace=True)
+    group_info.drop_duplicates(subset='group_id', keep='last', inplace=True)
+
+    # Sort by 'total_amount_donated' in descending order
+    group_info.sort_values(by='total_amount_donated', ascending=False, inplace=True)
+    # CLEAN UP THE DATA
+    group_info.drop(['created_at', 'amount_donated'], axis=1, inplace=True)
+    group_info.rename(columns={'project_id': 'latest_created_project_id'}, inplace=True)
+
+    # Reorder the columns in the group_info DataFrame
+    group_info.rename(columns={'website': 'latest_website', 'payout_address': 'latest_payout_address', 'project_twitter': 'latest_project_twitter', 'project_github': 'latest_project_github', 'source': 'latest_source'}, inplace=True)
+    project_groups_summary = group_info[SUMMARY_COLUMNS]
+    project_groups_summary.reset_index(drop=True, inplace=True)
+    return project_groups_summary
+
+
+def write_table(df, table, connection):
+    try:
+        # Incremental runs replace the rows of single groups
+        publish_table(connection, df, table, indexes=[['group_id']])
+    except Exception as e:
+        logger.error(f"Failed to write data to database table {table}: {e}")
+        raise
+    logger.info(f"Data successfully written to database table {table}.")
+
+
+def match_near_duplicates(data, threshold):
+    """Return a copy of data in which near-duplicate titles and websites are replaced by one value of their cluster."""
+    grouping_data = data.copy()
+    for attribute in SIMILARITY_ATTRIBUTES:
+        values = grouping_data[attribute]
+        if attribute == 'website':
+            values = values.str.lower().str.replace(r'^https?://(www\.)?', '', regex=True).str.rstrip('/')
+        grouping_data[attribute] = similar_value_clusters(values, threshold)
+    return grouping_data
+
+
+def get_previous_group_ids(connection, data):
+    """Return the group id every application of data has in project_lookup, NaN for the ones not in it."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('project_lookup')")
+        exists = cursor.fetchone()[0] is not None
+    if not exists:
+        connection.rollback()
+        return pd.Series(np.nan, index=data.index)
+    previous = read_query(connection, "SELECT project_id, source, group_id FROM project_lookup")
+    connection.rollback()
+    previous['group_id'] = pd.to_numeric(previous['group_id'], errors='coerce')
+    previous = previous.dropna(subset=['group_id']).drop_duplicates(['project_id', 'source'])
+    return data[['project_id', 'source']].merge(previous, on=['project_id', 'source'], how='left')['group_id']
+
+
+def rebuild_project_groups(connection, similarity_threshold=None, report=None):
+    """Group all applications from scratch, replace both tables and then rebuild the grouping state.
+
+    The groups keep the ids they had in project_lookup where they overlap
+    a previous group, so the ids consumers stored stay valid.
+
+    With a similarity_threshold, near-duplicate titles and websites count
+    as shared attributes. The grouping state is then cleared instead, as
+    new applications can only be matched to near-duplicates by regrouping
+    everything.
+    """
+    with report_step(report, 'fetch', connection):
+        cgrants_data = run_query(cgrants_query)
+        indexer_data = run_query(indexer_query)
+        cgrants_data['project_id'] = cgrants_data['project_id'].astype(str)
+        data = pd.concat([cgrants_data, indexer_data], ignore_index=True)
+    data = normalize_attributes(data, report, connection)
+
+    # Link rows sharing at least min_shared_attributes attributes and number the connected groups
+    with report_step(report, 'group', connection):
+        grouping_data = data
+        if similarity_threshold is not None:
+            grouping_data = match_near_duplicates(data, similarity_threshold)
+        group_ids = assign_group_ids(grouping_data, min_shared_attributes, GROUPING_ATTRIBUTES)
+        data['group_id'] = keep_group_ids(group_ids, get_previous_group_ids(connection, data), get_next_group_id(connection))
+        logger.info(f"Grouped {len(data)} applications into {data['group_id'].nunique()} project groups")
+
+    published = data.assign(group_id=data['group_id'].astype(str))
+    project_lookup = published[['group_id', 'project_id', 'source']]
+    project_lookup = project_lookup.sort_values(by='group_id')
+
+    ## UPLOAD project_lookup TO POSTGRES
+    with report_step(report, 'project_lookup', connection):
+        write_table(project_lookup, 'project_lookup', connection)
+
+    ## UPLOAD project_groups_summary TO POSTGRES
+    with report_step(report, 'project_groups_summary', connection):
+        write_table(summarize_groups(published), 'project_groups_summary', connection)
+
+    # The grouping state describes the published groups, so it is only stored once both tables are
+    with report_step(report, 'grouping_state', connection):
+        if similarity_threshold is None:
+            rebuild_grouping_state(connection, data, min_shared_attributes, GROUPING_ATTRIBUTES)
+        else:
+            clear_grouping_state(connection)
+        connection.commit()
+
+
+def fetch_new_applications(connection, report=None):
+    """Return the applications created after the newest grouped one of their source (and chain)."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MAX(created_at) FROM {GROUP_MEMBERS_TABLE} WHERE source = 'cGrants'")
+        cgrants_watermark = cursor.fetchone()[0]
+        cursor.execute(f"""
+        SELECT chain_id, MAX(created_at_block) FROM {GROUP_MEMBERS_TABLE}
+        WHERE source = 'indexer' GROUP BY chain_id
+        """)
+        block_watermarks = cursor.fetchall()
+    connection.rollback()
+
+    with report_step(report, 'fetch', connection):
+        if cgrants_watermark is None:
+            cgrants_data = run_query(cgrants_query)
+        else:
+            cgrants_data = run_query(cgrants_query + " WHERE cg.createdon > %s", (cgrants_watermark,))
+        cgrants_data['project_id'] = cgrants_data['project_id'].astype(str)
+        query = indexer_query
+        if any(block is not None for _, block in block_watermarks):
+            # Block numbers are only comparable within a chain
+            cases = ' '.join(f"WHEN {int(chain_id)} THEN {block}" for chain_id, block in block_watermarks if block is not None)
+            query += f" AND created_at_block > CASE chain_id {cases} ELSE -1 END"
+        indexer_data = run_query(query)
+        data = pd.concat([cgrants_data, indexer_data], ignore_index=True)
+    data = normalize_attributes(data, report, connection)
+
+    # Skip applications grouped before, e.g. ones sharing the watermark block
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT member_key FROM {GROUP_MEMBERS_TABLE} WHERE member_key = ANY(%s)",
+            (data['member_key'].tolist(),)
+        )
+        known = {row[0] for row in cursor.fetchall()}
+    connection.rollback()
+    return data[~data['member_key'].isin(known)].reset_index(drop=True)
+
+
+def update_donation_totals(connection):
+    """Store the current donation totals of all indexer applications; return the groups whose totals changed.
+
+    Donations keep arriving for applications grouped long ago, so every
+    run reads the (narrow) totals of all of them; only the groups whose
+    totals changed are rewritten. Runs in the caller's transaction; the
+    caller commits.
+    """
+    amounts = run_query(indexer_amounts_query)
+    with connection.cursor() as cursor:
+        cursor.execute("""
+        CREATE TEMP TABLE project_group_amounts (member_key text PRIMARY KEY, amount_donated double precision)
+        ON COMMIT DROP
+        """)
+    copy_dataframe(connection, amounts.drop_duplicates('member_key'), 'project_group_amounts')
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        UPDATE {GROUP_MEMBERS_TABLE} m SET amount_donated = a.amount_donated
+        FROM project_group_amounts a
+        WHERE m.member_key = a.member_key AND m.amount_donated IS DISTINCT FROM a.amount_donated
+        RETURNING m.group_id
+        """)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def update_project_groups_incrementally(connection, report=None):
+    """Group only the new applications and rewrite the rows of the groups they touched."""
+    new_members = fetch_new_applications(connection, report)
+    merges = {}
+    affected = set()
+    with report_step(report, 'group', connection):
+        if len(new_members):
+            affected, merges = add_members(connection, new_members, min_shared_attributes, GROUPING_ATTRIBUTES)
+        else:
+            logger.info("No new applications to group")
+    with report_step(report, 'donation_totals', connection):
+        changed_totals = update_donation_totals(connection)
+    logger.info(f"Donation totals changed in {len(changed_totals)} groups")
+    affected |= changed_totals
+    if not affected:
+        connection.commit()
+        return
+
+    rewritten = [str(group_id) for group_id in sorted(affected | set(merges))]
+    with report_step(report, 'rewrite_groups', connection), connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT {', '.join(column for column in ['group_id', 'project_id', 'source', 'created_at', 'amount_donated'] + GROUPING_ATTRIBUTES)}
+        FROM {GROUP_MEMBERS_TABLE} WHERE group_id = ANY(%s)
+        """, (sorted(affected),))
+        col_names = [desc[0] for desc in cursor.description]
+        members = pd.DataFrame(cursor.fetchall(), columns=col_names)
+        members['group_id'] = members['group_id'].astype(str)
+        cursor.execute("DELETE FROM project_lookup WHERE group_id = ANY(%s)", (rewritten,))
+        cursor.execute("DELETE FROM project_groups_summary WHERE group_id = ANY(%s)", (rewritten,))
+        copy_dataframe(connection, members[['group_id', 'project_id', 'source']], 'project_lookup')
+        copy_dataframe(connection, summarize_groups(members), 'project_groups_summary')
+        connection.commit()
+    logger.info(f"Rewrote the project_lookup and project_groups_summary rows of {len(rewritten)} groups")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group project applications and update project_lookup and project_groups_summary.")
+    parser.add_argument(
+        '--full-rebuild',
+        action='store_true',
+        help="Regroup every application from scratch instead of grouping only the new ones"
+    )
+    parser.add_argument(
+        '--similarity-threshold',
+        type=float,
+        default=similarity_threshold,
+        help="Also count titles and websites with at least this estimated similarity as shared; always regroups from scratch"
+    )
+    parser.add_argument(
+        '--trace-memory',
+        action='store_true',
+        help="Also record the peak memory every step allocated; tracing slows the pandas steps down"
+    )
+    args = parser.parse_args()
+
+    # Every step records its duration, and with --trace-memory the peak memory it allocated
+    report = RunReport('update_project_groups', trace_memory=args.trace_memory)
+    status = 'failed'
+    connection = pg.connect(host=host, port=port, dbname=dbname, user=user, password=password)
+    try:
+        ensure_grouping_tables(connection)
+        state = get_grouping_state(connection)
+        if args.similarity_threshold is not None:
+            rebuild_project_groups(connection, args.similarity_threshold, report)
+        elif args.full_rebuild or state is None:
+            rebuild_project_groups(connection, report=report)
+        elif state != {'min_shared_attributes': min_shared_attributes, 'attributes': GROUPING_ATTRIBUTES}:
+            logger.info("Grouping settings changed since the last rebuild, regrouping from scratch")
+            rebuild_project_groups(connection, report=report)
+        else:
+            update_project_groups_incrementally(connection, report)
+        status = 'succeeded'
+    finally:
+        saved = report.save(connection, status)
+        for step in saved['steps']:
+            memory = f", peak {step['peak_memory_bytes'] / 2**20:.1f} MiB" if step.get('peak_memory_bytes') is not None else ''
+            logger.info(f"{step['step']}: {step['duration_seconds']:.2f}s{memory}")
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,13 @@
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import pandas as pd
-from sqlalchemy import create_engine
+import psycopg2
 import json
 import os
 import logging
 
+from table_publisher import publish_table
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -43,10 +45,12 @@ df['amount_in_usd'] = df['amount_in_usd'].replace('[\$,]', '', regex=True).astyp
 
 ## UPLOAD df TO POSTGRES
 table = 'AlloRoundsOutsideIndexer'
-engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{dbname}')
+connection = psycopg2.connect(host=host, port=port, dbname=dbname, user=user, password=password)
 try:
-    df.to_sql(table, engine, if_exists='replace', index=False)
+    publish_table(connection, df, table)
     print(f"Data successfully written to database table {table}.")
 except Exception as e:
     print("Failed to write data to database:", e)
+finally:
+    connection.close()
 
@@ -1,10 +1,11 @@
 import pandas as pd
-from sqlalchemy import create_engine, text
 import json
 import os
 import logging
 import psycopg2
 
+from table_publisher import publish_table
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -71,36 +72,20 @@ def clean_model_scores(df):
     return df
 
 def upload_to_postgres(df, table_name):
-    temp_table = f"{table_name}_temp"
-    
-    # Create SQLAlchemy engine
-    logger.info(f"Creating SQLAlchemy engine with connection string: postgresql://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}:{DB_PARAMS['port']}/{DB_PARAMS['dbname']}")
-    engine = create_engine(f'postgresql://{DB_PARAMS["user"]}:{DB_PARAMS["password"]}@{DB_PARAMS["host"]}:{DB_PARAMS["port"]}/{DB_PARAMS["dbname"]}')
-    logger.info("SQLAlchemy engine created successfully.")
+    """Replace the table with df: COPY into a staging table, then swap it in atomically.
+
+    Set PUBLISH_WORKERS to copy on several connections in parallel.
+    """
+    logger.info(f"Publishing {len(df)} rows to {table_name}...")
+    connection = psycopg2.connect(**DB_PARAMS)
     try:
-        with engine.begin() as conn:
-            # Use to_sql to create temporary table and insert data into the temporary table
-            logger.info(f"Attempting to write data to temporary table {temp_table}...")
-            df.to_sql(temp_table, conn, if_exists='replace', index=False, method='multi', chunksize=1000)
-            logger.info(f"Data successfully written to temporary table {temp_table}.")
-            
-            # Log the start of the main table drop operation
-            logger.info(f"Attempting to drop main table {table_name}...")
-            # Drop the main table if it exists
-            drop_main_table_query = text(f"DROP TABLE IF EXISTS {table_name};")
-            conn.execute(drop_main_table_query)
-            logger.info(f"Main table {table_name} dropped.")
-            
-            # Log the start of the temporary table rename operation
-            logger.info(f"Attempting to rename temporary table {temp_table} to {table_name}...")
-            # Rename the temporary table to the main table
-            rename_temp_table_query = text(f"ALTER TABLE {temp_table} RENAME TO {table_name};")
-            conn.execute(rename_temp_table_query)
-            logger.info(f"Succesfully renamed temporary table {temp_table} to {table_name}.")
-            
+        publish_table(connection, df, table_name, connection_params=DB_PARAMS)
+        logger.info(f"Successfully published {table_name}.")
     except Exception as e:
         logger.error(f"Failed to write data to database: {e}")
         raise
+    finally:
+        connection.close()
 
 
 # Usage
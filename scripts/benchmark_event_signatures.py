@@ -0,0 +1,110 @@
+"""Compare the row-wise and batched event_signature hashing of Dune leaderboard rows.
+
+For every frame size a synthetic leaderboard frame is generated and its
+signatures are computed with the original DataFrame.apply(..., axis=1)
+scheme, with the batched implementation on one process, and with the
+batched implementation on a process pool. The three must produce
+identical signatures. The row-wise scheme is only timed up to
+--legacy-max-rows, because it takes minutes on larger frames.
+
+Usage:
+    python scripts/benchmark_event_signatures.py --rows 100000 1000000 10000000 --workers 8
+
+Needs no database.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'automations'))
+
+from dune_loader import SIGNATURE_WORKERS, event_signatures  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ROLES = ['donor', 'grantee', 'round_operator', 'contract_dev']
+
+
+def generate_events(rows: int, seed: int = 75) -> pd.DataFrame:
+    """Return a frame shaped like the sorted Dune leaderboard result, including NULL addresses."""
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit='s')
+    addresses = pd.Series([f"0x{value:040x}" for value in rng.integers(0, 2**62, rows)], dtype=object)
+    addresses[rng.random(rows) < 0.01] = None
+    df = pd.DataFrame({
+        'blockchain': 'ethereum',
+        'tx_timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S.000 UTC'),
+        'tx_hash': [f"0x{value:064x}" for value in rng.integers(0, 2**62, rows)],
+        'address': addresses,
+        'strategy_name': 'DonationVotingMerkleDistributionDirectTransferStrategy',
+        'role': rng.choice(ROLES, rows),
+        'gmv': np.round(rng.lognormal(3, 2, rows), 6)
+    })
+    df['row_number'] = range(1, rows + 1)
+    return df
+
+
+def legacy_signatures(df: pd.DataFrame) -> list:
+    """The original row-wise scheme."""
+    return df.apply(
+        lambda row: hashlib.sha256(
+            f"{row['tx_timestamp']}{row['tx_hash']}{row['address']}{row['gmv']}{row['role']}{row['row_number']}".encode()
+        ).hexdigest(),
+        axis=1
+    ).tolist()
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event_signature hashing.")
+    parser.add_argument('--rows', nargs='+', type=int, default=[100000, 1000000, 10000000], help="Frame sizes")
+    parser.add_argument('--workers', type=int, default=SIGNATURE_WORKERS, help="Processes of the pooled run")
+    parser.add_argument('--legacy-max-rows', type=int, default=1000000, help="Largest frame the row-wise scheme is timed on")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        df = generate_events(rows)
+        batched, batched_seconds = timed(event_signatures, df, workers=1)
+        pooled, pooled_seconds = timed(event_signatures, df, workers=args.workers)
+        if pooled != batched:
+            raise AssertionError(f"Pooled signatures differ from the single-process ones at {rows} rows")
+        result = {'rows': rows, 'batched_seconds': batched_seconds, 'pooled_seconds': pooled_seconds, 'legacy_seconds': None}
+        if rows <= args.legacy_max_rows:
+            legacy, result['legacy_seconds'] = timed(legacy_signatures, df)
+            if legacy != batched:
+                raise AssertionError(f"Batched signatures differ from the row-wise ones at {rows} rows")
+        results.append(result)
+        logger.info(f"{rows} rows: batched {batched_seconds:.2f}s, pooled {pooled_seconds:.2f}s, row-wise {result['legacy_seconds']}")
+
+    print(f"{'rows':>12}{'row-wise s':>14}{'batched s':>12}{'pooled s':>12}{'speedup':>10}")
+    for result in results:
+        legacy = result['legacy_seconds']
+        best = min(result['batched_seconds'], result['pooled_seconds'])
+        print(
+            f"{result['rows']:>12}{legacy if legacy is not None else float('nan'):>14.2f}"
+            f"{result['batched_seconds']:>12.2f}{result['pooled_seconds']:>12.2f}"
+            f"{(legacy / max(best, 0.001)) if legacy is not None else float('nan'):>9.1f}x"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
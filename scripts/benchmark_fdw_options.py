@@ -0,0 +1,144 @@
+"""Measure foreign table scan throughput under different postgres_fdw options.
+
+For each setting the options are applied to the foreign table with ALTER
+FOREIGN TABLE inside a transaction that is rolled back afterwards, so the
+configured options are never changed. Each setting runs a full scan under
+EXPLAIN ANALYZE, which fetches every row from the remote server without
+sending them on to the client. The setting also runs a filtered scan, to
+compare the planner's row estimate with the actual row count.
+
+Usage:
+    python scripts/benchmark_fdw_options.py --tables indexer.donations indexer.applications --runs 3
+
+Runs against the Grants database configured through DB_HOST, DB_PORT,
+DB_USER and DB_PASSWORD. The foreign tables must already exist; see
+automations/update_foreign_schema.py.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'automations'))
+
+from update_foreign_schema import (  # noqa: E402
+    DB_PARAMS, INDEXER_CONFIG, MACI_CONFIG, fdw_options_clause, parse_fdw_options
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CONFIGS = {config.schema: config for config in (INDEXER_CONFIG, MACI_CONFIG)}
+
+# The postgres_fdw defaults, set explicitly so that server options do not leak into the baseline
+BASELINE_OPTIONS = {'fetch_size': '100', 'use_remote_estimate': 'false', 'async_capable': 'false'}
+
+SETTINGS = {
+    'default': {},
+    'fetch_size=1000': {'fetch_size': '1000'},
+    'fetch_size=10000': {'fetch_size': '10000'},
+    'fetch_size=50000': {'fetch_size': '50000'},
+    'use_remote_estimate': {'use_remote_estimate': 'true'}
+}
+
+
+def get_table_options(connection, relation: str) -> dict:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT ftoptions FROM pg_foreign_table WHERE ftrelid = to_regclass(%s)", (relation,))
+        row = cursor.fetchone()
+    connection.rollback()
+    if row is None:
+        raise ValueError(f"{relation} is not a foreign table")
+    return parse_fdw_options(row[0])
+
+
+def explain_analyze(cursor, query: str) -> dict:
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+    result = cursor.fetchone()[0]
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]
+    return {
+        'execution_ms': plan['Execution Time'],
+        'planning_ms': plan['Planning Time'],
+        'estimated_rows': plan['Plan']['Plan Rows'],
+        'rows': plan['Plan']['Actual Rows']
+    }
+
+
+def benchmark_setting(connection, relation: str, options: dict, runs: int, filter_sql: str) -> dict:
+    """Scan a foreign table under the given options and return the median timings."""
+    current = get_table_options(connection, relation)
+    clause = fdw_options_clause(current, {**BASELINE_OPTIONS, **options})
+    scans = []
+    with connection.cursor() as cursor:
+        try:
+            if clause:
+                cursor.execute(f"ALTER FOREIGN TABLE {relation} {clause}")
+            for _ in range(runs):
+                scans.append(explain_analyze(cursor, f"SELECT * FROM {relation}"))
+            filtered = explain_analyze(cursor, f"SELECT * FROM {relation} WHERE {filter_sql}")
+        finally:
+            connection.rollback()
+
+    execution_ms = statistics.median(scan['execution_ms'] for scan in scans)
+    rows = scans[-1]['rows']
+    return {
+        'options': options,
+        'execution_ms': execution_ms,
+        'rows': rows,
+        'rows_per_second': rows / max(execution_ms / 1000, 0.001),
+        'filtered_estimated_rows': filtered['estimated_rows'],
+        'filtered_rows': filtered['rows'],
+        'filtered_planning_ms': filtered['planning_ms']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark postgres_fdw options on foreign tables.")
+    parser.add_argument('--tables', nargs='+', default=['indexer.donations'], help="Foreign tables (schema.name)")
+    parser.add_argument('--runs', type=int, default=3, help="Full scans per setting")
+    parser.add_argument('--filter', default='chain_id = 10', help="Predicate of the estimate check")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(**DB_PARAMS)
+    results = {}
+    try:
+        for relation in args.tables:
+            schema, table = relation.split('.', 1)
+            config = CONFIGS.get(schema)
+            settings = dict(SETTINGS)
+            if config is not None:
+                settings['configured'] = {**config.server_options, **config.table_options.get(table, {})}
+            results[relation] = {}
+            for name, options in settings.items():
+                result = benchmark_setting(connection, relation, options, args.runs, args.filter)
+                results[relation][name] = result
+                logger.info(
+                    f"{relation} [{name}]: {result['execution_ms']:.0f} ms, "
+                    f"{result['rows_per_second']:.0f} rows/s, filtered estimate "
+                    f"{result['filtered_estimated_rows']} vs. {result['filtered_rows']} rows"
+                )
+    finally:
+        connection.close()
+
+    print(f"{'table':<24}{'setting':<22}{'ms':>10}{'rows/s':>14}{'speedup':>10}{'estimate':>12}{'actual':>10}")
+    for relation, settings in results.items():
+        baseline_ms = settings['default']['execution_ms']
+        for name, result in settings.items():
+            print(
+                f"{relation:<24}{name:<22}{result['execution_ms']:>10.0f}{result['rows_per_second']:>14.0f}"
+                f"{baseline_ms / max(result['execution_ms'], 0.001):>9.2f}x"
+                f"{result['filtered_estimated_rows']:>12}{result['filtered_rows']:>10}"
+            )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
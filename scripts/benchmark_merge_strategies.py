@@ -0,0 +1,134 @@
+"""Compare the merge strategies used to build the base materialized views.
+
+For every base view, each strategy's merge query is executed with
+EXPLAIN (ANALYZE, BUFFERS) a few times and the median execution time, peak
+sort/hash memory and temp blocks written are reported. With --check the
+strategies are also compared row for row.
+
+Usage:
+    python scripts/benchmark_merge_strategies.py --views donations applications --runs 3 --check
+
+Runs against the Grants database configured through DB_HOST, DB_PORT,
+DB_USER and DB_PASSWORD, e.g. a database filled by scripts/synthetic_indexer.py.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'automations'))
+
+from update_materialized_views import (  # noqa: E402
+    BASE_MATVIEWS, build_merge_query, get_connection
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ['window', 'anti_join']
+
+
+def walk_plan(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk_plan(child)
+
+
+def explain_analyze(connection, query: str) -> dict:
+    """Run a query under EXPLAIN ANALYZE and summarize its plan."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}")
+        result = cursor.fetchone()[0]
+    connection.rollback()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]
+    nodes = list(walk_plan(plan['Plan']))
+    return {
+        'execution_ms': plan['Execution Time'],
+        'rows': plan['Plan'].get('Actual Rows'),
+        'peak_memory_kb': max(
+            [node.get('Peak Memory Usage', 0) for node in nodes]
+            + [node.get('Sort Space Used', 0) for node in nodes if node.get('Sort Space Type') == 'Memory']
+        ),
+        'temp_blocks_written': plan['Plan'].get('Temp Written Blocks', 0),
+        'node_types': sorted({node['Node Type'] for node in nodes})
+    }
+
+
+def count_differences(connection, first_query: str, second_query: str) -> int:
+    """Return the number of rows that appear in only one of the two query results."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT COUNT(*) FROM (
+            (({first_query}) EXCEPT ALL ({second_query}))
+            UNION ALL
+            (({second_query}) EXCEPT ALL ({first_query}))
+        ) differences
+        """)
+        differences = cursor.fetchone()[0]
+    connection.rollback()
+    return differences
+
+
+def benchmark_view(connection, matview: str, runs: int, check: bool) -> dict:
+    config = BASE_MATVIEWS[matview]
+    queries = {
+        strategy: build_merge_query(matview, dict(config, merge_strategy=strategy))
+        for strategy in STRATEGIES
+    }
+
+    results = {}
+    for strategy, query in queries.items():
+        samples = [explain_analyze(connection, query) for _ in range(runs)]
+        result = samples[-1]
+        result['execution_ms'] = statistics.median(sample['execution_ms'] for sample in samples)
+        results[strategy] = result
+        logger.info(
+            f"{matview} [{strategy}]: {result['execution_ms']:.0f} ms median over {runs} runs, "
+            f"{result['rows']} rows, peak memory {result['peak_memory_kb']} kB, "
+            f"{result['temp_blocks_written']} temp blocks written"
+        )
+
+    if check:
+        differences = count_differences(connection, queries['window'], queries['anti_join'])
+        results['differences'] = differences
+        if differences:
+            logger.error(f"{matview}: strategies disagree on {differences} rows")
+        else:
+            logger.info(f"{matview}: strategies return identical rows")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the base view merge strategies.")
+    parser.add_argument(
+        '--views',
+        nargs='+',
+        default=[matview for matview, config in BASE_MATVIEWS.items() if config.get('refresh_type') != 'dune'],
+        help="Base views to benchmark"
+    )
+    parser.add_argument('--runs', type=int, default=3, help="Executions per strategy")
+    parser.add_argument('--check', action='store_true', help="Also verify both strategies return the same rows")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        results = {matview: benchmark_view(connection, matview, args.runs, args.check) for matview in args.views}
+    finally:
+        connection.close()
+
+    print(f"{'view':<24}{'window ms':>12}{'anti_join ms':>14}{'speedup':>10}")
+    for matview, result in results.items():
+        window_ms = result['window']['execution_ms']
+        anti_join_ms = result['anti_join']['execution_ms']
+        print(f"{matview:<24}{window_ms:>12.0f}{anti_join_ms:>14.0f}{window_ms / max(anti_join_ms, 0.001):>9.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Measure the scaling and accuracy of the MinHash LSH near-duplicate stage.
+
+For every size a synthetic set of project titles is generated: titles
+built from a word list, about half of them resubmitted with a small edit
+(a typo, a dropped or added word, a round suffix). The stages of
+near_duplicates are timed separately, and the time per value should stay
+roughly flat as the size grows. Up to --exact-max-rows distinct values,
+the exact Jaccard similarity of every pair is also computed, to report
+the recall and precision of the similar pairs found through LSH.
+
+Usage:
+    python scripts/benchmark_near_duplicates.py --rows 10000 100000 1000000 3000000
+
+Needs no database.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'automations'))
+
+from near_duplicates import (  # noqa: E402
+    BANDS, NUM_PERM, SHINGLE_SIZE, SIMILARITY_THRESHOLD, candidate_pairs, estimated_similarities, minhash_signatures
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+WORDS = [
+    'open', 'source', 'public', 'goods', 'ethereum', 'protocol', 'dao', 'network', 'climate', 'solar', 'data',
+    'labs', 'wallet', 'privacy', 'zero', 'knowledge', 'education', 'community', 'builders', 'grants', 'impact',
+    'regen', 'music', 'art', 'collective', 'foundation', 'layer', 'bridge', 'oracle', 'identity', 'dev', 'tools'
+]
+
+
+def generate_titles(rows: int, seed: int = 22) -> pd.Series:
+    """Return titles of which about half are small edits of an earlier one."""
+    rng = np.random.default_rng(seed)
+    originals = rows - rows // 2
+    lengths = rng.integers(2, 6, originals)
+    words = rng.choice(WORDS, lengths.sum())
+    ids = rng.integers(0, 10**6, originals)
+    titles = []
+    start = 0
+    for length, project in zip(lengths.tolist(), ids.tolist()):
+        titles.append(' '.join(words[start:start + length]) + f" {project}")
+        start += length
+    for base, edit in zip(rng.integers(0, originals, rows // 2).tolist(), rng.integers(0, 4, rows // 2).tolist()):
+        title = titles[base]
+        if edit == 0:
+            position = int(rng.integers(0, len(title)))
+            title = title[:position] + title[position + 1:]
+        elif edit == 1:
+            title = title + ' v2'
+        elif edit == 2:
+            title = title + ' ' + str(rng.choice(WORDS))
+        else:
+            title = title.replace(' ', '', 1)
+        titles.append(title)
+    return pd.Series(titles, dtype=object)
+
+
+def shingle_set(value: str, shingle_size: int) -> set:
+    value = value.ljust(shingle_size)
+    return {value[i:i + shingle_size] for i in range(len(value) - shingle_size + 1)}
+
+
+def exact_similar_pairs(values: list, threshold: float, shingle_size: int) -> set:
+    """All pairs of values with an exact shingle Jaccard similarity of at least threshold."""
+    shingles = [shingle_set(value, shingle_size) for value in values]
+    pairs = set()
+    for first in range(len(values)):
+        for second in range(first + 1, len(values)):
+            union = len(shingles[first] | shingles[second])
+            if union and len(shingles[first] & shingles[second]) / union >= threshold:
+                pairs.add((first, second))
+    return pairs
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the near-duplicate title stage.")
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000, 1000000], help="Numbers of titles")
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument('--num-perm', type=int, default=NUM_PERM)
+    parser.add_argument('--bands', type=int, default=BANDS)
+    parser.add_argument('--exact-max-rows', type=int, default=3000, help="Largest input compared with the exact all-pairs similarity")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        values = list(pd.unique(generate_titles(rows)))
+        signatures, minhash_seconds = timed(minhash_signatures, values, args.num_perm, SHINGLE_SIZE)
+        pairs, candidate_seconds = timed(candidate_pairs, signatures, args.bands)
+        similarities, verify_seconds = timed(estimated_similarities, signatures, pairs)
+        similar = pairs[similarities >= args.threshold]
+        seconds = minhash_seconds + candidate_seconds + verify_seconds
+        result = {
+            'rows': rows, 'distinct': len(values), 'candidates': len(pairs), 'similar': len(similar),
+            'minhash_seconds': minhash_seconds, 'candidate_seconds': candidate_seconds,
+            'verify_seconds': verify_seconds, 'microseconds_per_value': seconds / len(values) * 1e6,
+            'recall': None, 'precision': None
+        }
+        if len(values) <= args.exact_max_rows:
+            exact = exact_similar_pairs(values, args.threshold, SHINGLE_SIZE)
+            found = set(map(tuple, similar.tolist()))
+            result['recall'] = len(exact & found) / len(exact) if exact else 1.0
+            result['precision'] = len(exact & found) / len(found) if found else 1.0
+        results.append(result)
+        logger.info(f"{rows} titles: {len(pairs)} candidates, {len(similar)} similar in {seconds:.2f}s")
+
+    print(f"{'rows':>10}{'distinct':>10}{'candidates':>12}{'similar':>10}{'minhash s':>11}{'lsh s':>8}{'verify s':>10}{'us/value':>10}{'recall':>8}{'precision':>11}")
+    for result in results:
+        print(
+            f"{result['rows']:>10}{result['distinct']:>10}{result['candidates']:>12}{result['similar']:>10}"
+            f"{result['minhash_seconds']:>11.2f}{result['candidate_seconds']:>8.2f}{result['verify_seconds']:>10.2f}"
+            f"{result['microseconds_per_value']:>10.1f}"
+            f"{result['recall'] if result['recall'] is not None else float('nan'):>8.3f}"
+            f"{result['precision'] if result['precision'] is not None else float('nan'):>11.3f}"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Compare the pairwise and attribute-combination project grouping.
+
+For every size a synthetic set of applications is generated in which
+projects reapply with partly changed attributes, a few payout addresses
+are shared by many unrelated projects, and some titles are generic. The
+groups are computed with the original scheme, which counts the shared
+attributes of every pair and takes the connected components with
+networkx, and with project_grouping.assign_group_ids. Both must assign
+identical group ids. The pairwise scheme is only timed up to
+--legacy-max-rows; it needs networkx, which the automations no longer
+depend on.
+
+Usage:
+    python scripts/benchmark_project_grouping.py --rows 10000 100000 1000000
+
+Needs no database.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'automations'))
+
+from project_grouping import GROUPING_ATTRIBUTES, assign_group_ids  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def generate_applications(rows: int, seed: int = 20) -> pd.DataFrame:
+    """Return cleaned applications, about three per project, with shared and missing values."""
+    rng = np.random.default_rng(seed)
+    projects = rng.integers(0, max(rows // 3, 1), rows)
+
+    def attribute(prefix, changed, missing, shared=None, shared_values=0):
+        values = pd.Series([f"{prefix}{project}" for project in projects], dtype=object)
+        changes = rng.random(rows) < changed
+        values[changes] = [f"{prefix}{project}v{version}" for project, version in zip(projects[changes], rng.integers(0, 3, changes.sum()))]
+        if shared:
+            popular = rng.random(rows) < shared
+            values[popular] = [f"{prefix}popular{i}" for i in rng.integers(0, shared_values, popular.sum())]
+        values[rng.random(rows) < missing] = None
+        return values
+
+    return pd.DataFrame({
+        'title': attribute('title', 0.2, 0.0, shared=0.02, shared_values=3),
+        'website': attribute('https://site', 0.2, 0.3),
+        'payout_address': attribute('0xaddress', 0.1, 0.0, shared=0.05, shared_values=5),
+        'project_twitter': attribute('twitter', 0.1, 0.4),
+        'project_github': attribute('github', 0.1, 0.5)
+    })
+
+
+def legacy_group_ids(data: pd.DataFrame, min_shared_attributes: int) -> np.ndarray:
+    """The original pairwise scheme."""
+    import networkx as nx
+
+    G = nx.Graph()
+    for i in data.index:
+        G.add_node(i)
+    shared_attributes_counter = defaultdict(int)
+    for attribute in GROUPING_ATTRIBUTES:
+        attribute_data = data.dropna(subset=[attribute])
+        for _, group in attribute_data.groupby(attribute):
+            for i1, i2 in itertools.combinations(group.index, 2):
+                shared_attributes_counter[tuple(sorted((i1, i2)))] += 1
+    for pair, count in shared_attributes_counter.items():
+        if count >= min_shared_attributes:
+            G.add_edge(*pair)
+    group_ids = pd.Series(0, index=data.index)
+    for group_id, component in enumerate(nx.connected_components(G)):
+        group_ids.loc[list(component)] = group_id
+    return group_ids.to_numpy()
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark project grouping.")
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000, 1000000], help="Numbers of applications")
+    parser.add_argument('--min-shared-attributes', nargs='+', type=int, default=[3], help="Thresholds to compare")
+    parser.add_argument('--legacy-max-rows', type=int, default=20000, help="Largest input the pairwise scheme is timed on")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        data = generate_applications(rows)
+        for min_shared_attributes in args.min_shared_attributes:
+            group_ids, seconds = timed(assign_group_ids, data, min_shared_attributes)
+            result = {
+                'rows': rows, 'min_shared_attributes': min_shared_attributes,
+                'groups': int(group_ids.max()) + 1, 'seconds': seconds, 'legacy_seconds': None
+            }
+            if rows <= args.legacy_max_rows:
+                legacy, result['legacy_seconds'] = timed(legacy_group_ids, data, min_shared_attributes)
+                if not np.array_equal(legacy, group_ids):
+                    raise AssertionError(
+                        f"Group ids differ from the pairwise ones at {rows} rows, threshold {min_shared_attributes}"
+                    )
+            results.append(result)
+            logger.info(f"{rows} rows, threshold {min_shared_attributes}: {result['groups']} groups in {seconds:.2f}s")
+
+    print(f"{'rows':>10}{'threshold':>11}{'groups':>10}{'pairwise s':>12}{'grouped s':>11}{'speedup':>10}")
+    for result in results:
+        legacy = result['legacy_seconds']
+        print(
+            f"{result['rows']:>10}{result['min_shared_attributes']:>11}{result['groups']:>10}"
+            f"{legacy if legacy is not None else float('nan'):>12.2f}{result['seconds']:>11.2f}"
+            f"{(legacy / max(result['seconds'], 0.001)) if legacy is not None else float('nan'):>9.1f}x"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
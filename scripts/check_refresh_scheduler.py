@@ -0,0 +1,73 @@
+"""Check that critical-path priorities decide the order refresh steps start in.
+
+A small DAG is run with sleeping steps on two workers: a base view with
+an expensive chain of dependent views behind it, and many cheap index
+and stats steps that are ready from the start. Once the base view
+finishes, its dependent view has the longest remaining path, so it must
+start before the cheap steps that have been ready (and waiting) since
+the beginning, and the whole run must take about as long as the critical
+path rather than the critical path plus the cheap steps.
+
+Usage:
+    python scripts/check_refresh_scheduler.py
+
+Needs no database.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'automations'))
+
+from refresh_scheduler import critical_path_costs, run_dag  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Seconds every step sleeps for
+STEP_SECONDS = {'base': 0.2, 'dependent': 0.5, 'leaderboard': 0.5}
+CHEAP_STEPS = [f"index_{number}" for number in range(8)]
+CHEAP_SECONDS = 0.1
+
+
+class DummyConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def main():
+    dependencies = {'base': [], 'dependent': ['base'], 'leaderboard': ['dependent']}
+    dependencies.update({step: [] for step in CHEAP_STEPS})
+    costs = dict(STEP_SECONDS, **{step: CHEAP_SECONDS for step in CHEAP_STEPS})
+    priorities = critical_path_costs(dependencies, costs)
+
+    started = []
+    lock = threading.Lock()
+
+    def task(step):
+        def run(connection):
+            with lock:
+                started.append(step)
+            time.sleep(costs[step])
+        return run
+
+    start_time = time.time()
+    run_dag({step: task(step) for step in dependencies}, dependencies, DummyConnection, max_workers=2, priorities=priorities)
+    seconds = time.time() - start_time
+
+    critical_path = max(priorities.values())
+    later_cheap = [step for step in CHEAP_STEPS if started.index(step) > started.index('dependent')]
+    print(f"Start order: {', '.join(started)}")
+    print(f"Finished in {seconds:.2f}s, critical path {critical_path:.2f}s")
+    if not later_cheap:
+        raise AssertionError("The dependent view did not start before the cheap steps that were ready earlier")
+    if seconds > critical_path + 0.15:
+        raise AssertionError(f"The run took {seconds:.2f}s, longer than its critical path of {critical_path:.2f}s")
+    print("OK: the critical path started first whenever a worker was free")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Local stand-in for the Dune results API.
+
+Serves a synthetic leaderboard result (see benchmark_event_signatures.py)
+through the two endpoints the refresh uses, with the same pagination as
+Dune: GET /query/{id}/results and GET /execution/{id}/results, both with
+limit, offset and a "tx_timestamp > '...'" or ">= '...'" filter, answering with
+next_uri/next_offset until the last page. Every --new-execution-every
+requests to /query/{id}/results, a new execution with --growth more rows
+is published, to exercise the cache and incremental ingestion.
+
+Usage:
+    python scripts/dune_api_stub.py --rows 1000000 --port 8765
+    DUNE_API_URL=http://localhost:8765/api/v1 DUNE_API_KEY=stub python automations/refresh_dune_table.py
+
+Needs no database.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_event_signatures import generate_events  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+FILTER_PATTERN = re.compile(r"^\s*tx_timestamp\s*(>=?)\s*'((?:[^']|'')*)'\s*$")
+
+
+class StubResults:
+    """The published executions of the stubbed query."""
+
+    def __init__(self, rows: int, growth: int, new_execution_every: int):
+        # Later executions add the newest events
+        events = generate_events(rows + growth * 100).drop(columns=['row_number']).sort_values('tx_timestamp')
+        self.events = events.to_dict('records')
+        self.random = random.Random(1)
+        self.rows = rows
+        self.growth = growth
+        self.new_execution_every = new_execution_every
+        self.executions = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.publish()
+
+    def publish(self) -> str:
+        execution_id = f"01STUB{len(self.executions):06d}"
+        rows = self.events[:self.rows + self.growth * len(self.executions)]
+        # Dune returns the rows unsorted
+        self.random.shuffle(rows)
+        self.executions[execution_id] = rows
+        self.latest = execution_id
+        logger.info(f"Published execution {execution_id} with {len(rows)} rows")
+        return execution_id
+
+    def latest_execution(self) -> str:
+        with self.lock:
+            self.requests += 1
+            if self.new_execution_every and self.requests % self.new_execution_every == 0:
+                self.publish()
+            return self.latest
+
+    def page(self, base_url: str, execution_id: str, query: dict) -> dict:
+        rows = self.executions[execution_id]
+        filters = query.get('filters', [None])[0]
+        if filters:
+            match = FILTER_PATTERN.match(filters)
+            if not match:
+                raise ValueError(f"Unsupported filter: {filters}")
+            since = match.group(2).replace("''", "'")
+            if match.group(1) == '>=':
+                rows = [row for row in rows if row['tx_timestamp'] >= since]
+            else:
+                rows = [row for row in rows if row['tx_timestamp'] > since]
+        limit = int(query.get('limit', [len(rows) or 1])[0])
+        offset = int(query.get('offset', [0])[0])
+        page = {
+            'execution_id': execution_id,
+            'state': 'QUERY_STATE_COMPLETED',
+            'result': {'rows': rows[offset:offset + limit], 'metadata': {'total_row_count': len(rows)}}
+        }
+        if offset + limit < len(rows):
+            next_query = {'limit': limit, 'offset': offset + limit}
+            if filters:
+                next_query['filters'] = filters
+            page['next_offset'] = offset + limit
+            page['next_uri'] = f"{base_url}/execution/{execution_id}/results?{urlencode(next_query)}"
+        return page
+
+
+def make_handler(results: StubResults, base_path: str):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            base_url = f"http://{self.headers['Host']}{base_path}"
+            query_match = re.fullmatch(rf"{base_path}/query/\d+/results", url.path)
+            execution_match = re.fullmatch(rf"{base_path}/execution/(\w+)/results", url.path)
+            try:
+                if query_match:
+                    body = results.page(base_url, results.latest_execution(), query)
+                elif execution_match and execution_match.group(1) in results.executions:
+                    body = results.page(base_url, execution_match.group(1), query)
+                else:
+                    self.send_error(404)
+                    return
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            payload = json.dumps(body, default=str).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Dune result over a local HTTP API.")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows of the first execution")
+    parser.add_argument('--growth', type=int, default=1000, help="Rows added by every new execution")
+    parser.add_argument('--new-execution-every', type=int, default=0, help="Publish a new execution every N latest-result requests (0: never)")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    results = StubResults(args.rows, args.growth, args.new_execution_every)
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(results, '/api/v1'))
+    logger.info(f"Serving the Dune API stub on http://localhost:{args.port}/api/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,651 @@
+"""Generate a synthetic, indexer-shaped dataset in a local Postgres and benchmark the refresh.
+
+The generator creates the tables that update_materialized_views.py reads:
+
+- an indexer source database with chain_data_{version}.rounds, applications
+  (with realistic metadata JSONB), donations, applications_payouts and
+  round_roles, exposed in the Grants database as the indexer.* foreign tables
+  through a loopback postgres_fdw server named indexer
+- a MACI source database with rounds, contributions and round_roles, exposed
+  as maci.* through a loopback server named maci
+- the static tier (static_indexer_chain_data_75.*), static_donations,
+  static_matching, the experimental_views reference tables and a
+  placeholder allov2_distribution_events_for_leaderboard
+
+Data is generated server-side with generate_series, so large scale factors
+do not go through Python. Scale factor 1 is roughly 100k donations.
+
+Usage:
+    python scripts/synthetic_indexer.py --scale 1 --benchmark
+
+Connection settings come from DB_HOST, DB_PORT, DB_USER and DB_PASSWORD, the
+same variables the automations use. Point them at a local server, never at
+the production database: the Grants database is recreated from scratch.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import psycopg2
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rows generated per unit of scale factor
+BASE_ROW_COUNTS = {
+    'rounds': 200,
+    'applications': 5000,
+    'donations': 100000,
+    'applications_payouts': 2000,
+    'round_roles': 1000,
+    'maci_rounds': 20,
+    'maci_contributions': 10000,
+    'dune_events': 5000
+}
+
+CHAIN_IDS = [1, 10, 137, 250, 324, 424, 8453, 42161, 43114, 534352, 11155111]
+
+INDEXER_TABLES = """
+CREATE TABLE {schema}.rounds (
+    id text NOT NULL,
+    chain_id integer NOT NULL,
+    tags text[],
+    match_amount numeric(78,0),
+    match_token_address text,
+    match_amount_in_usd real,
+    funded_amount numeric(78,0),
+    funded_amount_in_usd real,
+    application_metadata_cid text,
+    application_metadata jsonb,
+    round_metadata_cid text,
+    round_metadata jsonb,
+    applications_start_time timestamptz,
+    applications_end_time timestamptz,
+    donations_start_time timestamptz,
+    donations_end_time timestamptz,
+    created_by_address text,
+    created_at_block numeric(78,0),
+    updated_at_block numeric(78,0),
+    manager_role text,
+    admin_role text,
+    strategy_address text,
+    strategy_id text,
+    strategy_name text,
+    matching_distribution jsonb,
+    ready_for_payout_transaction text,
+    project_id text,
+    total_amount_donated_in_usd real,
+    total_donations_count integer,
+    unique_donors_count integer,
+    PRIMARY KEY (id, chain_id)
+);
+CREATE TABLE {schema}.applications (
+    id text NOT NULL,
+    chain_id integer NOT NULL,
+    round_id text NOT NULL,
+    project_id text,
+    anchor_address text,
+    status text,
+    status_snapshots jsonb,
+    distribution_transaction text,
+    metadata_cid text,
+    metadata jsonb,
+    created_by_address text,
+    created_at_block numeric(78,0),
+    status_updated_at_block numeric(78,0),
+    total_donations_count integer,
+    total_amount_donated_in_usd real,
+    unique_donors_count integer,
+    tags text[],
+    PRIMARY KEY (chain_id, round_id, id)
+);
+CREATE TABLE {schema}.donations (
+    id text PRIMARY KEY,
+    chain_id integer NOT NULL,
+    round_id text NOT NULL,
+    application_id text NOT NULL,
+    donor_address text NOT NULL,
+    recipient_address text NOT NULL,
+    project_id text NOT NULL,
+    transaction_hash text NOT NULL,
+    block_number numeric(78,0) NOT NULL,
+    token_address text NOT NULL,
+    amount numeric(78,0) NOT NULL,
+    amount_in_usd real NOT NULL,
+    amount_in_round_match_token numeric(78,0) NOT NULL,
+    timestamp timestamptz
+);
+CREATE TABLE {schema}.applications_payouts (
+    id text PRIMARY KEY,
+    chain_id integer NOT NULL,
+    application_id text NOT NULL,
+    round_id text NOT NULL,
+    amount numeric(78,0) NOT NULL,
+    token_address text NOT NULL,
+    amount_in_usd real NOT NULL,
+    amount_in_round_match_token numeric(78,0) NOT NULL,
+    transaction_hash text NOT NULL,
+    sender text NOT NULL,
+    timestamp timestamptz
+);
+CREATE TABLE {schema}.round_roles (
+    chain_id integer NOT NULL,
+    round_id text NOT NULL,
+    address text NOT NULL,
+    role text NOT NULL,
+    created_at_block numeric(78,0),
+    PRIMARY KEY (chain_id, round_id, address, role)
+);
+"""
+
+MACI_TABLES = """
+CREATE TABLE {schema}.rounds (
+    id text NOT NULL,
+    chain_id integer NOT NULL,
+    round_metadata jsonb,
+    strategy_name text,
+    created_at_block numeric(78,0),
+    PRIMARY KEY (id, chain_id)
+);
+CREATE TABLE {schema}.contributions (
+    id text PRIMARY KEY,
+    chain_id integer NOT NULL,
+    round_id text NOT NULL,
+    contributor_address text NOT NULL,
+    voice_credit_balance numeric NOT NULL,
+    transaction_hash text NOT NULL,
+    timestamp timestamptz
+);
+CREATE TABLE {schema}.round_roles (
+    chain_id integer NOT NULL,
+    round_id text NOT NULL,
+    address text NOT NULL,
+    role text NOT NULL,
+    PRIMARY KEY (chain_id, round_id, address, role)
+);
+"""
+
+# Data is spread over CHAIN_IDS; round ids are shared by applications,
+# donations and payouts so that the joins in the dependent views match.
+INDEXER_DATA = """
+INSERT INTO {schema}.rounds
+SELECT
+    '0x' || lpad(to_hex(g), 40, '0') AS id,
+    (ARRAY{chains})[1 + g % {chain_count}] AS chain_id,
+    ARRAY['allo-v2'],
+    (1000 + g % 50) * 1000000000000000000::numeric,
+    '0x0000000000000000000000000000000000000000',
+    (1000 + g % 50) * 10,
+    (1000 + g % 50) * 1000000000000000000::numeric,
+    (1000 + g % 50) * 10,
+    'bafy' || md5(g::text),
+    jsonb_build_object('version', '1.0.0'),
+    'bafy' || md5('r' || g),
+    jsonb_build_object('name', 'Synthetic Round ' || g, 'roundType', 'public',
+                       'eligibility', jsonb_build_object('description', repeat('eligible ', 5))),
+    now() - (g % 700) * interval '1 day' - interval '30 days',
+    now() - (g % 700) * interval '1 day' - interval '20 days',
+    now() - (g % 700) * interval '1 day' - interval '14 days',
+    now() - (g % 700) * interval '1 day',
+    '0x' || md5('creator' || g % 37),
+    10000000 + g * 100,
+    10000000 + g * 100 + g % 7,
+    '0x' || md5('manager' || g),
+    '0x' || md5('admin' || g),
+    '0x' || md5('strategy' || g),
+    'allov2.DonationVotingMerkleDistributionDirectTransferStrategy',
+    CASE WHEN g % 3 = 0 THEN 'allov1.QF' ELSE 'allov2.DonationVotingMerkleDistributionDirectTransferStrategy' END,
+    CASE WHEN g % 2 = 0 THEN jsonb_build_object(
+        'blockTimestamp', to_char(now() - (g % 700) * interval '1 day', 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"'),
+        'matchingDistribution', (
+            SELECT jsonb_agg(jsonb_build_object(
+                'projectId', '0x' || md5('project' || (g * 25 + a) % {applications}),
+                'projectName', 'Project ' || (g * 25 + a) % {applications},
+                'applicationId', a::text,
+                'contributionsCount', a * 3,
+                'matchAmountInToken', (a * 1000000000000000)::text,
+                'matchPoolPercentage', 0.04,
+                'projectPayoutAddress', '0x' || md5('payout' || (g * 25 + a) % {applications}),
+                'originalMatchAmountInToken', (a * 1000000000000000)::text
+            ))
+            FROM generate_series(0, 24) a
+        )
+    ) END,
+    NULL,
+    '0x' || md5('round-project' || g),
+    0,
+    0,
+    0
+FROM generate_series(1, {rounds}) g;
+
+INSERT INTO {schema}.applications
+SELECT
+    (g / {rounds})::text AS id,
+    r.chain_id,
+    r.id AS round_id,
+    '0x' || md5('project' || g % ({applications} / 2 + 1)),
+    '0x' || md5('anchor' || g),
+    (ARRAY['APPROVED', 'APPROVED', 'APPROVED', 'PENDING', 'REJECTED'])[1 + g % 5],
+    jsonb_build_array(jsonb_build_object('status', 'PENDING', 'updatedAtBlock', 10000000 + g)),
+    CASE WHEN g % 4 = 0 THEN '0x' || md5('distribution' || g) END,
+    'bafy' || md5('application' || g),
+    jsonb_build_object(
+        'signature', '0x' || md5('signature' || g),
+        'application', jsonb_build_object(
+            'round', r.id,
+            'recipient', '0x' || substr(md5('payout' || g % ({applications} / 2 + 1)), 1, 40),
+            'answers', jsonb_build_array(
+                jsonb_build_object('question', 'Email', 'answer', 'team' || g || '@example.org'),
+                jsonb_build_object('question', 'Describe your impact', 'answer', repeat('impact ', 40))
+            ),
+            'project', jsonb_build_object(
+                'id', '0x' || md5('project' || g % ({applications} / 2 + 1)),
+                'title', 'Project ' || g % ({applications} / 2 + 1),
+                'website', 'https://project' || g % ({applications} / 2 + 1) || '.example.org',
+                'description', repeat('A synthetic public goods project. ', 20),
+                'projectTwitter', 'project' || g % ({applications} / 2 + 1),
+                'projectGithub', CASE WHEN g % 3 = 0 THEN 'https://github.com/project' || g % 997 END,
+                'createdAt', (extract(epoch FROM now() - (g % 700) * interval '1 day') * 1000)::bigint,
+                'logoImg', 'bafy' || md5('logo' || g)
+            )
+        )
+    ),
+    '0x' || md5('creator' || g),
+    10000000 + g * 10,
+    10000000 + g * 10 + g % 13,
+    0,
+    0,
+    0,
+    ARRAY['allo-v2']
+FROM generate_series(0, {applications} - 1) g
+JOIN (
+    SELECT id, chain_id, row_number() OVER (ORDER BY id) - 1 AS n FROM {schema}.rounds
+) r ON r.n = g % {rounds};
+
+INSERT INTO {schema}.donations
+SELECT
+    '0x' || md5('donation' || g) AS id,
+    a.chain_id,
+    a.round_id,
+    a.id,
+    '0x' || substr(md5('donor' || (g::bigint * 7919) % ({donations} / 5 + 1)), 1, 40),
+    a.metadata #>> '{{application, recipient}}',
+    a.project_id,
+    '0x' || md5('tx' || g / 3),
+    20000000 + g,
+    '0x0000000000000000000000000000000000000000',
+    (g % 100 + 1) * 1000000000000000::numeric,
+    (g % 100 + 1) * 0.5,
+    (g % 100 + 1) * 1000000000000000::numeric,
+    now() - (g % 700) * interval '1 day'
+FROM generate_series(0, {donations} - 1) g
+JOIN (
+    SELECT id, chain_id, round_id, project_id, metadata,
+           row_number() OVER (ORDER BY chain_id, round_id, id) - 1 AS n
+    FROM {schema}.applications
+) a ON a.n = g % {applications};
+
+UPDATE {schema}.applications a
+SET total_donations_count = d.donation_count,
+    total_amount_donated_in_usd = d.amount_in_usd,
+    unique_donors_count = d.donor_count
+FROM (
+    SELECT chain_id, round_id, application_id,
+           COUNT(*) AS donation_count, SUM(amount_in_usd) AS amount_in_usd,
+           COUNT(DISTINCT donor_address) AS donor_count
+    FROM {schema}.donations
+    GROUP BY 1, 2, 3
+) d
+WHERE d.chain_id = a.chain_id AND d.round_id = a.round_id AND d.application_id = a.id;
+
+UPDATE {schema}.rounds r
+SET total_donations_count = d.donation_count,
+    total_amount_donated_in_usd = d.amount_in_usd,
+    unique_donors_count = d.donor_count
+FROM (
+    SELECT chain_id, round_id,
+           COUNT(*) AS donation_count, SUM(amount_in_usd) AS amount_in_usd,
+           COUNT(DISTINCT donor_address) AS donor_count
+    FROM {schema}.donations
+    GROUP BY 1, 2
+) d
+WHERE d.chain_id = r.chain_id AND d.round_id = r.id;
+
+INSERT INTO {schema}.applications_payouts
+SELECT
+    'payout-' || g,
+    a.chain_id,
+    a.id,
+    a.round_id,
+    (g % 50 + 1) * 1000000000000000000::numeric,
+    '0x0000000000000000000000000000000000000000',
+    (g % 50 + 1) * 25,
+    (g % 50 + 1) * 1000000000000000000::numeric,
+    '0x' || md5('payout-tx' || g),
+    '0x' || md5('sender' || g % 11),
+    now() - (g % 700) * interval '1 day'
+FROM generate_series(0, {applications_payouts} - 1) g
+JOIN (
+    SELECT id, chain_id, round_id, row_number() OVER (ORDER BY chain_id, round_id, id) - 1 AS n
+    FROM {schema}.applications
+) a ON a.n = (g * 13) % {applications};
+
+INSERT INTO {schema}.round_roles
+SELECT DISTINCT ON (r.chain_id, r.id, address, role)
+    r.chain_id,
+    r.id,
+    '0x' || substr(md5('operator' || g % ({round_roles} / 2 + 1)), 1, 40) AS address,
+    CASE WHEN g % 4 = 0 THEN 'admin' ELSE 'manager' END AS role,
+    10000000 + g
+FROM generate_series(0, {round_roles} - 1) g
+JOIN (
+    SELECT id, chain_id, row_number() OVER (ORDER BY id) - 1 AS n FROM {schema}.rounds
+) r ON r.n = g % {rounds};
+"""
+
+MACI_DATA = """
+INSERT INTO {schema}.rounds
+SELECT
+    '0x' || lpad(to_hex(1000000 + g), 40, '0'),
+    (ARRAY[10, 42161, 534352])[1 + g % 3],
+    jsonb_build_object('name', 'Synthetic MACI Round ' || g),
+    'allov2.MACIQF',
+    30000000 + g
+FROM generate_series(1, {maci_rounds}) g;
+
+INSERT INTO {schema}.contributions
+SELECT
+    'contribution-' || g,
+    r.chain_id,
+    r.id,
+    '0x' || substr(md5('maci-donor' || g % ({maci_contributions} / 4 + 1)), 1, 40),
+    (g % 20 + 1) * 100000,
+    '0x' || md5('maci-tx' || g),
+    now() - (g % 300) * interval '1 day'
+FROM generate_series(0, {maci_contributions} - 1) g
+JOIN (
+    SELECT id, chain_id, row_number() OVER (ORDER BY id) - 1 AS n FROM {schema}.rounds
+) r ON r.n = g % {maci_rounds};
+
+INSERT INTO {schema}.round_roles
+SELECT chain_id, id, '0x' || substr(md5('maci-operator' || id), 1, 40), 'admin'
+FROM {schema}.rounds;
+"""
+
+# Reference data that lives in the Grants database itself
+GRANTS_DATA = """
+CREATE SCHEMA IF NOT EXISTS experimental_views;
+CREATE SCHEMA IF NOT EXISTS static_indexer_chain_data_75;
+
+-- Static tier: a snapshot of the older half of every indexer table, with
+-- stale amounts so that the merge visibly prefers the indexer copy, plus
+-- rows that only exist in the static tier
+CREATE TABLE static_indexer_chain_data_75.rounds AS
+SELECT * FROM indexer.rounds WHERE created_at_block < 10000000 + {rounds} * 50;
+CREATE TABLE static_indexer_chain_data_75.applications AS
+SELECT * FROM indexer.applications WHERE created_at_block < 10000000 + {applications} * 5;
+CREATE TABLE static_indexer_chain_data_75.donations AS
+SELECT * FROM indexer.donations WHERE block_number < 20000000 + {donations} / 2;
+UPDATE static_indexer_chain_data_75.donations SET amount_in_usd = amount_in_usd / 2;
+INSERT INTO static_indexer_chain_data_75.donations
+SELECT '0x' || md5('static-donation' || id), chain_id, round_id, application_id, donor_address,
+       recipient_address, project_id, transaction_hash, block_number, token_address, amount,
+       amount_in_usd, amount_in_round_match_token, timestamp
+FROM indexer.donations WHERE block_number < 20000000 + {donations} / 10;
+CREATE TABLE static_indexer_chain_data_75.applications_payouts AS
+SELECT * FROM indexer.applications_payouts WHERE split_part(id, '-', 2)::int < {applications_payouts} / 2;
+CREATE TABLE static_indexer_chain_data_75.round_roles AS
+SELECT * FROM indexer.round_roles WHERE created_at_block < 10000000 + {round_roles} / 2;
+
+CREATE TABLE experimental_views.all_rounds_20241029131838 AS
+SELECT
+    (row_number() OVER (ORDER BY id))::int AS round_number,
+    'Program Round' AS type,
+    'chain-' || chain_id AS chain_name,
+    chain_id,
+    round_metadata #>> '{{name}}' AS round_name,
+    id AS round_id
+FROM indexer.rounds;
+
+CREATE TABLE experimental_views.ens_names_allo_donors_20241022231136 AS
+SELECT DISTINCT donor_address AS address, substr(donor_address, 3, 8) || '.eth' AS name
+FROM indexer.donations
+WHERE block_number % 10 = 0;
+
+CREATE TABLE public.static_donations AS
+SELECT
+    1 AS round_num,
+    'cGrants Round 1' AS round_name,
+    '0x' || md5('cgrants-donor' || g % 1000) AS donor_address,
+    (g % 100)::numeric AS amount_in_usd,
+    '0x' || md5('cgrants-recipient' || g % 300) AS recipient_address,
+    now() - interval '1000 days' + (g % 30) * interval '1 day' AS timestamp,
+    'cGrants Project ' || g % 300 AS project_name,
+    (g % 300)::text AS project_id,
+    'cgrants-round-1' AS round_id,
+    1 AS chain_id,
+    'cGrants' AS source
+FROM generate_series(1, {donations} / 10) g;
+
+CREATE TABLE public.static_matching AS
+SELECT
+    1 AS round_num,
+    'cGrants Project ' || g AS title,
+    (g * 10)::numeric AS match_amount_usd,
+    '0x' || md5('cgrants-recipient' || g) AS payoutaddress,
+    g::text AS project_id,
+    'cgrants-round-1' AS round_id,
+    1 AS chain_id,
+    now() - interval '1000 days' AS timestamp
+FROM generate_series(1, 300) g;
+
+-- Stand-in for the Dune leaderboard view so allo_gmv_leaderboard_events can
+-- be built without a Dune API key
+CREATE MATERIALIZED VIEW public.allov2_distribution_events_for_leaderboard AS
+SELECT
+    (ARRAY['arbitrum', 'optimism', 'base', 'ethereum'])[1 + g % 4] AS blockchain,
+    to_char(now() - (g % 400) * interval '1 day', 'YYYY-MM-DD HH24:MI:SS.MS "UTC"') AS tx_timestamp,
+    '0x' || md5('dune-tx' || g / 3) AS tx_hash,
+    '0x' || substr(md5('dune-address' || g % 500), 1, 40) AS address,
+    (ARRAY['DirectAllocationStrategy', 'DirectGrantsLiteStrategy'])[1 + g % 2] AS strategy_name,
+    (ARRAY['grantee', 'round_operator', 'contract_dev'])[1 + g % 3] AS role,
+    (g % 1000) / 10.0 AS gmv,
+    g AS row_number,
+    encode(sha256(('dune' || g)::bytea), 'hex') AS event_signature
+FROM generate_series(1, {dune_events}) g;
+"""
+
+
+def connect(dbname: str, autocommit: bool = False):
+    connection = psycopg2.connect(
+        host=os.environ.get('DB_HOST', 'localhost'),
+        port=os.environ.get('DB_PORT', '5432'),
+        user=os.environ.get('DB_USER', 'postgres'),
+        password=os.environ.get('DB_PASSWORD', ''),
+        dbname=dbname
+    )
+    connection.autocommit = autocommit
+    return connection
+
+
+def recreate_database(dbname: str) -> None:
+    """Drop and recreate a database on the local server."""
+    connection = connect('postgres', autocommit=True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS "{dbname}" WITH (FORCE)')
+            cursor.execute(f'CREATE DATABASE "{dbname}"')
+    finally:
+        connection.close()
+
+
+def run_script(connection, label: str, sql: str) -> None:
+    start_time = time.time()
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+    connection.commit()
+    logger.info(f"{label} took {time.time() - start_time:.2f} seconds")
+
+
+def row_counts(scale: float) -> dict:
+    return {name: max(int(count * scale), 10) for name, count in BASE_ROW_COUNTS.items()}
+
+
+def load_schema_versions() -> dict:
+    with open(os.path.join(REPO_ROOT, 'schema_versions.json'), 'r') as f:
+        return json.load(f)
+
+
+def create_source(connection, schema: str, tables_sql: str, data_sql: str, counts: dict, label: str) -> None:
+    chains = list(CHAIN_IDS)
+    run_script(connection, f"Creating {label} tables", f"CREATE SCHEMA IF NOT EXISTS {schema};" + tables_sql.format(schema=schema))
+    run_script(connection, f"Generating {label} data", data_sql.format(
+        schema=schema,
+        chains=chains,
+        chain_count=len(chains),
+        **counts
+    ))
+    run_script(connection, f"Analyzing {label} tables", "ANALYZE;")
+
+
+def link_source(grants, server: str, dbname: str, remote_schema: str, tables: list) -> None:
+    """Expose a source database in the Grants database through a loopback postgres_fdw server."""
+    host = os.environ.get('DB_HOST', 'localhost')
+    port = os.environ.get('DB_PORT', '5432')
+    user = os.environ.get('DB_USER', 'postgres')
+    password = os.environ.get('DB_PASSWORD', '')
+    run_script(grants, f"Linking {server} server", f"""
+    CREATE EXTENSION IF NOT EXISTS postgres_fdw;
+    CREATE SERVER {server} FOREIGN DATA WRAPPER postgres_fdw
+        OPTIONS (host '{host}', dbname '{dbname}', port '{port}');
+    CREATE USER MAPPING FOR CURRENT_USER SERVER {server}
+        OPTIONS (user '{user}', password '{password}');
+    CREATE SCHEMA {server};
+    IMPORT FOREIGN SCHEMA {remote_schema} LIMIT TO ({', '.join(tables)})
+        FROM SERVER {server} INTO {server} OPTIONS (import_default 'false');
+    """)
+
+
+def ensure_digest(grants) -> None:
+    """Install pgcrypto, or a sha256-only digest() with the same signature where it is unavailable."""
+    try:
+        run_script(grants, "Installing pgcrypto", "CREATE EXTENSION IF NOT EXISTS pgcrypto;")
+    except psycopg2.Error as e:
+        grants.rollback()
+        logger.warning(f"pgcrypto is not available, using a sha256-only digest(): {e}")
+        run_script(grants, "Creating digest() fallback", """
+        CREATE FUNCTION public.digest(data text, type text) RETURNS bytea
+        LANGUAGE sql IMMUTABLE STRICT
+        AS $$ SELECT CASE WHEN lower(type) = 'sha256' THEN sha256(convert_to(data, 'UTF8')) END $$;
+        """)
+
+
+def generate(scale: float, indexer_dbname: str, maci_dbname: str, local_sources: bool = False) -> None:
+    """Recreate the Grants database and its synthetic sources."""
+    counts = row_counts(scale)
+    logger.info(f"Generating synthetic dataset at scale {scale}: {counts}")
+    versions = load_schema_versions()
+    indexer_schema = f"chain_data_{versions['indexer']['version']}"
+    maci_schema = f"chain_data_{versions['maci']['version']}"
+
+    recreate_database('Grants')
+    grants = connect('Grants')
+    if local_sources:
+        # Without postgres_fdw, the indexer and maci schemas hold plain local tables
+        create_source(grants, 'indexer', INDEXER_TABLES, INDEXER_DATA, counts, 'indexer')
+        create_source(grants, 'maci', MACI_TABLES, MACI_DATA, counts, 'MACI')
+    else:
+        for dbname, schema, tables_sql, data_sql, label in [
+            (indexer_dbname, indexer_schema, INDEXER_TABLES, INDEXER_DATA, 'indexer'),
+            (maci_dbname, maci_schema, MACI_TABLES, MACI_DATA, 'MACI')
+        ]:
+            recreate_database(dbname)
+            source = connect(dbname)
+            try:
+                create_source(source, schema, tables_sql, data_sql, counts, label)
+            finally:
+                source.close()
+        link_source(grants, 'indexer', indexer_dbname, indexer_schema,
+                    ['rounds', 'applications', 'donations', 'applications_payouts', 'round_roles'])
+        link_source(grants, 'maci', maci_dbname, maci_schema, ['rounds', 'contributions', 'round_roles'])
+
+    ensure_digest(grants)
+    run_script(grants, "Creating Grants reference data", GRANTS_DATA.format(**counts))
+    run_script(grants, "Analyzing Grants tables", "ANALYZE;")
+    grants.close()
+
+
+def benchmark(runs: int, workers: int) -> None:
+    """Run the full refresh pipeline against the synthetic Grants database."""
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'automations'))
+    os.chdir(REPO_ROOT)
+    import update_materialized_views as refresh
+
+    views = [
+        matview for matview, config in refresh.BASE_MATVIEWS.items()
+        if config.get('refresh_type') != 'dune'
+    ]
+    timings = []
+    for run in range(1, runs + 1):
+        connection = refresh.get_connection()
+        start_time = time.time()
+        try:
+            refresh.refresh_materialized_views(connection, max_workers=workers, views=views, force=True)
+        finally:
+            connection.close()
+        timings.append(time.time() - start_time)
+        logger.info(f"Refresh run {run} took {timings[-1]:.2f} seconds")
+    logger.info(f"Refresh timings (seconds): {', '.join(f'{t:.2f}' for t in timings)}")
+
+    # Per-step breakdown of the last run, from the run history table
+    connection = refresh.get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+            SELECT step, duration_seconds, rows, pg_size_pretty(relation_bytes)
+            FROM public.refresh_runs
+            WHERE run_id = (
+                SELECT run_id FROM public.refresh_runs
+                WHERE script = 'update_materialized_views'
+                ORDER BY started_at DESC LIMIT 1
+            )
+            ORDER BY duration_seconds DESC
+            LIMIT 15
+            """)
+            print(f"{'step':<48}{'seconds':>10}{'rows':>12}{'size':>12}")
+            for step, seconds, rows, size in cursor.fetchall():
+                print(f"{step:<48}{seconds:>10.2f}{rows if rows is not None else '':>12}{size or '':>12}")
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=float, default=1.0, help="Scale factor, 1 is roughly 100k donations")
+    parser.add_argument('--indexer-dbname', default='synthetic_indexer', help="Database for the indexer source tables")
+    parser.add_argument('--maci-dbname', default='synthetic_maci', help="Database for the MACI source tables")
+    parser.add_argument('--local-sources', action='store_true',
+                        help="Create indexer.* and maci.* as local tables instead of postgres_fdw foreign tables")
+    parser.add_argument('--skip-generate', action='store_true', help="Reuse the existing synthetic databases")
+    parser.add_argument('--benchmark', action='store_true', help="Run the refresh pipeline end to end after generating")
+    parser.add_argument('--runs', type=int, default=1, help="Number of benchmark refresh runs")
+    parser.add_argument('--workers', type=int, default=4, help="Worker connections for the refresh")
+    args = parser.parse_args()
+
+    host = os.environ.get('DB_HOST', 'localhost')
+    if host not in ('localhost', '127.0.0.1', '::1') and not host.startswith('/'):
+        raise ValueError(f"Refusing to recreate the Grants database on non-local host {host}")
+
+    if not args.skip_generate:
+        generate(args.scale, args.indexer_dbname, args.maci_dbname, args.local_sources)
+    if args.benchmark:
+        benchmark(args.runs, args.workers)
+
+
+if __name__ == '__main__':
+    main()